@@ -0,0 +1,369 @@
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import os
+import tempfile
+from wgm_util import gfx9, WorkGroupMapping, simulatorVersion, cachePolicies
+
+# (M, N, K, MT0, MT1, DU, WGM): the two __main__ configs plus small-tile variants that fill the MALL
+shapes = [
+    (128, 106496, 8192*2, 64, 512, 512, 16),
+    (128, 106496, 8192*2, 128, 512, 512, 32),
+    (128, 106496, 8192*2, 64, 256, 256, 16),
+    (128, 106496, 8192*2, 32, 128, 128, 16),
+]
+
+def legacyHitRates(wgm):
+    # The dict + min() LRU scan getHitRates used before CacheLevel, kept only as a timing baseline
+    numRequests = 0
+    l2Hits = 0
+    mallHits = 0
+    hbmHits = 0
+    L2 = dict()
+    L2Usage = dict()
+    MALL = dict()
+    MALLUsage = 0
+    for xcd in range(wgm.GPU.numXCDs):
+        L2[xcd] = dict()
+        L2Usage[xcd] = 0
+    numWorkGroups = wgm.MOverMT0*wgm.NOverMT1
+    workGroupsPerWave = wgm.GPU.numCUs*wgm.workGroupsPerCU
+    clk = 0
+    for firstWG in range(0, numWorkGroups, workGroupsPerWave):
+        for kSlice in range(wgm.KOverDU):
+            for linearWG in range(firstWG, min(firstWG + workGroupsPerWave, numWorkGroups)):
+                wg = wgm.workGroups[(linearWG%wgm.MOverMT0, linearWG//wgm.MOverMT0)]
+                for tile in ('A(%d,%d)'%(wg.new_m, kSlice), 'B(%d,%d)'%(kSlice, wg.new_n)):
+                    numRequests += 1
+                    if tile not in L2[wg.xcd].keys():
+                        if L2Usage[wg.xcd] + wgm.ATileBytes >= wgm.GPU.L2BytesPerXCD:
+                            L2[wg.xcd].pop(min(L2[wg.xcd], key=L2[wg.xcd].get), None)
+                            L2Usage[wg.xcd] -= wgm.ATileBytes
+                        L2[wg.xcd].update({tile: clk})
+                        L2Usage[wg.xcd] += wgm.ATileBytes
+                        if tile not in MALL.keys():
+                            if MALLUsage + wgm.ATileBytes >= wgm.GPU.MALLBytes:
+                                MALL.pop(min(MALL, key=MALL.get), None)
+                                MALLUsage -= wgm.ATileBytes
+                            MALL.update({tile: clk})
+                            MALLUsage += wgm.ATileBytes
+                            hbmHits += 1
+                        else:
+                            MALL[tile] = clk
+                            mallHits += 1
+                    else:
+                        L2[wg.xcd][tile] = clk
+                        l2Hits += 1
+                    clk += 1
+    return l2Hits/numRequests, mallHits/numRequests, hbmHits/numRequests
+
+# Multi-wave shapes for checking getHitRatesSampled against the exact engine, on top of the regression corpus. The last
+# ones have enough waves for the sampler to run rather than fall back to the exact engine
+samplingShapes = [
+    (16384, 16384, 4096, 128, 128, 256, 8),
+    (16384, 8192, 2048, 64, 128, 256, 16),
+    (32768, 32768, 1024, 256, 256, 256, 4),
+    (128, 1064960, 8192, 64, 128, 512, 16),
+    (8192, 57344, 4096, 256, 256, 256, 16),
+    (32768, 32768, 2048, 128, 128, 256, 8),
+    (65536, 16384, 1024, 128, 128, 256, 16),
+    (65536, 32768, 1024, 256, 128, 256, 8),
+    (256, 4194304, 2048, 128, 128, 256, 16),
+]
+
+def validateSampling(targetError=0.01, seed=0):
+    # Reports, per corpus case and sampling shape, the sampled estimate's error against the exact engine and whether the
+    # exact value lies in the CI. Returns the cases whose CI misses it
+    gpu = gfx9()
+    worst = 0.0
+    misses = []
+    cases = [case[1:] for case in corpus] + [shape + (1,) for shape in samplingShapes]
+    for M, N, K, MT0, MT1, DU, WGM, workGroupsPerCU in cases:
+        wgm = WorkGroupMapping(M=M, N=N, K=K, MT0=MT0, MT1=MT1, DU=DU, WGM=WGM, GPU=gpu, workGroupsPerCU=workGroupsPerCU, verbose=False)
+        exactTime, exact = timeIt(wgm.getHitRates, False)
+        sampledTime, sampled = timeIt(wgm.getHitRatesSampled, targetError, None, 1, 8, 0.95, seed)
+        errors = [abs(a - b) for a, b in zip(exact, sampled.estimates)]
+        covered = all(lo - 1e-12 <= value <= hi + 1e-12 for value, (lo, hi) in zip(exact, sampled.confidenceIntervals))
+        worst = max(worst, max(errors))
+        name = '%dx%dx%d MT %dx%dx%d WGM %d'%(M, N, K, MT0, MT1, DU, WGM)
+        if not covered:
+            misses.append(name)
+        print('%s: exact %.3fs sampled %.3fs (%d/%d waves, %.2f of trace)'%(name, exactTime, sampledTime, sampled.sampledWaves, sampled.numWaves, sampled.simulatedFraction))
+        print('    exact   (l2,mall,hbm) (%.4f, %.4f, %.4f)'%exact)
+        print('    sampled (l2,mall,hbm) (%.4f, %.4f, %.4f) +- (%.4f, %.4f, %.4f); max error %.4f; exact inside CI: %r'%(sampled.estimates + sampled.halfWidths + (max(errors), covered)))
+    print('worst absolute error %.4f'%worst)
+    return misses
+
+def timeIt(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return time.perf_counter() - start, out
+
+def benchmarkCacheEngine():
+    gpu = gfx9()
+    for M, N, K, MT0, MT1, DU, WGM in shapes:
+        wgm = WorkGroupMapping(M=M, N=N, K=K, MT0=MT0, MT1=MT1, DU=DU, WGM=WGM, GPU=gpu)
+        numRequests = 2*wgm.MOverMT0*wgm.NOverMT1*wgm.KOverDU
+        legacyTime, legacyRates = timeIt(legacyHitRates, wgm)
+        newTime, newRates = timeIt(wgm.getHitRates, False)
+        print('%dx%dx%d MT %dx%dx%d WGM %d: %d requests; legacy %.3fs; CacheLevel %.3fs; speedup %.1fx'%(M, N, K, MT0, MT1, DU, WGM, numRequests, legacyTime, newTime, legacyTime/newTime))
+        print('    legacy (l2,mall,hbm) %s'%(legacyRates,))
+        print('    new    (l2,mall,hbm) %s'%(newRates,))
+
+# Regression corpus: (name, M, N, K, MT0, MT1, DU, WGM, workGroupsPerCU). The __main__ configs, square LLM GEMMs,
+# skinny decode GEMMs (one tile row) and grids that end in a partial wave (tiles not a multiple of numCUs*workGroupsPerCU)
+corpus = [
+    ('main-64x512', 128, 106496, 8192*2, 64, 512, 512, 16, 1),
+    ('main-128x512', 128, 106496, 8192*2, 128, 512, 512, 32, 1),
+    ('square-4k', 4096, 4096, 4096, 256, 256, 256, 8, 1),
+    ('square-8k', 8192, 8192, 8192, 256, 256, 256, 8, 1),
+    ('square-16k', 16384, 16384, 16384, 256, 256, 256, 8, 1),
+    ('llm-mlp-up', 8192, 28672, 8192, 256, 256, 256, 16, 1),
+    ('decode-qkv', 64, 12288, 8192, 64, 256, 256, 16, 1),
+    ('decode-down', 64, 8192, 28672, 64, 128, 512, 8, 1),
+    ('partial-304', 4864, 4096, 4096, 256, 256, 256, 8, 1),
+    ('partial-2perCU', 5120, 5120, 2048, 128, 256, 256, 8, 2),
+]
+
+def peakMemory(fn, *args):
+    # Peak bytes Python allocates while fn runs (NumPy buffers included), traced on a run of its own
+    tracemalloc.start()
+    try:
+        out = fn(*args)
+        return tracemalloc.get_traced_memory()[1], out
+    finally:
+        tracemalloc.stop()
+
+def measureCase(M, N, K, MT0, MT1, DU, WGM, workGroupsPerCU, repeats=3):
+    # Best-of-repeats seconds and peak memory of construction, getHitRates and getHitRatesFast, each on a fresh
+    # WorkGroupMapping (results are cached per instance), plus the hit rates both return
+    gpu = gfx9()
+
+    def construct():
+        return WorkGroupMapping(M=M, N=N, K=K, MT0=MT0, MT1=MT1, DU=DU, WGM=WGM, workGroupsPerCU=workGroupsPerCU, GPU=gpu)
+
+    row = {'construct': float('inf'), 'getHitRates': float('inf'), 'getHitRatesFast': float('inf')}
+    for _ in range(repeats):
+        seconds, wgm = timeIt(construct)
+        row['construct'] = min(row['construct'], seconds)
+        seconds, hitRates = timeIt(wgm.getHitRates)
+        row['getHitRates'] = min(row['getHitRates'], seconds)
+        seconds, fastHitRates = timeIt(construct().getHitRatesFast)
+        row['getHitRatesFast'] = min(row['getHitRatesFast'], seconds)
+    row['numRequests'] = len(wgm.trace)
+    row['requestsPerSecond'] = row['numRequests']/row['getHitRates']
+    row['constructPeakBytes'], wgm = peakMemory(construct)
+    row['getHitRatesPeakBytes'], _ = peakMemory(wgm.getHitRates)
+    row['getHitRatesFastPeakBytes'], _ = peakMemory(construct().getHitRatesFast)
+    row['levelRequests'] = wgm.result.levelRequests
+    row['hitRates'] = list(hitRates)
+    row['fastHitRates'] = list(fastHitRates)
+    return row
+
+def runCorpus(names=None, repeats=3):
+    cases = dict()
+    for name, *shape in corpus:
+        if names and name not in names:
+            continue
+        row = cases[name] = measureCase(*shape, repeats=repeats)
+        print('%-15s %8d requests %10.0f req/s  construct %8.2f ms  getHitRates %8.2f ms  getHitRatesFast %8.2f ms  peak %6.1f/%6.1f/%6.1f MiB'%(
+            name, row['numRequests'], row['requestsPerSecond'], row['construct']*1e3, row['getHitRates']*1e3, row['getHitRatesFast']*1e3,
+            row['constructPeakBytes']/2**20, row['getHitRatesPeakBytes']/2**20, row['getHitRatesFastPeakBytes']/2**20))
+    return {'simulatorVersion': simulatorVersion, 'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.platform(), 'processor': platform.processor(), 'cases': cases}
+
+# Machine-independent results, committed in bench_golden.json, and the machine-specific timings and peaks kept in
+# the local baseline
+goldenFields = ('numRequests', 'levelRequests', 'hitRates', 'fastHitRates')
+timingFields = ('construct', 'getHitRates', 'getHitRatesFast', 'requestsPerSecond', 'constructPeakBytes', 'getHitRatesPeakBytes', 'getHitRatesFastPeakBytes')
+
+def compareGolden(current, golden, tolerance=1e-9):
+    # Failures of current against the golden results: request or per-level counts differing at all, or a
+    # getHitRatesFast rate moving by more than tolerance
+    failures = list()
+    for name, row in current['cases'].items():
+        known = golden['cases'].get(name)
+        if known is None:
+            failures.append('%s: no golden results, add them with --update-golden'%name)
+            continue
+        if row['numRequests'] != known['numRequests'] or row['levelRequests'] != known['levelRequests']:
+            failures.append('%s: %d requests served (l2,mall,hbm) %s, golden %d requests %s'%(name, row['numRequests'], row['levelRequests'], known['numRequests'], known['levelRequests']))
+        change = max(abs(a - b) for a, b in zip(row['fastHitRates'], known['fastHitRates']))
+        if change > tolerance:
+            failures.append('%s: getHitRatesFast changed by %.3g, (%.6f, %.6f, %.6f) -> (%.6f, %.6f, %.6f)'%(name, change, *known['fastHitRates'], *row['fastHitRates']))
+    if current['simulatorVersion'] != golden['simulatorVersion'] and failures:
+        print('note: simulatorVersion %d -> %d, result changes may be intended (rerun with --update-golden)'%(golden['simulatorVersion'], current['simulatorVersion']))
+    return failures
+
+def compareBaseline(current, baseline, maxSlowdown=0.25, maxMemoryGrowth=0.25, timeSlack=0.002):
+    # Failures of current against the local baseline: throughput falling or a time growing by more than maxSlowdown
+    # (times within timeSlack seconds are noise), or a peak growing by more than maxMemoryGrowth. Timings only
+    # compare meaningfully on the machine that wrote the baseline.
+    failures = list()
+    if current['machine'] != baseline['machine']:
+        print('warning: baseline from %s, running on %s; timings may not compare'%(baseline['machine'], current['machine']))
+    for name, row in current['cases'].items():
+        known = baseline['cases'].get(name)
+        if known is None:
+            print('%s: not in the baseline'%name)
+            continue
+        if row['requestsPerSecond'] < known['requestsPerSecond']*(1 - maxSlowdown) and row['getHitRates'] - known['getHitRates'] > timeSlack:
+            failures.append('%s: %.0f req/s, baseline %.0f req/s'%(name, row['requestsPerSecond'], known['requestsPerSecond']))
+        for key in ('construct', 'getHitRatesFast'):
+            if row[key] > known[key]*(1 + maxSlowdown) + timeSlack:
+                failures.append('%s: %s takes %.4fs, baseline %.4fs'%(name, key, row[key], known[key]))
+        for key in ('constructPeakBytes', 'getHitRatesPeakBytes', 'getHitRatesFastPeakBytes'):
+            if row[key] > known[key]*(1 + maxMemoryGrowth):
+                failures.append('%s: %s %.1f MiB, baseline %.1f MiB'%(name, key, row[key]/2**20, known[key]/2**20))
+    return failures
+
+def writeResults(path, current, fields, previous=None, machine=True):
+    # Writes the given fields of current's cases, keeping the other cases of previous (from a --cases run), and the
+    # machine description only with machine
+    results = {key: value for key, value in current.items() if key != 'cases' and (machine or key == 'simulatorVersion')}
+    results['cases'] = dict(previous['cases']) if previous is not None else dict()
+    results['cases'].update({name: {field: row[field] for field in fields} for name, row in current['cases'].items()})
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=1, sort_keys=True)
+        file.write('\n')
+
+def loadResults(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+def runRegression(args):
+    # Measures the corpus and checks its results against the committed golden file and its timings and peaks against
+    # the local baseline, exiting with status 1 on any failure. --update-golden and --update rewrite them instead;
+    # a missing local baseline is written, but the results are still checked.
+    names = args.cases.split(',') if args.cases else None
+    current = runCorpus(names, args.repeats)
+    golden = loadResults(args.golden)
+    baseline = loadResults(args.baseline)
+    failures = list()
+    if args.update_golden:
+        writeResults(args.golden, current, goldenFields, golden, machine=False)
+        print('golden results written to %s'%args.golden)
+    elif golden is None:
+        failures.append('no golden results in %s'%args.golden)
+    else:
+        failures += compareGolden(current, golden, args.tolerance)
+    if args.update or baseline is None:
+        writeResults(args.baseline, current, timingFields, baseline)
+        print('timing baseline written to %s%s'%(args.baseline, '' if args.update else ', timings not checked'))
+    else:
+        failures += compareBaseline(current, baseline, args.max_slowdown, args.max_memory_growth)
+    for failure in failures:
+        print('REGRESSION %s'%failure)
+    if failures:
+        sys.exit(1)
+    print('no regressions against %s and %s'%(args.golden, args.baseline))
+
+def legacyHitRatesFast(wgm):
+    # The list scan getHitRatesFast used before FootprintProfile, kept as its reference
+    l2Hits = 0
+    mallHits = 0
+    hbmHits = 0
+    l2ARows = {xcd: list() for xcd in range(wgm.GPU.numXCDs)}
+    l2BCols = {xcd: list() for xcd in range(wgm.GPU.numXCDs)}
+    mallARows = list()
+    mallBCols = list()
+    for wg in wgm.workGroups.values():
+        for value, l2Seen, mallSeen in ((wg.new_m, l2ARows[wg.xcd], mallARows), (wg.new_n, l2BCols[wg.xcd], mallBCols)):
+            if value in l2Seen:
+                l2Hits += 1
+            else:
+                l2Seen.append(value)
+                if value in mallSeen:
+                    mallHits += 1
+                else:
+                    mallSeen.append(value)
+                    hbmHits += 1
+    numRequests = 2*len(wgm.workGroups)
+    return l2Hits/numRequests, mallHits/numRequests, hbmHits/numRequests
+
+def checkEngines(M, N, K, MT0, MT1, DU, WGM, workGroupsPerCU, workers=None):
+    # Failures of the engine equivalences the faster engines are built on: for every replacement policy the serial,
+    # parallel and steady-state (without wave extrapolation) engines serve every request from the same level; the
+    # stack-distance profile gives LRU's hit rates; getHitRatesFast equals the list scan; the event-driven trace
+    # without jitter is the lockstep trace; and a trace file replays to the same result
+    gpu = gfx9()
+    wgm = WorkGroupMapping(M=M, N=N, K=K, MT0=MT0, MT1=MT1, DU=DU, WGM=WGM, workGroupsPerCU=workGroupsPerCU, GPU=gpu)
+    failures = list()
+    for policy in cachePolicies:
+        serial = wgm.simulate(policy=policy).levels
+        for engine, levels in (('parallel', wgm.simulate(policy=policy, engine='parallel', workers=workers).levels),
+                               ('steady', wgm.simulateSteadyState(policy=policy, extrapolateWaves=False).levels)):
+            if not np.array_equal(levels, serial):
+                failures.append("%s: engine '%s' differs from 'serial' on %d requests"%(policy, engine, np.count_nonzero(levels != serial)))
+    lru = wgm.simulate(policy='lru').hitRates()
+    profile = wgm.getReuseProfile().hitRates(gpu.L2BytesPerXCD, gpu.MALLBytes)
+    if max(abs(a - b) for a, b in zip(profile, lru)) > 1e-12:
+        failures.append('getReuseProfile().hitRates %s differs from LRU getHitRates %s'%(profile, lru))
+    fast = wgm.getHitRatesFast()
+    legacy = legacyHitRatesFast(wgm)
+    if max(abs(a - b) for a, b in zip(fast, legacy)) > 1e-12:
+        failures.append('getHitRatesFast %s differs from the list scan %s'%(fast, legacy))
+    event = wgm.getEventTrace(jitter=0.0)
+    trace = wgm.trace
+    for field in ('xcd', 'operand', 'tileID', 'numBytes', 'wg', 'kSlice'):
+        if not np.array_equal(getattr(event, field), getattr(trace, field)):
+            failures.append('getEventTrace(jitter=0) differs from trace in %s'%field)
+    from wgm_trace import TraceFile
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'corpus.trace')
+        wgm.exportTrace(path)
+        replayed = TraceFile(path).simulate(gpu)
+    if replayed.levelRequests != wgm.result.levelRequests or replayed.levelBytes != wgm.result.levelBytes:
+        failures.append('TraceFile.simulate %s differs from result %s'%(replayed.levelRequests, wgm.result.levelRequests))
+    return failures
+
+def runEngineChecks(args):
+    failures = list()
+    for name, *shape in corpus:
+        if args.cases and name not in args.cases.split(','):
+            continue
+        seconds, caseFailures = timeIt(checkEngines, *shape, args.workers)
+        print('%-15s %s (%.1fs)'%(name, 'engines agree' if not caseFailures else '%d failures'%len(caseFailures), seconds))
+        failures += ['%s: %s'%(name, failure) for failure in caseFailures]
+    for failure in failures:
+        print('MISMATCH %s'%failure)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulator benchmarks')
+    parser.add_argument('--validate-sampling', action='store_true', help='compare getHitRatesSampled against the exact engine')
+    parser.add_argument('--target-error', type=float, default=0.01)
+    parser.add_argument('--regress', action='store_true', help='measure the regression corpus and check it against --golden and --baseline')
+    parser.add_argument('--check-engines', action='store_true', help='check that the engines agree on the regression corpus')
+    parser.add_argument('--golden', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_golden.json'), help='committed golden results')
+    parser.add_argument('--baseline', default='bench_baseline.json', help='local, machine-specific timings and peaks')
+    parser.add_argument('--update', action='store_true', help='overwrite the timing baseline with this run')
+    parser.add_argument('--update-golden', action='store_true', help='overwrite the golden results with this run')
+    parser.add_argument('--workers', type=int, default=None, help='processes of the parallel engine with --check-engines')
+    parser.add_argument('--cases', default=None, help='comma-separated corpus names (default: all)')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--max-slowdown', type=float, default=0.25, help='allowed fractional loss of throughput')
+    parser.add_argument('--max-memory-growth', type=float, default=0.25, help='allowed fractional growth of peak memory')
+    parser.add_argument('--tolerance', type=float, default=1e-9, help='allowed absolute change of the getHitRatesFast rates')
+    args = parser.parse_args()
+    if args.regress:
+        runRegression(args)
+    elif args.check_engines:
+        runEngineChecks(args)
+    elif args.validate_sampling:
+        misses = validateSampling(args.target_error)
+        for name in misses:
+            print('MISMATCH %s: the exact hit rates lie outside the sampled confidence interval'%name)
+        if misses:
+            sys.exit(1)
+    else:
+        benchmarkCacheEngine()
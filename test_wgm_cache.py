@@ -0,0 +1,58 @@
+from collections import OrderedDict
+import numpy as np
+import pytest
+from wgm_util import SetAssociativeCache, WorkGroupMapping, gfx9
+
+def referenceHits(numSets, numWays, policy, cache, setIndex, tags):
+    # One OrderedDict per set, least recently used (LRU) or oldest fill (FIFO) first
+    sets = [OrderedDict() for _ in range(int(cache.max() + 1)*numSets)]
+    hits = list()
+    for index, tag in zip((cache*numSets + setIndex).tolist(), tags.tolist()):
+        ways = sets[index]
+        hit = tag in ways
+        if hit and policy == 'lru':
+            ways.move_to_end(tag)
+        elif not hit:
+            if len(ways) == numWays:
+                ways.popitem(last=False)
+            ways[tag] = None
+        hits.append(hit)
+    return np.array(hits)
+
+@pytest.mark.parametrize('policy', ['lru', 'fifo'])
+def test_matches_per_set_reference(policy):
+    rng = np.random.default_rng(1)
+    numAccesses = 20000
+    cache = rng.integers(0, 2, numAccesses)
+    setIndex = rng.integers(0, 8, numAccesses)
+    # Few tags per set, so sets hit, miss and evict; runs of one tag exercise the repeat shortcut
+    tags = np.repeat(rng.integers(0, 6, numAccesses//4), 4)
+    expected = referenceHits(8, 4, policy, cache, setIndex, tags)
+    assert np.array_equal(SetAssociativeCache(2, 8, 4, policy).access(cache, setIndex, tags), expected)
+    # Batches continue the same state
+    split = SetAssociativeCache(2, 8, 4, policy)
+    halves = [split.access(cache[part], setIndex[part], tags[part]) for part in (slice(0, 7777), slice(7777, None))]
+    assert np.array_equal(np.concatenate(halves), expected)
+
+def test_rejects_other_policies():
+    with pytest.raises(ValueError):
+        SetAssociativeCache(1, 8, 4, 'plru')
+
+def test_sampled_sets_match_the_full_run():
+    wgm = WorkGroupMapping(M=2048, N=2048, K=1024, WGM=4, GPU=gfx9(L2Hash='linear'), MT0=128, MT1=256, DU=256, verbose=False)
+    full = wgm.simulateL2Sets()
+    sampled = wgm.simulateL2Sets(setSampleEvery=4)
+    assert np.array_equal(sampled.setMisses[:, ::4], full.setMisses[:, ::4])
+    assert np.array_equal(sampled.setConflicts[:, ::4], full.setConflicts[:, ::4])
+    assert not sampled.setMisses[:, 1::4].any()
+    assert np.array_equal(sampled.channelRequests, full.channelRequests)
+    assert sampled.lineRequests*4 == pytest.approx(full.lineRequests, rel=0.05)
+
+def test_size_guard_names_a_sampling_rate():
+    wgm = WorkGroupMapping(M=2048, N=2048, K=1024, WGM=4, GPU=gfx9(), MT0=128, MT1=256, DU=256, verbose=False)
+    # 196608 line requests
+    with pytest.raises(ValueError, match='setSampleEvery=4'):
+        wgm.simulateL2Sets(maxLineRequests=60000)
+    assert wgm.simulateL2Sets(maxLineRequests=60000, setSampleEvery=4).lineRequests <= 60000
+    with pytest.raises(ValueError):
+        wgm.simulateL2Sets(setSampleEvery=3)
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from wgm_util import AccessTrace, WorkDecomposition, WorkGroupMapping, gfx9
+
+shape = dict(M=2048, N=2048, K=4096, WGM=4, MT0=256, MT1=256, DU=256)
+
+def build(decomposition, GPU=None, **options):
+    return WorkGroupMapping(GPU=GPU or gfx9(), verbose=False, decomposition=decomposition, **dict(shape, **options))
+
+def coverage(work, numTiles, KOverDU):
+    # How many segments cover every (tile, kSlice)
+    covered = np.zeros((numTiles, KOverDU), dtype=np.int64)
+    for tile, kStart, length in zip(work.tile.tolist(), work.kStart.tolist(), work.length.tolist()):
+        covered[tile, kStart:kStart + length] += 1
+    return covered
+
+@pytest.mark.parametrize('kind, options', [('split-k', dict(splitK=3)), ('stream-k', dict(numWorkGroups=300))])
+def test_segments_cover_every_iteration_once(kind, options):
+    work = WorkDecomposition(kind, 64, 16, gfx9(), **options)
+    assert (coverage(work, 64, 16) == 1).all()
+    assert work.iterations.sum() == 64*16
+    assert np.array_equal(work.contributors, np.bincount(work.tile, minlength=64))
+
+def test_stream_k_balances_iterations():
+    work = WorkDecomposition('stream-k', 64, 16, gfx9(), numWorkGroups=300)
+    assert work.numWorkGroups == 300
+    assert work.iterations.max() - work.iterations.min() <= 1
+
+def test_split_k_rejects_more_splits_than_kslices():
+    with pytest.raises(ValueError):
+        WorkDecomposition('split-k', 4, 8, gfx9(), splitK=9)
+
+@pytest.mark.parametrize('kind, options', [('split-k', dict(splitK=4)), ('stream-k', dict())])
+def test_work_trace_requests(kind, options):
+    wgm = build(kind, **options)
+    trace = wgm.trace
+    reads = trace.operand != AccessTrace.C
+    # Every A and B tile of the data-parallel launch, once per (tile, kSlice)
+    dataParallel = build('data-parallel').trace
+    assert np.array_equal(np.sort(trace.tileID[reads]), np.sort(dataParallel.tileID))
+    # One partial write and one read back per segment that is not the last of its tile
+    partials = int(np.sum(wgm.work.contributors - 1))
+    assert np.count_nonzero(trace.write) == partials
+    assert np.count_nonzero(~reads & ~trace.write) == partials
+    assert np.array_equal(np.sort(trace.tileID[trace.write]), np.sort(trace.tileID[~reads & ~trace.write]))
+    assert np.array_equal(trace.clk, np.arange(len(trace)))
+
+@pytest.mark.parametrize('kind, options', [('split-k', dict(splitK=3, M=4096)), ('stream-k', dict(streamKWorkGroups=600))])
+def test_wave_selection_partitions_the_trace(kind, options):
+    wgm = build(kind, **options)
+    numWaves = -(-wgm.work.numWorkGroups//(wgm.GPU.numCUs*wgm.workGroupsPerCU))
+    assert numWaves > 1
+    parts = [wgm.getWorkTrace(wave, wave + 1) for wave in range(numWaves)]
+    for field in ('clk', 'tileID', 'xcd', 'wg', 'write'):
+        assert np.array_equal(np.concatenate([getattr(part, field) for part in parts]), getattr(wgm.trace, field))
+
+@pytest.mark.parametrize('kind, options', [('split-k', dict(splitK=4)), ('stream-k', dict())])
+def test_fast_hit_rates_are_unbounded_caches(kind, options):
+    unbounded = gfx9(L2BytesPerXCD=2**40, MALLBytes=2**42)
+    wgm = build(kind, GPU=unbounded, **options)
+    assert wgm.getHitRatesFast() == pytest.approx(wgm.simulate().hitRates())
+    with pytest.raises(ValueError):
+        wgm.getFootprints()
+
+def test_engines_agree_on_split_k():
+    wgm = build('split-k', splitK=4)
+    assert np.array_equal(wgm.simulate(engine='parallel', workers=1).levels, wgm.simulate().levels)
+    with pytest.raises(ValueError):
+        wgm.simulate(engine='steady')
@@ -0,0 +1,62 @@
+
+import numpy as np
+from wgm_util import gfx9
+from wgm_memo import ResultCache, resultKey
+
+def groupedWalk(width):
+    # Closures of one function that differ only in their captured width: launch IDs walk groups of width columns
+    # width tiles at a time along N
+    def walk(m, n, grid):
+        wg = n*grid.MOverMT0 + m
+        group, within = divmod(wg, width*grid.MOverMT0)
+        return within//width, group*width + within%width
+    return walk
+
+params = dict(M=4096, N=4096, K=2048, WGM=0, MT0=128, MT1=128, DU=256)
+
+def test_key_is_stable():
+    gpu = gfx9()
+    assert resultKey('simulate', gpu, **params) == resultKey('simulate', gfx9(), **dict(params))
+    assert resultKey('simulate', gpu, **params) != resultKey('simulate', gpu, **dict(params, K=4096))
+    assert resultKey('simulate', gpu, **params) != resultKey('getHitRatesFast', gpu, **params)
+    assert resultKey('simulate', gpu, **params) != resultKey('simulate', gfx9(MALLBytes=2**24), **params)
+
+def test_closures_of_one_function_do_not_collide(tmp_path):
+    gpu = gfx9()
+    narrow, wide = groupedWalk(1), groupedWalk(16)
+    assert resultKey('simulate', gpu, **dict(params, mapping=narrow)) != resultKey('simulate', gpu, **dict(params, mapping=wide))
+    cache = ResultCache(str(tmp_path/'results.db'))
+    first = cache.getHitRates(gpu, mapping=narrow, **params)
+    second = cache.getHitRates(gpu, mapping=wide, **params)
+    fresh = ResultCache(str(tmp_path/'fresh.db')).getHitRates(gpu, mapping=wide, **params)
+    assert second == fresh
+    assert first != second
+
+def test_same_remap_shares_a_key():
+    gpu = gfx9()
+    assert resultKey('simulate', gpu, **dict(params, mapping=groupedWalk(4))) == resultKey('simulate', gpu, **dict(params, mapping=groupedWalk(4)))
+
+def test_round_trip_through_disk(tmp_path):
+    gpu = gfx9()
+    path = str(tmp_path/'results.db')
+    stored = ResultCache(path).simulate(gpu, **params)
+    cache = ResultCache(path)
+    loaded = cache.simulate(gpu, **params)
+    assert cache.hits == 1 and cache.misses == 0
+    assert loaded.levelRequests == stored.levelRequests
+    assert np.allclose(loaded.levelBytes, stored.levelBytes)
+
+def test_memory_is_bounded_and_disk_evicts_least_recent(tmp_path):
+    cache = ResultCache(str(tmp_path/'results.db'), maxBytes=200, memoryEntries=2)
+    for index in range(5):
+        cache.put('key%d'%index, {'value': index})
+    assert list(cache.memory) == ['key3', 'key4']
+    assert cache.storedBytes == cache.db.execute('SELECT SUM(size) FROM results').fetchone()[0] <= 200
+    assert len(cache) == 5
+    cache.put('big', {'value': 'x'*150})
+    assert cache.storedBytes <= 200
+    assert cache.get('key0') is None
+    assert cache.get('big') == {'value': 'x'*150}
+    # Replacing a row counts its size once
+    cache.put('big', {'value': 'y'*150})
+    assert cache.storedBytes == cache.db.execute('SELECT SUM(size) FROM results').fetchone()[0]
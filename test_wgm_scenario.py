@@ -0,0 +1,42 @@
+import pytest
+from wgm_util import WorkGroupMapping, gfx9
+from wgm_scenario import Scenario
+
+def kernel(GPU, M=2048, N=4096, K=2048, **options):
+    return WorkGroupMapping(M=M, N=N, K=K, WGM=4, GPU=GPU, MT0=256, MT1=256, DU=256, verbose=False, **options)
+
+def test_single_kernel_matches_its_own_simulation():
+    gpu = gfx9()
+    wgm = kernel(gpu)
+    result = Scenario(gpu).add(wgm, name='gemm').run()
+    assert result['gemm'].levelRequests == wgm.simulate().levelRequests
+    assert result.total.levelRequests == result['gemm'].levelRequests
+    assert result.start[0] == 0.0 and result.end[0] > 0.0
+
+def test_shared_tensor_saves_hbm_traffic():
+    gpu = gfx9()
+    private = Scenario(gpu).add(kernel(gpu), name='q').add(kernel(gpu), name='k').run()
+    shared = Scenario(gpu).add(kernel(gpu), name='q', A='x').add(kernel(gpu), name='k', A='x').run()
+    assert shared.total.numRequests == private.total.numRequests
+    assert shared.total.hbmBytes < private.total.hbmBytes
+
+def test_after_launches_follow_their_predecessor():
+    gpu = gfx9()
+    result = Scenario(gpu, flushL2=True).add(kernel(gpu), name='first').add(kernel(gpu), name='second', launch='after').run()
+    assert result.start[1] >= result.end[0]
+    assert 'second' in result.report()
+
+def test_rejects_invalid_kernels():
+    gpu = gfx9()
+    scenario = Scenario(gpu)
+    with pytest.raises(ValueError):
+        scenario.add(kernel(gpu), launch='after')
+    scenario.add(kernel(gpu), name='gemm', A='x')
+    with pytest.raises(ValueError):
+        scenario.add(kernel(gpu), name='gemm')
+    with pytest.raises(ValueError):
+        scenario.add(kernel(gpu, K=4096), A='x')
+    with pytest.raises(ValueError):
+        scenario.add(kernel(gpu, workGroupsPerCU=2))
+    with pytest.raises(ValueError):
+        scenario.add(kernel(gpu, decomposition='split-k', splitK=2))
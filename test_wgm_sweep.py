@@ -0,0 +1,35 @@
+import csv
+from wgm_memo import openCache
+from wgm_sweep import fields, problemOf, rankKeys, runConfig, sweep, sweepConfigs
+
+problems = [(1024, 2048, 1024, 0.5), (512, 4096, 512, 0.5)]
+space = {'MT0': [128, 1024], 'MT1': [256], 'DU': [256], 'WGM': [0, 4], 'customWGM': [False, True]}
+
+def test_configs_skip_empty_grids_and_custom_without_wgm():
+    configs = list(sweepConfigs(problems, space))
+    # MT0 1024 leaves no tile rows for M=512; customWGM needs a WGM
+    assert all(config['M'] >= config['MT0'] for config in configs)
+    assert not any(config['customWGM'] and config['WGM'] == 0 for config in configs)
+    # Three WGM/customWGM combinations per tile shape: two tile shapes for the first problem, one for the second
+    assert len(configs) == 3*2 + 3
+
+def test_sweep_ranks_rows_per_problem(tmp_path):
+    out = str(tmp_path/'rows.csv')
+    rows = sweep(problems, space, workers=1, batchSize=2, output=out, rankBy='traffic')
+    assert len(rows) == len(list(sweepConfigs(problems, space)))
+    assert [problemOf(row) for row in rows] == sorted(problemOf(row) for row in rows)
+    for problem in problems:
+        keys = [rankKeys['traffic'](row) for row in rows if problemOf(row) == problem]
+        assert keys == sorted(keys)
+    with open(out, newline='') as file:
+        written = list(csv.DictReader(file))
+    assert len(written) == len(rows) and list(written[0]) == fields
+
+def test_cached_rows_are_reused(tmp_path):
+    path = str(tmp_path/'results.db')
+    config = next(sweepConfigs(problems, space))
+    first = runConfig(config, cachePath=path)
+    again = runConfig(config, cachePath=path)
+    assert openCache(path).hits == 1
+    fresh = runConfig(config)
+    assert dict(again, seconds=0) == dict(first, seconds=0) == dict(fresh, seconds=0)
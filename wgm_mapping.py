@@ -0,0 +1,168 @@
+
+import numpy as np
+
+# Workgroup remaps: launch coordinates (m, n) -> output tile (new_m, new_n). Every remap is compiled once per grid
+# into arrays indexed by launch order (linear = n*MOverMT0 + m), so consumers only index arrays.
+
+class RemapGrid:
+    # What a remap may depend on: the output tile grid and the GPU it launches on
+    def __init__(self, MOverMT0, NOverMT1, numXCDs=8, numCUs=256):
+        self.MOverMT0 = MOverMT0
+        self.NOverMT1 = NOverMT1
+        self.numXCDs = numXCDs
+        self.numCUs = numCUs
+
+    @classmethod
+    def of(cls, wgm):
+        return cls(wgm.MOverMT0, wgm.NOverMT1, wgm.GPU.numXCDs, wgm.GPU.numCUs)
+
+def dechunk(wgID, perXCD, numXCDs, numWGs):
+    # Launch IDs go round-robin over XCDs. Within each group of numXCDs*perXCD IDs, gives every XCD's IDs consecutive
+    # numbers, XCD by XCD. The last group may be partial, and then each XCD gets its actual share. A permutation of [0, numWGs).
+    groupSize = numXCDs*perXCD
+    group = wgID//groupSize
+    within = wgID%groupSize
+    size = np.minimum(groupSize, numWGs - group*groupSize)
+    xcd = within%numXCDs
+    return group*groupSize + xcd*(size//numXCDs) + np.minimum(xcd, size%numXCDs) + within//numXCDs
+
+class IdentityRemap:
+    name = 'identity'
+
+    def config(self):
+        return {}
+
+    def remap(self, m, n, grid):
+        return m, n, dict()
+
+class WGMRemap:
+    # The WGM remap: groups of WGM launch columns are walked WGM tiles at a time along N (a narrower last group if
+    # NOverMT1 is not a multiple of WGM)
+    name = 'wgm'
+
+    def __init__(self, WGM):
+        self.WGM = WGM
+
+    def config(self):
+        return {'WGM': self.WGM}
+
+    def remap(self, m, n, grid):
+        numFullWG = grid.NOverMT1//self.WGM
+        remainder = grid.NOverMT1%self.WGM
+        wgSerial = (n%self.WGM)*grid.MOverMT0 + m
+        wgSet = n//self.WGM
+        setWidth = np.where(wgSet < numFullWG, self.WGM, max(remainder, 1))
+        X = wgSerial//setWidth
+        Y = wgSerial%setWidth
+        return X, Y + wgSet*self.WGM, {'wgSet': wgSet, 'wgSerial': wgSerial, 'X': X, 'Y': Y}
+
+class BlockRemap:
+    # Output tiles are covered by blockM x blockN blocks of workgroups, column-major over blocks and within a block.
+    # With dechunk, each XCD's workgroups fill whole blocks (dechunk() with perXCD = blockM*blockN), so a block shares
+    # one L2. Tiles outside the full blocks (the edge: the last MOverMT0 % blockM rows and NOverMT1 % blockN columns)
+    # take the remaining launch IDs, row by row along N, dechunked edgePerXCD at a time (edgePerXCD=0 keeps launch order).
+    name = 'block'
+
+    def __init__(self, blockM=2, blockN=16, dechunk=True, edgePerXCD=2):
+        self.blockM = blockM
+        self.blockN = blockN
+        self.dechunk = dechunk
+        self.edgePerXCD = edgePerXCD
+
+    def config(self):
+        return {'blockM': self.blockM, 'blockN': self.blockN, 'dechunk': self.dechunk, 'edgePerXCD': self.edgePerXCD}
+
+    def remap(self, m, n, grid):
+        numWG = grid.MOverMT0*grid.NOverMT1
+        numWGPerBlock = self.blockM*self.blockN
+        numBlocksM = grid.MOverMT0//self.blockM
+        numBlocksN = grid.NOverMT1//self.blockN
+        numWGInBlocks = numWGPerBlock*numBlocksM*numBlocksN
+        wgID = n*grid.MOverMT0 + m
+        inBlocks = wgID < numWGInBlocks
+
+        # blockWGs
+        blockDechunked = dechunk(wgID, numWGPerBlock, grid.numXCDs, numWGInBlocks) if self.dechunk else wgID
+        blockID = blockDechunked//numWGPerBlock
+        wgBlockID = blockDechunked%numWGPerBlock
+        blockNewM = wgBlockID%self.blockM + (blockID%max(numBlocksM, 1))*self.blockM
+        blockNewN = wgBlockID//self.blockM + (blockID//max(numBlocksM, 1))*self.blockN
+
+        # edgeWGs, enumerated over the edge tiles row by row
+        edgeID = np.maximum(wgID - numWGInBlocks, 0)
+        edgeDechunked = dechunk(edgeID, self.edgePerXCD, grid.numXCDs, numWG - numWGInBlocks) if self.edgePerXCD else edgeID
+        edgeM, edgeN = edgeTiles(grid, numBlocksM*self.blockM, numBlocksN*self.blockN)
+
+        newM = np.where(inBlocks, blockNewM, edgeM[edgeDechunked] if len(edgeM) else 0)
+        newN = np.where(inBlocks, blockNewN, edgeN[edgeDechunked] if len(edgeN) else 0)
+        return newM, newN, {'wgID': wgID, 'wgIDDechunked': np.where(inBlocks, blockDechunked, edgeDechunked)}
+
+def edgeTiles(grid, blockLimM, blockLimN):
+    # (m, n) of the tiles outside [0, blockLimM) x [0, blockLimN), row by row along N
+    m, n = np.divmod(np.arange(grid.MOverMT0*grid.NOverMT1), grid.NOverMT1)
+    edge = (m >= blockLimM) | (n >= blockLimN)
+    return m[edge], n[edge]
+
+class CallableRemap:
+    # A user function fn(m, n, grid) -> (new_m, new_n). With vectorized it is called once on the launch-coordinate
+    # arrays, otherwise once per workgroup at compile time
+    def __init__(self, fn, vectorized=False, name=None):
+        self.fn = fn
+        self.vectorized = vectorized
+        self.name = name or getattr(fn, '__qualname__', repr(fn))
+
+    def config(self):
+        # Names the function only: closures of one function share it, so result caches key by the compiled remap
+        return {'fn': '%s.%s'%(getattr(self.fn, '__module__', ''), self.name), 'vectorized': self.vectorized}
+
+    def remap(self, m, n, grid):
+        if self.vectorized:
+            newM, newN = self.fn(m, n, grid)
+            return np.asarray(newM, dtype=np.int64), np.asarray(newN, dtype=np.int64), dict()
+        pairs = [self.fn(wgM, wgN, grid) for wgM, wgN in zip(m.tolist(), n.tolist())]
+        newM = np.fromiter((pair[0] for pair in pairs), dtype=np.int64, count=len(pairs))
+        newN = np.fromiter((pair[1] for pair in pairs), dtype=np.int64, count=len(pairs))
+        return newM, newN, dict()
+
+# Named remaps for WorkGroupMapping(mapping=...): a class, built with the keyword arguments given alongside, or a callable
+remaps = {'identity': IdentityRemap, 'wgm': WGMRemap, 'block': BlockRemap}
+
+def registerRemap(name, fn=None, vectorized=False):
+    # Registers fn(m, n, grid) -> (new_m, new_n) under name; usable as a decorator
+    def register(fn):
+        remaps[name] = CallableRemap(fn, vectorized, name)
+        return fn
+    return register if fn is None else register(fn)
+
+def getRemap(mapping, **params):
+    # Remap object from a registered name (with constructor params), a remap object, or a bare callable
+    if isinstance(mapping, str):
+        if mapping not in remaps:
+            raise KeyError("unknown mapping '%s', registered: %s"%(mapping, ', '.join(sorted(remaps))))
+        mapping = remaps[mapping]
+        return mapping(**params) if isinstance(mapping, type) else mapping
+    if hasattr(mapping, 'remap'):
+        return mapping
+    if callable(mapping):
+        return CallableRemap(mapping)
+    raise TypeError('mapping must be a registered name, a remap object or a callable, got %r'%(mapping,))
+
+class CompiledRemap:
+    # A remap evaluated over a whole grid: new_m/new_n and extras indexed by launch order, and permutation mapping
+    # each launch ID to its output tile's linear index (n*MOverMT0 + m)
+    def __init__(self, remap, grid):
+        self.remap = remap
+        self.grid = grid
+        linearWG = np.arange(grid.MOverMT0*grid.NOverMT1)
+        m = linearWG%grid.MOverMT0
+        n = linearWG//grid.MOverMT0
+        newM, newN, self.extras = remap.remap(m, n, grid)
+        self.newM = np.broadcast_to(np.asarray(newM, dtype=np.int64), linearWG.shape).copy()
+        self.newN = np.broadcast_to(np.asarray(newN, dtype=np.int64), linearWG.shape).copy()
+        self.permutation = self.newN*grid.MOverMT0 + self.newM
+
+    def __len__(self):
+        return len(self.permutation)
+
+def compileRemap(mapping, grid, **params):
+    return CompiledRemap(getRemap(mapping, **params), grid)
@@ -0,0 +1,172 @@
+
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from wgm_util import WorkGroupMapping, SimulationResult, simulatorVersion
+from wgm_mapping import RemapGrid, CompiledRemap, getRemap
+
+# WorkGroupMapping arguments that never change a simulation result
+ignoredArguments = ('self', 'GPU', 'width', 'height', 'debug', 'verbose')
+
+def canonical(value):
+    # JSON-stable form of an input; pluggable policy classes are identified by their qualified name, remap objects by
+    # their class and parameters (resultKey keys mappings by mappingDigest instead)
+    if isinstance(value, type) or (callable(value) and not hasattr(value, 'remap')):
+        return '%s.%s'%(value.__module__, value.__qualname__)
+    if hasattr(value, 'remap'):
+        return {'%s.%s'%(type(value).__module__, type(value).__qualname__): value.config()}
+    return value
+
+def mappingDigest(mapping, inputs, GPU):
+    # A mapping is keyed by the launch-order arrays it compiles to on this grid, not by its name: two closures of one
+    # function, or a name registered again, then only share results when they compute the same remap
+    grid = RemapGrid(inputs['M']//inputs['MT0'], inputs['N']//inputs['MT1'], GPU.numXCDs, GPU.numCUs)
+    compiled = CompiledRemap(getRemap(mapping), grid)
+    return {'remap': hashlib.blake2b(compiled.newM.tobytes() + compiled.newN.tobytes(), digest_size=16).hexdigest()}
+
+argumentDefaults = {name: parameter.default for name, parameter in inspect.signature(WorkGroupMapping.__init__).parameters.items() if name not in ignoredArguments}
+
+def resultKey(kind, GPU, **params):
+    # Content address of a result: every argument that affects it, with defaults filled in, plus the simulator version
+    unknown = set(params) - set(argumentDefaults)
+    if unknown:
+        raise TypeError('unexpected WorkGroupMapping arguments %s'%(sorted(unknown)))
+    inputs = dict(argumentDefaults)
+    inputs.update(params)
+    missing = [name for name, value in inputs.items() if value is inspect.Parameter.empty]
+    if missing:
+        raise TypeError('missing WorkGroupMapping arguments %s'%(missing))
+    if inputs['mapping'] is not None:
+        inputs['mapping'] = mappingDigest(inputs['mapping'], inputs, GPU)
+    inputs = {name: canonical(value) for name, value in inputs.items()}
+    inputs['GPU'] = {name: canonical(value) for name, value in GPU.config().items()}
+    inputs['kind'] = kind
+    inputs['simulatorVersion'] = simulatorVersion
+    return hashlib.blake2b(json.dumps(inputs, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+class ResultCache:
+    # On-disk memo of simulation results in SQLite (WAL mode, so several sweep processes can share one file),
+    # bounded to maxBytes of payload with least-recently-used eviction, and an in-process LRU of the memoryEntries
+    # most recent results (and argument keys) in front
+    def __init__(self, path, maxBytes=256*2**20, touchInterval=60.0, memoryEntries=4096):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.touchInterval = touchInterval
+        self.memoryEntries = memoryEntries
+        self.memory = OrderedDict()
+        self.keys = OrderedDict()
+        self.db = sqlite3.connect(path, timeout=60.0, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, atime REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_atime ON results (atime)')
+        self.hits = 0
+        self.misses = 0
+        # Payload bytes in the file, kept up to date by put(); other processes' writes are picked up when it crosses
+        # maxBytes and evict() recounts
+        self.storedBytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    def remember(self, table, key, value):
+        # Inserts into one of the in-process LRUs, dropping its least recently used entry beyond memoryEntries
+        table[key] = value
+        table.move_to_end(key)
+        if len(table) > self.memoryEntries:
+            table.popitem(last=False)
+
+    def key(self, kind, GPU, params):
+        # resultKey memoized on the raw arguments, so warm lookups skip the JSON encode and hash
+        rawKey = (kind, tuple(sorted(params.items())), tuple(sorted(GPU.config().items())))
+        key = self.keys.get(rawKey)
+        if key is None:
+            key = resultKey(kind, GPU, **params)
+        self.remember(self.keys, rawKey, key)
+        return key
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return value
+        row = self.db.execute('SELECT value, atime FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        value = json.loads(row[0])
+        now = time.time()
+        if now - row[1] > self.touchInterval:
+            # Coarse access times keep warm reads from turning into writes
+            self.db.execute('UPDATE results SET atime = ? WHERE key = ?', (now, key))
+        self.remember(self.memory, key, value)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        text = json.dumps(value)
+        self.remember(self.memory, key, value)
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            old = self.db.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+            self.db.execute('INSERT OR REPLACE INTO results (key, value, size, atime) VALUES (?, ?, ?, ?)', (key, text, len(text), time.time()))
+            self.storedBytes += len(text) - (old[0] if old else 0)
+            if self.storedBytes > self.maxBytes:
+                self.evict()
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def evict(self):
+        # Recounts (other processes may have written) and drops least recently used rows down to maxBytes
+        self.storedBytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if self.storedBytes <= self.maxBytes:
+            return
+        for key, size in self.db.execute('SELECT key, size FROM results ORDER BY atime').fetchall():
+            self.db.execute('DELETE FROM results WHERE key = ?', (key,))
+            self.memory.pop(key, None)
+            self.storedBytes -= size
+            if self.storedBytes <= self.maxBytes:
+                return
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def simulate(self, GPU, **params):
+        # Memoized WorkGroupMapping(...).result, without the per-request levels
+        key = self.key('simulate', GPU, params)
+        value = self.get(key)
+        if value is None:
+            wgm = WorkGroupMapping(GPU=GPU, verbose=False, **params)
+            value = {'levelRequests': wgm.result.levelRequests, 'levelBytes': wgm.result.levelBytes, 'writeBytes': wgm.result.writeBytes}
+            self.put(key, value)
+        result = SimulationResult(value['levelRequests'], value['levelBytes'])
+        result.writeBytes = value.get('writeBytes', 0.0)
+        return result
+
+    def getHitRates(self, GPU, **params):
+        return self.simulate(GPU, **params).hitRates()
+
+    def getHitRatesFast(self, GPU, **params):
+        key = self.key('getHitRatesFast', GPU, params)
+        value = self.get(key)
+        if value is None:
+            wgm = WorkGroupMapping(GPU=GPU, verbose=False, **params)
+            value = list(wgm.getHitRatesFast())
+            self.put(key, value)
+        return tuple(value)
+
+openCaches = dict()
+
+def openCache(path, maxBytes=256*2**20):
+    # One connection per process and path, for pool workers that receive only the path
+    path = os.path.abspath(path)
+    if path not in openCaches:
+        openCaches[path] = ResultCache(path, maxBytes)
+    return openCaches[path]
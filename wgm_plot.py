@@ -0,0 +1,188 @@
+
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.patches as patches
+from matplotlib.colors import ListedColormap
+from wgm_util import CacheHierarchy
+
+# Plotting for WorkGroupMapping, imported only when a plot method is called so the simulator needs NumPy alone
+
+def workGroupRect(wg):
+    return patches.Rectangle((wg.width*wg.n, wg.height*wg.m), wg.width, wg.height, linewidth=1, edgecolor='k', facecolor='none')
+
+def newWorkGroupRect(wg):
+    return patches.Rectangle((wg.width*wg.new_n, wg.height*wg.new_m), wg.width, wg.height, linewidth=1, edgecolor='k', facecolor=wg.color, alpha=0.25)
+
+def plotWorkGroups(wgm, plot_launch_order=True, full_annotation=False, raster=None):
+    # One patch and annotation per workgroup; raster=True (the default beyond maxPatchSide tiles) uses plotTileMaps
+    if raster or (raster is None and max(wgm.MOverMT0, wgm.NOverMT1) > wgm.maxPatchSide):
+        return plotTileMaps(wgm, layout='launch', hitCounts=False)
+    fig, ax = plt.subplots(figsize=(2*wgm.NOverMT1, 2*wgm.MOverMT0))
+    plt.tick_params(left = False, right = False, labelleft = False, labelbottom = False, bottom = False)
+    for x in range(wgm.MOverMT0):
+        for y in range(wgm.NOverMT1):
+            wg_tup = (x,y)
+            wg = wgm.workGroups[wg_tup]
+            ax.add_patch(wg.rect)
+            rx, ry = wg.rect.get_xy()
+            cx = rx + wg.rect.get_width()/2.0
+            cy = ry + wg.rect.get_height()/2.0
+            if full_annotation:
+                ax.annotate('%d,%d -> %d,%d'%(wg.m, wg.n,wg.new_m,wg.new_n), (cx, cy), color='k', fontsize=8, ha='center', va='center')
+            else:
+                ax.annotate('%d,%d\nXCD%d CU%d'%(wg.m,wg.n, wg.xcd, wg.cu), (cx, cy), color='k', fontsize=8, ha='center', va='center')
+    if plot_launch_order:
+        Ctr = 0
+        for y in range(wgm.NOverMT1):
+            for x in range(wgm.MOverMT0):
+                wg_tup = (x,y)
+                wg = wgm.workGroups[wg_tup]
+                rx, ry = wg.rect.get_xy()
+                cx = rx + wg.rect.get_width()/2.0
+                cy = ry + wg.rect.get_height()/2.0
+                if Ctr == 0:
+                    cx_begin = cx
+                    cy_begin = cy
+                    if not (x == 0 and y == 0):
+                        cx_dot_len = cx - cx_dot_begin
+                        cy_dot_len = cy - cy_dot_begin
+                        plt.arrow(cx_dot_begin, cy_dot_begin, cx_dot_len, cy_dot_len, length_includes_head=True, linestyle='--', width=0.005, alpha=0.25, zorder=5)
+                if Ctr == wgm.MOverMT0 - 1 or (x == wgm.MOverMT0 - 1 and y == wgm.NOverMT1 - 1):
+                    cx_len = cx - cx_begin
+                    cy_len = cy - cy_begin
+                    cx_dot_begin = cx
+                    cy_dot_begin = cy
+                    plt.arrow(cx_begin, cy_begin, cx_len, cy_len, length_includes_head=True, width=0.005, alpha=0.25, zorder=5)
+                Ctr = (Ctr + 1)%wgm.MOverMT0
+    plt.xlim(0,0.1*wgm.NOverMT1)
+    plt.ylim(0,0.1*wgm.MOverMT0)
+
+def launchRuns(newM, newN):
+    # (first, last) launch IDs of the straight runs of the compiled remap: consecutive workgroups one tile apart in
+    # the same direction (WGM tiles along N for the WGM remap), whatever mapping produced it
+    runs = list()
+    first = 0
+    for wg in range(1, len(newM) + 1):
+        if wg < len(newM):
+            step = (int(newM[wg] - newM[wg - 1]), int(newN[wg] - newN[wg - 1]))
+            if abs(step[0]) + abs(step[1]) == 1 and (wg - 1 == first or step == (int(newM[first + 1] - newM[first]), int(newN[first + 1] - newN[first]))):
+                continue
+        runs.append((first, wg - 1))
+        first = wg
+    return runs
+
+def plotNewWorkGroups(wgm, saveFig=False, figureTag=None, plot_launch_order=True, full_annotation=False, raster=None):
+    if raster or (raster is None and max(wgm.MOverMT0, wgm.NOverMT1) > wgm.maxPatchSide):
+        # Hit counts only when the simulation has already run: drawing the mapping must not start one
+        return plotTileMaps(wgm, layout='new', hitCounts='result' in wgm.stages, saveFig=saveFig, figureTag=figureTag)
+    fig, ax = plt.subplots(figsize=(2*wgm.NOverMT1, 2*wgm.MOverMT0))
+    plt.tick_params(left = False, right = False, labelleft = False, labelbottom = False, bottom = False)
+    for wg_tup, wg in wgm.newWorkGroups.items():
+            ax.add_patch(wg.new_rect)
+            rx, ry = wg.new_rect.get_xy()
+            cx = rx + wg.new_rect.get_width()/2.0
+            cy = ry + wg.new_rect.get_height()/2.0
+            if full_annotation:
+                if 'wgIDDechunked' in wg.extras:
+                    ax.annotate('%d,%d -> %d,%d\nXCD%d CU%d\nwgID %d -> %d'%(wg.m, wg.n,wg.new_m, wg.new_n, wg.xcd, wg.cu, wg.extras['wgID'], wg.extras['wgIDDechunked']), (cx, cy), color='k', fontsize=8, ha='center', va='center')
+                elif 'wgSet' in wg.extras:
+                    ax.annotate('%d,%d -> %d,%d\nXCD%d CU%d\n%d;%d\n%d,%d'%(wg.m, wg.n, wg.new_m, wg.new_n, wg.xcd, wg.cu, wg.extras['wgSet'], wg.extras['wgSerial'], wg.extras['X'], wg.extras['Y']), (cx, cy), color='k', fontsize=8, ha='center', va='center')
+                else:
+                    ax.annotate('%d,%d -> %d,%d\nXCD%d CU%d'%(wg.m, wg.n, wg.new_m, wg.new_n, wg.xcd, wg.cu), (cx, cy), color='k', fontsize=8, ha='center', va='center')
+            else:
+                ax.annotate('%d,%d\nXCD%d CU%d'%(wg.new_m,wg.new_n, wg.xcd, wg.cu), (cx, cy), color='k', fontsize=8, ha='center', va='center')
+    if plot_launch_order:
+        table = wgm.table
+        cx = table.width*table.new_n + table.width/2.0
+        cy = table.height*table.new_m + table.height/2.0
+        runs = launchRuns(table.new_m, table.new_n)
+        for run, (first, last) in enumerate(runs):
+            if run > 0:
+                previous = runs[run - 1][1]
+                plt.arrow(cx[previous], cy[previous], cx[first] - cx[previous], cy[first] - cy[previous], length_includes_head=True, linestyle='--', width=0.005, alpha=0.25, zorder=5)
+            plt.arrow(cx[first], cy[first], cx[last] - cx[first], cy[last] - cy[first], length_includes_head=True, width=0.005, alpha=0.25, zorder=5)
+    plt.xlim(0,0.1*wgm.NOverMT1)
+    plt.ylim(0,0.1*wgm.MOverMT0)
+    if saveFig:
+        figureName = '%dx%dx%d_HHS_NN_%dx%dx%d_WGM%d'%(wgm.M, wgm.N, wgm.K, wgm.MT0, wgm.MT1, wgm.DU, wgm.WGM)
+        if figureTag is not None:
+            figureName += '_%s'%(figureTag)
+        figureName += '.png'
+        
+        plt.savefig(figureName, transparent=True, dpi=300, format='png')
+
+def plotTileMaps(wgm, layout='new', result=None, hitCounts=True, maxInches=16.0, maxPixels=1024, annotateLimit=256, saveFig=False, figureTag=None):
+    # Raster view for any grid size: one imshow panel each for XCD, launch order and, with hitCounts, the requests
+    # every workgroup served from L2, MALL and HBM (from result, default wgm.result, which must keep its levels).
+    # Tiles sit at their output position (layout='new') or launch position ('launch'). Grids larger than maxPixels
+    # along a side are downsampled (first XCD, mean launch order, summed counts of each block); the figure is at
+    # most maxInches wide and, apart from titles, tall. Tiles are annotated only in grids of at most annotateLimit.
+    if layout == 'new':
+        index = wgm.table.newIndex.reshape(wgm.NOverMT1, wgm.MOverMT0).T
+    elif layout == 'launch':
+        index = np.arange(len(wgm.table)).reshape(wgm.NOverMT1, wgm.MOverMT0).T
+    else:
+        raise ValueError("unknown layout '%s', expected 'new' or 'launch'"%layout)
+    present = index >= 0
+    safeIndex = np.where(present, index, 0)
+    panels = [('XCD', wgm.table.xcd, 'first'), ('launch order', np.arange(len(wgm.table)), 'mean')]
+    if hitCounts:
+        result = wgm.result if result is None else result
+        if result.levels is None:
+            raise ValueError('plotTileMaps needs per-request levels, pass a result of the serial engine')
+        trace = wgm.trace
+        # Requests per launch-order tile (workgroups are tiles only when data-parallel)
+        tile = trace.wg if trace.tile is None else trace.tile
+        counts = np.bincount(tile*3 + result.levels, minlength=3*len(wgm.table)).reshape(-1, 3)
+        panels += [('%s requests'%name, counts[:, level], 'sum') for level, name in enumerate(CacheHierarchy.levelNames)]
+
+    factorY = -(-wgm.MOverMT0//maxPixels)
+    factorX = -(-wgm.NOverMT1//maxPixels)
+    rows = -(-wgm.MOverMT0//factorY)
+    cols = -(-wgm.NOverMT1//factorX)
+    panelHeight = min(max(maxInches*rows/cols, 1.0), maxInches/len(panels)) + 0.6
+    fig, axes = plt.subplots(len(panels), 1, figsize=(maxInches, panelHeight*len(panels)), squeeze=False)
+    annotate = len(wgm.table) <= annotateLimit and factorX == factorY == 1
+    for ax, (name, values, reduce) in zip(axes[:, 0], panels):
+        image = downsample(np.where(present, values[safeIndex], np.nan), present, factorY, factorX, reduce)
+        if name == 'XCD':
+            cmap = ListedColormap([wgm.GPU.color[xcd%len(wgm.GPU.color)] for xcd in range(wgm.GPU.numXCDs)])
+            im = ax.imshow(image, origin='lower', aspect='auto', interpolation='nearest', cmap=cmap, vmin=-0.5, vmax=wgm.GPU.numXCDs - 0.5)
+        else:
+            im = ax.imshow(image, origin='lower', aspect='auto', interpolation='nearest', cmap='viridis')
+        fig.colorbar(im, ax=ax, pad=0.01)
+        title = name if factorX == factorY == 1 else '%s (%dx%d tiles per pixel)'%(name, factorY, factorX)
+        ax.set_title(title, fontsize=9)
+        ax.set_xlabel('n', fontsize=8)
+        ax.set_ylabel('m', fontsize=8)
+        if annotate:
+            for m, n in zip(*np.nonzero(present)):
+                ax.annotate('%d'%image[m, n], (n, m), color='k', fontsize=6, ha='center', va='center')
+    fig.tight_layout()
+    if saveFig:
+        figureName = '%dx%dx%d_tiles_%s_%dx%dx%d_WGM%d'%(wgm.M, wgm.N, wgm.K, layout, wgm.MT0, wgm.MT1, wgm.DU, wgm.WGM)
+        if figureTag is not None:
+            figureName += '_%s'%(figureTag)
+        figureName += '.png'
+        plt.savefig(figureName, dpi=150, format='png')
+    return fig
+
+def downsample(image, present, factorY, factorX, reduce):
+    # Reduces each factorY x factorX block of image over its present tiles: 'first' present value, 'mean' or 'sum';
+    # NaN where a block has none
+    if factorY == factorX == 1:
+        return image
+    rows = -(-image.shape[0]//factorY)
+    cols = -(-image.shape[1]//factorX)
+    padded = np.full((rows*factorY, cols*factorX), np.nan)
+    padded[:image.shape[0], :image.shape[1]] = np.where(present, image, np.nan)
+    blocks = padded.reshape(rows, factorY, cols, factorX).transpose(0, 2, 1, 3).reshape(rows, cols, -1)
+    valid = ~np.isnan(blocks)
+    numValid = valid.sum(axis=2)
+    if reduce == 'first':
+        reduced = np.take_along_axis(blocks, valid.argmax(axis=2)[..., None], axis=2)[..., 0]
+    else:
+        reduced = np.where(valid, blocks, 0.0).sum(axis=2)
+        if reduce == 'mean':
+            reduced = reduced/np.maximum(numValid, 1)
+    return np.where(numValid > 0, reduced, np.nan)
@@ -0,0 +1,162 @@
+
+import numpy as np
+from wgm_util import CacheHierarchy, CacheLevel, EventDispatcher, SimulationResult
+
+# Several GEMMs sharing one GPU: their workgroups go through one EventDispatcher and their requests through one set of
+# L2s and one MALL. Every operand is a named tensor; kernels that name the same tensor (e.g. the weights of two
+# projections, or one activation read by Q, K and V) share its tiles in the caches.
+
+class Kernel:
+    def __init__(self, wgm, name, A, B, launch):
+        self.wgm = wgm
+        self.name = name
+        self.A = A
+        self.B = B
+        # Launch time in seconds, or 'after' to launch when the previous kernel's last workgroup ends
+        self.launch = launch
+
+class ScenarioResult:
+    # Per-kernel and aggregate results of a Scenario run, plus each kernel's first start and last end time (seconds)
+    def __init__(self, names, results, total, start, end):
+        self.names = names
+        self.results = results
+        self.total = total
+        self.start = start
+        self.end = end
+
+    def __getitem__(self, name):
+        return self.results[self.names.index(name)]
+
+    def report(self):
+        lines = []
+        for name, result, start, end in zip(self.names, self.results, self.start, self.end):
+            lines.append('%-12s %8.1f..%8.1f us  hit-rate(l2,mall,hbm) (%.4f, %.4f, %.4f)  HBM %8.1f MiB'%(
+                name, start*1e6, end*1e6, *result.hitRates(), result.hbmBytes/2**20))
+        lines.append('%-12s %8.1f..%8.1f us  hit-rate(l2,mall,hbm) (%.4f, %.4f, %.4f)  HBM %8.1f MiB'%(
+            'total', min(self.start)*1e6, max(self.end)*1e6, *self.total.hitRates(), self.total.hbmBytes/2**20))
+        return '\n'.join(lines)
+
+class Scenario:
+    # Kernels are added in dispatch order. Each workgroup's kSlice takes its FLOPs at its CU's share of peakFLOPS
+    # (scaled by the EventDispatcher jitter); workgroups of all kernels dispatch in order of (launch time, launch index,
+    # kernel), so kernels launched together alternate workgroups and a later one fills slots as earlier ones drain.
+    # With flushL2, the L2s are emptied when the first request of a kernel launched 'after' its predecessor arrives;
+    # the MALL always keeps its contents across kernels.
+    def __init__(self, GPU, jitter=0.0, seed=0, flushL2=False, policy=None):
+        self.GPU = GPU
+        self.jitter = jitter
+        self.seed = seed
+        self.flushL2 = flushL2
+        self.policy = policy
+        self.kernels = list()
+        # Tensor name -> (first key, tile geometry)
+        self.tensors = dict()
+        self.numKeys = 0
+
+    def add(self, wgm, name=None, A=None, B=None, launch=0.0):
+        # A and B name the operand tensors (default: private to this kernel); tensors shared by name must have the
+        # same tiles
+        if not wgm.dataParallel():
+            raise ValueError("scenarios run data-parallel kernels, not '%s'"%wgm.decomposition)
+        if self.kernels and wgm.workGroupsPerCU != self.kernels[0].wgm.workGroupsPerCU:
+            raise ValueError('kernels of one scenario must share workGroupsPerCU')
+        if launch == 'after' and not self.kernels:
+            raise ValueError("the first kernel cannot launch 'after' another")
+        name = 'kernel%d'%len(self.kernels) if name is None else name
+        if name in [kernel.name for kernel in self.kernels]:
+            raise ValueError("duplicate kernel name '%s'"%name)
+        A = self.tensor('%s.A'%name if A is None else A, (wgm.MOverMT0, wgm.KOverDU, wgm.ATileBytes))
+        B = self.tensor('%s.B'%name if B is None else B, (wgm.NOverMT1, wgm.KOverDU, wgm.BTileBytes))
+        self.kernels.append(Kernel(wgm, name, A, B, launch))
+        return self
+
+    def tensor(self, name, geometry):
+        # First key of a tensor's tiles, registering it on first use
+        if name in self.tensors:
+            base, known = self.tensors[name]
+            if known != geometry:
+                raise ValueError("tensor '%s' is used with (tiles, kSlices, tile bytes) %r and %r"%(name, known, geometry))
+            return base
+        self.tensors[name] = (self.numKeys, geometry)
+        self.numKeys += geometry[0]*geometry[1]
+        return self.tensors[name][0]
+
+    def sliceTimes(self, index, kernel):
+        # Seconds each of a kernel's workgroups spends on one kSlice
+        wgm = kernel.wgm
+        dispatcher = EventDispatcher(self.GPU, wgm.workGroupsPerCU, self.jitter, self.seed + index)
+        return dispatcher.sliceTimes(len(wgm.table))*2*wgm.MT0*wgm.MT1*wgm.DU/(self.GPU.peakFLOPS/self.GPU.numCUs)
+
+    def schedule(self):
+        # Launch time of every kernel, and its workgroups' start times, end times and CUs, resolving 'after' launches
+        # by scheduling the kernels before them first
+        sliceTimes = [self.sliceTimes(index, kernel) for index, kernel in enumerate(self.kernels)]
+        launches = list()
+        for index, kernel in enumerate(self.kernels):
+            if kernel.launch == 'after':
+                _, ends, _ = self.dispatch(launches, sliceTimes[:index])
+                launches.append(float(ends[-1].max()))
+            else:
+                launches.append(float(kernel.launch))
+        return (launches,) + self.dispatch(launches, sliceTimes)
+
+    def dispatch(self, launches, sliceTimes):
+        # Per kernel (of the first len(launches)): workgroup start times, end times and CUs
+        kernels = self.kernels[:len(launches)]
+        kernelIndex = np.concatenate([np.full(len(kernel.wgm.table), index) for index, kernel in enumerate(kernels)])
+        launchIndex = np.concatenate([np.arange(len(kernel.wgm.table)) for kernel in kernels])
+        release = np.asarray(launches)[kernelIndex]
+        order = np.lexsort((kernelIndex, launchIndex, release))
+        XCD = np.concatenate([kernel.wgm.table.xcd for kernel in kernels])[order]
+        times = np.concatenate(sliceTimes)[order]
+        KOverDU = np.concatenate([np.full(len(kernel.wgm.table), kernel.wgm.KOverDU) for kernel in kernels])[order]
+        dispatcher = EventDispatcher(self.GPU, kernels[0].wgm.workGroupsPerCU)
+        orderedStart, orderedCU = dispatcher.schedule(XCD, times, KOverDU, release[order])
+        start = np.empty(len(order))
+        CU = np.empty(len(order), dtype=np.int64)
+        start[order] = orderedStart
+        CU[order] = orderedCU
+        bounds = np.cumsum([0] + [len(kernel.wgm.table) for kernel in kernels])
+        starts = [start[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+        ends = [wgStart + times*kernel.wgm.KOverDU for wgStart, times, kernel in zip(starts, sliceTimes, kernels)]
+        return starts, ends, [CU[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+    def trace(self):
+        # (issue time, kernel, xcd, key, bytes) of every request, in issue order: each workgroup requests A then B at
+        # the start of each kSlice; simultaneous requests go by kernel, then launch order
+        _, starts, ends, _ = self.schedule()
+        parts = list()
+        for index, (kernel, start) in enumerate(zip(self.kernels, starts)):
+            wgm = kernel.wgm
+            sliceTime = (ends[index] - start)/wgm.KOverDU
+            wg = np.repeat(np.arange(len(wgm.table)), wgm.KOverDU)
+            kSlice = np.tile(np.arange(wgm.KOverDU), len(wgm.table))
+            issueTime = start[wg] + kSlice*sliceTime[wg]
+            AKey = kernel.A + wgm.table.new_m[wg]*wgm.KOverDU + kSlice
+            BKey = kernel.B + wgm.table.new_n[wg]*wgm.KOverDU + kSlice
+            parts.append((np.repeat(issueTime, 2), np.full(2*len(wg), index), np.repeat(wgm.table.xcd[wg], 2),
+                          np.stack([AKey, BKey], axis=1).ravel(), np.tile([wgm.ATileBytes, wgm.BTileBytes], len(wg))))
+        issueTime, kernelIndex, xcd, key, numBytes = (np.concatenate(column) for column in zip(*parts))
+        order = np.lexsort((np.arange(len(issueTime)), issueTime))
+        return issueTime[order], kernelIndex[order], xcd[order], key[order], numBytes[order], starts, ends
+
+    def run(self):
+        issueTime, kernelIndex, xcd, key, numBytes, starts, ends = self.trace()
+        granule = min(min(kernel.wgm.ATileBytes, kernel.wgm.BTileBytes) for kernel in self.kernels)
+        hierarchy = CacheHierarchy(self.GPU, self.policy, granule)
+        policy = self.GPU.cachePolicy if self.policy is None else self.policy
+        # Trace positions where the L2s are flushed: the first request of each kernel launched 'after' another
+        cuts = [0]
+        if self.flushL2:
+            first = np.full(len(self.kernels), len(key))
+            np.minimum.at(first, kernelIndex, np.arange(len(key)))
+            cuts += sorted(int(first[index]) for index, kernel in enumerate(self.kernels) if kernel.launch == 'after')
+        cuts.append(len(key))
+        levels = np.empty(len(key), dtype=np.int8)
+        for lo, hi in zip(cuts[:-1], cuts[1:]):
+            if lo > 0:
+                hierarchy.L2 = [CacheLevel(self.GPU.L2BytesPerXCD, policy, granule) for _ in range(self.GPU.numXCDs)]
+            levels[lo:hi] = np.fromiter(map(hierarchy.access, xcd[lo:hi].tolist(), key[lo:hi].tolist(), numBytes[lo:hi].tolist()), dtype=np.int8, count=hi - lo)
+        results = [SimulationResult.fromLevels(levels[kernelIndex == index], numBytes[kernelIndex == index]) for index in range(len(self.kernels))]
+        return ScenarioResult([kernel.name for kernel in self.kernels], results, SimulationResult.fromLevels(levels, numBytes),
+                              [float(start.min()) for start in starts], [float(end.max()) for end in ends])
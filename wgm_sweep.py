@@ -0,0 +1,168 @@
+
+import argparse
+import csv
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from wgm_util import gfx9, WorkGroupMapping, parseProblem
+from wgm_memo import openCache
+
+# Default search space, overridden per axis from the command line or the sweep() call
+defaultSpace = {'MT0': [64, 128, 256], 'MT1': [128, 256, 512], 'DU': [256, 512], 'WGM': [0, 8, 16, 32], 'customWGM': [False]}
+
+fields = ['M', 'N', 'K', 'elemSize', 'MT0', 'MT1', 'DU', 'WGM', 'customWGM', 'validMapping',
+          'l2HitRate', 'mallHitRate', 'hbmHitRate', 'l2Bytes', 'mallBytes', 'hbmBytes', 'predictedSeconds', 'boundBy', 'seconds']
+
+# Lower is better for every ranking; remaps that are not permutations skip tiles and always rank last
+rankKeys = {'hbm': lambda row: (not row['validMapping'], row['hbmHitRate'], row['hbmBytes']),
+            'traffic': lambda row: (not row['validMapping'], row['hbmBytes'], row['hbmHitRate']),
+            'time': lambda row: (not row['validMapping'], row['predictedSeconds'], row['hbmBytes'])}
+
+def sweepConfigs(problems, space=None):
+    # Every (problem, tile, WGM) combination that yields at least one tile in M, N and K
+    space = dict(defaultSpace, **(space or {}))
+    for M, N, K, elemSize in problems:
+        for MT0, MT1, DU, WGM, customWGM in itertools.product(space['MT0'], space['MT1'], space['DU'], space['WGM'], space['customWGM']):
+            if M//MT0 == 0 or N//MT1 == 0 or K//DU == 0:
+                continue
+            if customWGM and WGM == 0:
+                continue
+            yield {'M': M, 'N': N, 'K': K, 'elemSize': elemSize, 'MT0': MT0, 'MT1': MT1, 'DU': DU, 'WGM': WGM, 'customWGM': customWGM}
+
+def runConfig(config, gpuArgs=None, cachePath=None):
+    start = time.perf_counter()
+    GPU = gfx9(**(gpuArgs or {}))
+    if cachePath is not None:
+        cache = openCache(cachePath)
+        key = cache.key('sweep', GPU, config)
+        row = cache.get(key)
+        if row is not None:
+            return dict(row, seconds=time.perf_counter() - start)
+    wgm = WorkGroupMapping(GPU=GPU, verbose=False, **config)
+    result = wgm.result
+    l2HitRate, mallHitRate, hbmHitRate = result.hitRates()
+    performance = wgm.getPerformance(result)
+    row = dict(config, validMapping=wgm.isPermutation(), l2HitRate=l2HitRate, mallHitRate=mallHitRate, hbmHitRate=hbmHitRate,
+               l2Bytes=result.l2Bytes, mallBytes=result.mallBytes, hbmBytes=result.hbmBytes,
+               predictedSeconds=performance.time, boundBy=performance.boundBy, seconds=time.perf_counter() - start)
+    if cachePath is not None:
+        cache.put(key, row)
+    return row
+
+def runBatch(configs, gpuArgs=None, cachePath=None):
+    return [runConfig(config, gpuArgs, cachePath) for config in configs]
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+class CSVSink:
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=fields)
+        self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class ParquetSink:
+    def __init__(self, path):
+        # pyarrow is only needed when writing Parquet
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.writer = None
+        self.path = path
+
+    def write(self, rows):
+        table = self.pyarrow.Table.from_pylist(rows)
+        if self.writer is None:
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+def openSink(path):
+    if path is None:
+        return None
+    if path.endswith('.parquet'):
+        return ParquetSink(path)
+    return CSVSink(path)
+
+def sweep(problems, space=None, gpuArgs=None, workers=None, batchSize=8, output=None, rankBy='traffic', cachePath=None):
+    # Fans the configurations out over a process pool in batches, streams rows to output as batches
+    # finish and returns every row grouped by problem and ranked by rankBy ('hbm' hit fraction, predicted HBM 'traffic'
+    # or getPerformance's predicted 'time').
+    # With cachePath, rows already in that ResultCache file are reused instead of re-simulated.
+    configs = sweepConfigs(problems, space)
+    sink = openSink(output)
+    rows = list()
+    try:
+        if workers == 1:
+            for batch in batched(configs, batchSize):
+                batchRows = runBatch(batch, gpuArgs, cachePath)
+                rows.extend(batchRows)
+                if sink is not None:
+                    sink.write(batchRows)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(runBatch, batch, gpuArgs, cachePath) for batch in batched(configs, batchSize)]
+                for future in as_completed(futures):
+                    batchRows = future.result()
+                    rows.extend(batchRows)
+                    if sink is not None:
+                        sink.write(batchRows)
+    finally:
+        if sink is not None:
+            sink.close()
+    rankKey = rankKeys[rankBy]
+    rows.sort(key=lambda row: (problemOf(row), rankKey(row)))
+    return rows
+
+def problemOf(row):
+    return row['M'], row['N'], row['K'], row['elemSize']
+
+def parseList(text, cast=int):
+    return [cast(value) for value in text.split(',')]
+
+def addSweepArguments(parser):
+    parser.add_argument('--problem', action='append', type=parseProblem, required=True, help='M,N,K[,elemSize], repeatable')
+    parser.add_argument('--MT0', type=parseList, default=defaultSpace['MT0'])
+    parser.add_argument('--MT1', type=parseList, default=defaultSpace['MT1'])
+    parser.add_argument('--DU', type=parseList, default=defaultSpace['DU'])
+    parser.add_argument('--WGM', type=parseList, default=defaultSpace['WGM'])
+    parser.add_argument('--custom', action='store_true', help='also sweep the custom block mapping')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--batch', type=int, default=8, help='configurations per worker task')
+    parser.add_argument('--out', default=None, help='.csv or .parquet file, written as results arrive')
+    parser.add_argument('--rank', choices=sorted(rankKeys), default='traffic')
+    parser.add_argument('--cache', default=None, help='SQLite result cache shared by all workers')
+    parser.add_argument('--top', type=int, default=10, help='configurations printed per problem')
+
+def runSweep(args):
+    space = {'MT0': args.MT0, 'MT1': args.MT1, 'DU': args.DU, 'WGM': args.WGM, 'customWGM': [False, True] if args.custom else [False]}
+    start = time.perf_counter()
+    rows = sweep(args.problem, space, workers=args.workers, batchSize=args.batch, output=args.out, rankBy=args.rank, cachePath=args.cache)
+    print('%d configurations in %.2fs on %d workers'%(len(rows), time.perf_counter() - start, args.workers))
+    for problem, problemRows in itertools.groupby(rows, key=problemOf):
+        for row in list(problemRows)[:args.top]:
+            print('%dx%dx%d MT %dx%dx%d WGM %d%s%s: hit-rate(l2,mall,hbm) (%.4f, %.4f, %.4f) HBM %.1f MiB, %.1f us %s-bound'%(
+                row['M'], row['N'], row['K'], row['MT0'], row['MT1'], row['DU'], row['WGM'], ' custom' if row['customWGM'] else '', '' if row['validMapping'] else ' (invalid remap)',
+                row['l2HitRate'], row['mallHitRate'], row['hbmHitRate'], row['hbmBytes']/2**20, row['predictedSeconds']*1e6, row['boundBy']))
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep tile sizes and WGM over GEMM problems')
+    addSweepArguments(parser)
+    runSweep(parser.parse_args())
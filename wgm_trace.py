@@ -0,0 +1,120 @@
+
+import json
+import numpy as np
+from wgm_util import CacheHierarchy, SimulationResult
+
+# Binary access traces: a fixed headerBytes header followed by numRecords little-endian, packed fixed-size records.
+# The header starts with headerFields; the rest holds JSON metadata (numXCDs, granule, and one entry per GEMM written
+# with writeTrace) padded with zeros. Records of other tools only need consistent xcd, address and numBytes; address
+# is the cache key on replay, so different tensors must not overlap. Operand is 0 for A, 1 for B, 2 for reads of
+# split-K/Stream-K partial C tiles and writeOperand for their writes, which replay only counts in writeBytes.
+magic = b'WGMTRACE'
+formatVersion = 1
+headerBytes = 4096
+writeOperand = 3
+headerFields = np.dtype([('magic', 'S8'), ('version', '<u4'), ('recordBytes', '<u4'), ('numRecords', '<u8'), ('metaBytes', '<u4')])
+traceRecord = np.dtype([('clk', '<u8'), ('xcd', '<u2'), ('cu', '<u2'), ('operand', 'u1'), ('row', '<u4'), ('col', '<u4'),
+                        ('kSlice', '<u4'), ('address', '<u8'), ('numBytes', '<u4')])
+
+class TraceWriter:
+    # Appends records to a trace file; the header (record count and metadata) is written on close()
+    def __init__(self, path, numXCDs=8, granule=None):
+        # granule: smallest request size, used for PLRU way counts on replay (writeTrace keeps it up to date)
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(bytes(headerBytes))
+        self.numRecords = 0
+        self.meta = {'numXCDs': numXCDs, 'granule': granule, 'gemms': []}
+
+    def append(self, clk, xcd, cu, operand, row, col, kSlice, address, numBytes):
+        # Writes one record per element of the (broadcast) arrays
+        clk = np.asarray(clk)
+        records = np.empty(len(clk), dtype=traceRecord)
+        for name, values in zip(traceRecord.names, (clk, xcd, cu, operand, row, col, kSlice, address, numBytes)):
+            records[name] = values
+        records.tofile(self.file)
+        self.numRecords += len(records)
+
+    def close(self):
+        meta = json.dumps(self.meta).encode()
+        if headerFields.itemsize + len(meta) > headerBytes:
+            raise ValueError('trace metadata takes %d bytes, the header holds %d'%(len(meta), headerBytes - headerFields.itemsize))
+        header = np.array([(magic, formatVersion, traceRecord.itemsize, self.numRecords, len(meta))], dtype=headerFields)
+        self.file.seek(0)
+        self.file.write(header.tobytes() + meta)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class TraceFile:
+    # Read-only view of a trace file: records is a numpy.memmap, so chunks are paged in on demand
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            raw = file.read(headerBytes)
+        header = np.frombuffer(raw[:headerFields.itemsize], dtype=headerFields)[0]
+        if header['magic'] != magic:
+            raise ValueError("'%s' is not a trace file"%path)
+        if header['version'] != formatVersion or header['recordBytes'] != traceRecord.itemsize:
+            raise ValueError("'%s' has trace format %d with %d-byte records, expected %d with %d-byte records"%(
+                path, header['version'], header['recordBytes'], formatVersion, traceRecord.itemsize))
+        self.numRecords = int(header['numRecords'])
+        self.meta = json.loads(raw[headerFields.itemsize:headerFields.itemsize + int(header['metaBytes'])])
+        self.records = np.memmap(path, dtype=traceRecord, mode='r', offset=headerBytes, shape=(self.numRecords,)) if self.numRecords else np.empty(0, dtype=traceRecord)
+
+    def __len__(self):
+        return self.numRecords
+
+    def chunks(self, chunkRecords=2**20):
+        for start in range(0, self.numRecords, chunkRecords):
+            yield self.records[start:start + chunkRecords]
+
+    def replay(self, model, chunkRecords=2**20):
+        # Streams the records through model.access(xcd, address, numBytes) -> level, holding one chunk at a time.
+        # The result has per-level totals only, no per-request levels.
+        access = model.access
+        levelRequests = np.zeros(3, dtype=np.int64)
+        levelBytes = np.zeros(3)
+        writeBytes = 0
+        for chunk in self.chunks(chunkRecords):
+            numBytes = chunk['numBytes'].astype(np.int64)
+            levels = np.fromiter(map(access, chunk['xcd'].tolist(), chunk['address'].tolist(), numBytes.tolist()), dtype=np.int8, count=len(chunk))
+            read = chunk['operand'] != writeOperand
+            levelRequests += np.bincount(levels[read], minlength=3)
+            levelBytes += np.bincount(levels[read], weights=numBytes[read], minlength=3)
+            writeBytes += int(numBytes[~read].sum())
+        result = SimulationResult(levelRequests.tolist(), levelBytes.tolist())
+        result.writeBytes = float(writeBytes)
+        return result
+
+    def simulate(self, GPU, policy=None, chunkRecords=2**20):
+        # Replay through the tile-level L2s and MALL of GPU
+        return self.replay(CacheHierarchy(GPU, policy, granule=self.meta.get('granule')), chunkRecords)
+
+def writeTrace(wgm, writer, baseAddress=0, trace=None, wavesPerChunk=16):
+    # Appends a WorkGroupMapping's trace: the lockstep trace wavesPerChunk waves at a time, or the given trace (e.g.
+    # getEventTrace()). Addresses are baseAddress plus tileLayout()'s, so GEMMs written to one file need disjoint bases
+    # for distinct tensors and the same base to share them.
+    entry = {'M': wgm.M, 'N': wgm.N, 'K': wgm.K, 'MT0': wgm.MT0, 'MT1': wgm.MT1, 'DU': wgm.DU, 'elemSize': wgm.elemSize,
+             'baseAddress': baseAddress, 'firstRecord': writer.numRecords}
+    if trace is not None:
+        traces = [trace]
+    else:
+        numWaves = -(-wgm.work.numWorkGroups//(wgm.GPU.numCUs*wgm.workGroupsPerCU))
+        traces = (wgm.getTrace(firstWave, firstWave + wavesPerChunk) for firstWave in range(0, numWaves, wavesPerChunk))
+    for chunk in traces:
+        address, _ = wgm.tileLayout(chunk)
+        cu = wgm.work.cu[chunk.wg] if chunk.cu is None else chunk.cu
+        tile = chunk.wg if chunk.tile is None else chunk.tile
+        operand = chunk.operand if chunk.write is None else np.where(chunk.write, writeOperand, chunk.operand)
+        writer.append(chunk.clk, chunk.xcd, cu, operand, wgm.table.new_m[tile], wgm.table.new_n[tile],
+                      chunk.kSlice, baseAddress + address, chunk.numBytes)
+    entry['numRecords'] = writer.numRecords - entry['firstRecord']
+    writer.meta['gemms'].append(entry)
+    granule = min(wgm.ATileBytes, wgm.BTileBytes)
+    writer.meta['granule'] = granule if writer.meta['granule'] is None else min(writer.meta['granule'], granule)
+    return entry
@@ -0,0 +1,124 @@
+
+import argparse
+import time
+import numpy as np
+from wgm_util import gfx9, WorkGroupMapping, countDistinct, parseProblem
+from wgm_mapping import RemapGrid, IdentityRemap, WGMRemap, BlockRemap, CompiledRemap
+from wgm_memo import openCache
+
+def powersOfTwo(limit):
+    return [1 << i for i in range(max(limit, 1).bit_length()) if 1 << i <= limit]
+
+def candidateRemaps(grid, GPU, workGroupsPerCU=1, WGMs=None, blocks=None):
+    # The identity, every WGM in WGMs (default: powers of two up to NOverMT1), and every blockM x blockN in blocks
+    # (default: powers of two whose block fits one XCD's share of a wave)
+    WGMs = powersOfTwo(grid.NOverMT1) if WGMs is None else WGMs
+    if blocks is None:
+        blocks = [(blockM, blockN) for blockM in powersOfTwo(grid.MOverMT0) for blockN in powersOfTwo(grid.NOverMT1)
+                  if blockM*blockN <= GPU.numCUsPerXCD*workGroupsPerCU]
+    yield 'identity', IdentityRemap()
+    for WGM in WGMs:
+        yield 'wgm %d'%WGM, WGMRemap(WGM)
+    for blockM, blockN in blocks:
+        yield 'block %dx%d'%(blockM, blockN), BlockRemap(blockM, blockN, dechunk=True, edgePerXCD=blockN)
+
+def screenTraffic(newM, newN, XCD, MOverMT0, NOverMT1, KOverDU, ATileBytes, BTileBytes, GPU, workGroupsPerCU=1):
+    # Analytical (MALL bytes, HBM bytes) of a remap from per-wave footprints, without simulating:
+    #   - within a wave every kSlice fetches each distinct A row / B column of an XCD once into its L2
+    #     (every request misses when that kSlice working set exceeds the L2);
+    #   - a wave re-reads from HBM only the rows/columns the previous wave did not touch, or all of them when the
+    #     previous wave's footprint over every kSlice does not fit in the MALL.
+    workGroupsPerWave = GPU.numCUs*workGroupsPerCU
+    wave = np.arange(len(newM))//workGroupsPerWave
+    numWaves = int(wave[-1]) + 1
+
+    rowsPerXCD = countDistinct(wave*GPU.numXCDs + XCD, newM, numWaves*GPU.numXCDs, MOverMT0)
+    colsPerXCD = countDistinct(wave*GPU.numXCDs + XCD, newN, numWaves*GPU.numXCDs, NOverMT1)
+    sliceBytes = rowsPerXCD*ATileBytes + colsPerXCD*BTileBytes
+    requestsPerXCD = np.bincount(wave*GPU.numXCDs + XCD, minlength=numWaves*GPU.numXCDs)
+    sliceBytes = np.where(sliceBytes > GPU.L2BytesPerXCD, requestsPerXCD*(ATileBytes + BTileBytes), sliceBytes)
+    mallBytes = float(sliceBytes.sum())*KOverDU
+
+    rows = np.unique(wave*MOverMT0 + newM)
+    cols = np.unique(wave*NOverMT1 + newN)
+    rowWave = rows//MOverMT0
+    colWave = cols//NOverMT1
+    rowsPerWave = np.bincount(rowWave, minlength=numWaves)
+    colsPerWave = np.bincount(colWave, minlength=numWaves)
+    footprint = (rowsPerWave*ATileBytes + colsPerWave*BTileBytes)*KOverDU
+    # Rows/columns also touched by the previous wave, reusable when that wave's footprint fits in the MALL
+    previousFits = np.r_[False, footprint[:-1] <= GPU.MALLBytes]
+    reusedRows = np.isin(rows, rows + MOverMT0) & previousFits[rowWave]
+    reusedCols = np.isin(cols, cols + NOverMT1) & previousFits[colWave]
+    hbmBytes = float(np.count_nonzero(~reusedRows)*ATileBytes + np.count_nonzero(~reusedCols)*BTileBytes)*KOverDU
+    return mallBytes, hbmBytes
+
+def paretoLayers(rows, keys=('screenHBMBytes', 'screenMALLBytes')):
+    # Sets each row's 'paretoLayer': 0 for rows no other row beats on every key (and strictly on one), 1 for rows only
+    # layer-0 rows dominate, and so on
+    remaining = list(rows)
+    layer = 0
+    while remaining:
+        front = [row for row in remaining if not any(all(other[key] <= row[key] for key in keys) and any(other[key] < row[key] for key in keys) for other in remaining)]
+        for row in front:
+            row['paretoLayer'] = layer
+        remaining = [row for row in remaining if row.get('paretoLayer') != layer]
+        layer += 1
+    return rows
+
+def tune(M, N, K, GPU=None, MT0=64, MT1=512, DU=256, elemSize=0.5, workGroupsPerCU=1, WGMs=None, blocks=None, refine=4, cachePath=None):
+    # Screens every candidate remap with screenTraffic, drops duplicates (same permutation) and non-permutations,
+    # re-scores the refine best with the exact simulation (Pareto layer first, so dominated candidates only fill
+    # leftover slots), and returns rows ranked refined first by exact HBM bytes then predicted time, followed by the
+    # rest by Pareto layer and screened HBM bytes
+    GPU = gfx9() if GPU is None else GPU
+    MOverMT0, NOverMT1, KOverDU = M//MT0, N//MT1, K//DU
+    grid = RemapGrid(MOverMT0, NOverMT1, GPU.numXCDs, GPU.numCUs)
+    XCD = GPU.dispatch(MOverMT0*NOverMT1)[0]
+    ATileBytes = MT0*DU*elemSize
+    BTileBytes = MT1*DU*elemSize
+    rows = list()
+    seen = set()
+    for name, remap in candidateRemaps(grid, GPU, workGroupsPerCU, WGMs, blocks):
+        compiled = CompiledRemap(remap, grid)
+        permutation = compiled.permutation.tobytes()
+        if permutation in seen:
+            continue
+        seen.add(permutation)
+        valid = np.array_equal(np.sort(compiled.permutation), np.arange(len(compiled)))
+        mallBytes, hbmBytes = screenTraffic(compiled.newM, compiled.newN, XCD, MOverMT0, NOverMT1, KOverDU, ATileBytes, BTileBytes, GPU, workGroupsPerCU)
+        rows.append({'mapping': name, 'remap': remap, 'validMapping': valid, 'screenMALLBytes': mallBytes, 'screenHBMBytes': hbmBytes, 'refined': False})
+    rows = paretoLayers([row for row in rows if row['validMapping']])
+    rows.sort(key=lambda row: (row['paretoLayer'], row['screenHBMBytes'], row['screenMALLBytes']))
+
+    cache = openCache(cachePath) if cachePath is not None else None
+    params = dict(M=M, N=N, K=K, WGM=0, MT0=MT0, MT1=MT1, DU=DU, elemSize=elemSize, workGroupsPerCU=workGroupsPerCU)
+    for row in rows[:refine]:
+        wgm = WorkGroupMapping(GPU=GPU, verbose=False, mapping=row['remap'], **params)
+        result = wgm.result
+        row.update(refined=True, l2HitRate=result.hitRates()[0], mallHitRate=result.hitRates()[1], hbmHitRate=result.hitRates()[2],
+                   mallBytes=result.mallBytes, hbmBytes=result.hbmBytes, predictedSeconds=wgm.getPerformance(result).time)
+        if cache is not None:
+            cache.put(cache.key('simulate', GPU, dict(params, mapping=row['remap'])), {'levelRequests': result.levelRequests, 'levelBytes': result.levelBytes})
+    rows.sort(key=lambda row: (not row['refined'], row.get('hbmBytes', 0.0), row.get('predictedSeconds', 0.0), row['paretoLayer'], row['screenHBMBytes']))
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search WGM values and block remaps for one GEMM shape')
+    parser.add_argument('--problem', type=parseProblem, required=True, help='M,N,K[,elemSize]')
+    parser.add_argument('--MT0', type=int, default=64)
+    parser.add_argument('--MT1', type=int, default=512)
+    parser.add_argument('--DU', type=int, default=256)
+    parser.add_argument('--refine', type=int, default=4, help='candidates re-scored with the exact simulation')
+    parser.add_argument('--cache', default=None, help='SQLite result cache for the exact simulations')
+    args = parser.parse_args()
+    M, N, K, elemSize = args.problem
+    start = time.perf_counter()
+    rows = tune(M, N, K, MT0=args.MT0, MT1=args.MT1, DU=args.DU, elemSize=elemSize, refine=args.refine, cachePath=args.cache)
+    print('%d candidates kept in %.2fs'%(len(rows), time.perf_counter() - start))
+    for row in rows:
+        if row['refined']:
+            print('%-12s HBM %8.1f MiB (screen %8.1f MiB), hit-rate(l2,mall,hbm) (%.4f, %.4f, %.4f), %.1f us'%(
+                row['mapping'], row['hbmBytes']/2**20, row['screenHBMBytes']/2**20, row['l2HitRate'], row['mallHitRate'], row['hbmHitRate'], row['predictedSeconds']*1e6))
+        else:
+            print('%-12s screen HBM %8.1f MiB, MALL %8.1f MiB'%(row['mapping'], row['screenHBMBytes']/2**20, row['screenMALLBytes']/2**20))
@@ -1,13 +1,19 @@
 
-import math
+import heapq
+from collections import OrderedDict
+from collections.abc import Mapping
 import numpy as np
 import logging
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-import pdb
+import time
+from wgm_mapping import RemapGrid, IdentityRemap, WGMRemap, BlockRemap, CompiledRemap, getRemap
+
+# Bump whenever a simulator change alters results, so persisted results keyed on it are not reused
+simulatorVersion = 3
 
 class gfx9:
-    def __init__(self, numXCDs=8, chunkSize=1, numCUsPerXCD=32, L2BytesPerXCD=2097152*2, MALLBytes=268435456):
+    def __init__(self, numXCDs=8, chunkSize=1, numCUsPerXCD=32, L2BytesPerXCD=2097152*2, MALLBytes=268435456, cachePolicy='lru',
+                 L2LineBytes=128, L2Ways=16, L2Channels=16, L2ChannelInterleave=128, L2Hash='linear',
+                 L2BandwidthPerXCD=4.9e12, MALLBandwidth=17.2e12, HBMBandwidth=8e12, L2Latency=120e-9, MALLLatency=220e-9, HBMLatency=400e-9, peakFLOPS=10e15):
         self.numXCDs = numXCDs
         self.numCUsPerXCD = numCUsPerXCD
         self.chunkSize = chunkSize
@@ -15,12 +21,70 @@ class gfx9:
         self.currCU = dict()
         self.L2BytesPerXCD = L2BytesPerXCD
         self.MALLBytes = MALLBytes
+        self.cachePolicy = cachePolicy
+        # Line-granular L2 geometry for simulateL2Sets; L2Hash 'linear' takes the channel and set index straight from
+        # address bits, 'xor' folds all higher address bits into them
+        self.L2LineBytes = L2LineBytes
+        self.L2Ways = L2Ways
+        self.L2Channels = L2Channels
+        self.L2ChannelInterleave = L2ChannelInterleave
+        self.L2Hash = L2Hash
+        # Performance model for getPerformance: bytes/s, seconds and FLOP/s. The defaults are rough MI355X-class
+        # figures (FP4 dense peak), meant to be overridden with measured values
+        self.L2BandwidthPerXCD = L2BandwidthPerXCD
+        self.MALLBandwidth = MALLBandwidth
+        self.HBMBandwidth = HBMBandwidth
+        self.L2Latency = L2Latency
+        self.MALLLatency = MALLLatency
+        self.HBMLatency = HBMLatency
+        self.peakFLOPS = peakFLOPS
         for i in range(numXCDs):
             self.currCU[i] = 0
         self.CUsAllocated = 0
         self.currXCD = 0
         self.color = {0: '#b15928', 1: '#ffff99', 2: '#6a3d9a', 3: '#cab2d6', 4: '#a6cee3', 5: '#1f78b4', 6: '#b2df8a', 7: '#33a02c', 8: '#fb9a99', 9:'#e31a1c', 10: '#fdbf6f', 11: '#ff7f00'}
 
+    def config(self):
+        # Constructor arguments, enough to rebuild an equivalent gfx9 (e.g. in a worker process)
+        return {'numXCDs': self.numXCDs, 'chunkSize': self.chunkSize, 'numCUsPerXCD': self.numCUsPerXCD, 'L2BytesPerXCD': self.L2BytesPerXCD,
+                'MALLBytes': self.MALLBytes, 'cachePolicy': self.cachePolicy, 'L2LineBytes': self.L2LineBytes, 'L2Ways': self.L2Ways,
+                'L2Channels': self.L2Channels, 'L2ChannelInterleave': self.L2ChannelInterleave, 'L2Hash': self.L2Hash,
+                'L2BandwidthPerXCD': self.L2BandwidthPerXCD, 'MALLBandwidth': self.MALLBandwidth, 'HBMBandwidth': self.HBMBandwidth,
+                'L2Latency': self.L2Latency, 'MALLLatency': self.MALLLatency, 'HBMLatency': self.HBMLatency, 'peakFLOPS': self.peakFLOPS}
+
+    def L2Sets(self):
+        # Sets per XCD L2, numbered channel-major
+        numSets = self.L2BytesPerXCD//(self.L2LineBytes*self.L2Ways)
+        for name, value in (('L2LineBytes', self.L2LineBytes), ('L2Channels', self.L2Channels), ('L2ChannelInterleave', self.L2ChannelInterleave), ('sets per channel', numSets//self.L2Channels)):
+            if value < 1 or value & (value - 1):
+                raise ValueError('%s must be a power of two, got %d'%(name, value))
+        if self.L2ChannelInterleave < self.L2LineBytes:
+            raise ValueError('L2ChannelInterleave (%d) is smaller than L2LineBytes (%d)'%(self.L2ChannelInterleave, self.L2LineBytes))
+        if self.L2Hash not in ('linear', 'xor'):
+            raise ValueError("unknown L2Hash '%s', expected 'linear' or 'xor'"%self.L2Hash)
+        return numSets
+
+    def L2Location(self, addr):
+        # (channel, set) in an XCD's L2 of each byte address in the addr array. Consecutive L2ChannelInterleave blocks
+        # rotate over the channels; within a channel the remaining line-address bits pick the set.
+        setsPerChannel = self.L2Sets()//self.L2Channels
+        lineBits = self.L2LineBytes.bit_length() - 1
+        interleaveBits = self.L2ChannelInterleave.bit_length() - 1
+        channelBits = self.L2Channels.bit_length() - 1
+        xor = self.L2Hash == 'xor'
+        block = addr >> interleaveBits
+        channel = foldBits(block, channelBits, xor)
+        lineInChannel = ((block >> channelBits) << (interleaveBits - lineBits)) | ((addr >> lineBits) & ((1 << (interleaveBits - lineBits)) - 1))
+        return channel, channel*setsPerChannel + foldBits(lineInChannel, setsPerChannel.bit_length() - 1, xor)
+
+    def dispatch(self, numWorkGroups):
+        # Closed form of __call__ for a fresh launch: (XCD, CU) of every workgroup in launch order
+        linearWG = np.arange(numWorkGroups)
+        chunk = linearWG//self.chunkSize
+        XCD = chunk%self.numXCDs
+        CU = ((chunk//self.numXCDs)*self.chunkSize + linearWG%self.chunkSize)%self.numCUsPerXCD
+        return XCD, CU
+
     def __call__(self):
         while True:
             # Chunksize workgroups will be launched per XCD before moving to the next XCD. So if we know the # of the workgroup we are launching, we can   
@@ -31,25 +95,932 @@ class gfx9:
                 self.currXCD = (self.currXCD + 1)%self.numXCDs
                 self.CUsAllocated = 0
 
+def foldBits(value, width, xor=False):
+    # Low width bits of each value, or with xor every width-bit field of the value XORed together
+    mask = (1 << width) - 1
+    if not xor or width == 0:
+        return value & mask
+    folded = np.zeros_like(value)
+    while value.any():
+        folded ^= value & mask
+        value = value >> width
+    return folded
+
+# Replacement policies only track ordering; CacheLevel owns the bytes. Every operation is O(1) (O(log ways) for PLRU)
+class LRUPolicy:
+    def __init__(self, numWays=None):
+        # Least recently used entry first
+        self.order = OrderedDict()
+
+    def insert(self, key):
+        self.order[key] = None
+
+    def touch(self, key):
+        self.order.move_to_end(key)
+
+    def remove(self, key):
+        del self.order[key]
+
+    def victim(self):
+        return next(iter(self.order))
+
+    def hasRoom(self):
+        return True
+
+    # The whole replacement state is the key order, so it can be compared and relabelled
+    def orderedKeys(self):
+        return self.order.keys()
+
+    def relabel(self, delta):
+        self.order = OrderedDict.fromkeys(key + delta for key in self.order)
+
+class FIFOPolicy(LRUPolicy):
+    def touch(self, key):
+        # Hits do not change the insertion order
+        pass
+
+class TreePLRUPolicy:
+    def __init__(self, numWays):
+        if numWays is None:
+            raise ValueError('tree-PLRU needs a way count, pass a granule to CacheLevel')
+        self.numLeaves = 2
+        while self.numLeaves < numWays:
+            self.numLeaves *= 2
+        # bits[node] = 0 -> the victim is in the left subtree, 1 -> right subtree
+        self.bits = bytearray(self.numLeaves)
+        # Occupied leaves below each node so the victim walk never ends in an empty way
+        self.count = [0]*(2*self.numLeaves)
+        self.keyAt = [None]*self.numLeaves
+        self.slotOf = dict()
+        self.free = list(range(numWays - 1, -1, -1))
+
+    def insert(self, key):
+        slot = self.free.pop()
+        self.keyAt[slot] = key
+        self.slotOf[key] = slot
+        node = slot + self.numLeaves
+        while node:
+            self.count[node] += 1
+            node >>= 1
+        self.touch(key)
+
+    def touch(self, key):
+        node = self.slotOf[key] + self.numLeaves
+        while node > 1:
+            # Point the parent away from the way we just used
+            self.bits[node >> 1] = 0 if node & 1 else 1
+            node >>= 1
+
+    def remove(self, key):
+        slot = self.slotOf.pop(key)
+        self.keyAt[slot] = None
+        self.free.append(slot)
+        node = slot + self.numLeaves
+        while node:
+            self.count[node] -= 1
+            node >>= 1
+
+    def victim(self):
+        node = 1
+        while node < self.numLeaves:
+            node = 2*node + self.bits[node]
+            if self.count[node] == 0:
+                node ^= 1
+        return self.keyAt[node - self.numLeaves]
+
+    def hasRoom(self):
+        return len(self.free) > 0
+
+class RRIPPolicy:
+    def __init__(self, numWays=None, bits=2):
+        # Static RRIP: insert at maxRRPV-1, promote to 0 on a hit, evict the oldest entry at maxRRPV
+        self.maxRRPV = (1 << bits) - 1
+        self.levels = [OrderedDict() for _ in range(self.maxRRPV + 1)]
+        self.levelOf = dict()
+
+    def insert(self, key):
+        level = self.levels[self.maxRRPV - 1]
+        level[key] = None
+        self.levelOf[key] = level
+
+    def touch(self, key):
+        del self.levelOf[key][key]
+        self.levels[0][key] = None
+        self.levelOf[key] = self.levels[0]
+
+    def remove(self, key):
+        del self.levelOf.pop(key)[key]
+
+    def victim(self):
+        if not self.levels[-1]:
+            # Ageing every entry until one reaches maxRRPV is a rotation of the level buckets
+            top = max(i for i, level in enumerate(self.levels) if level)
+            shift = self.maxRRPV - top
+            self.levels = [OrderedDict() for _ in range(shift)] + self.levels[:len(self.levels) - shift]
+        return next(iter(self.levels[-1]))
+
+    def hasRoom(self):
+        return True
+
+cachePolicies = {'lru': LRUPolicy, 'fifo': FIFOPolicy, 'plru': TreePLRUPolicy, 'rrip': RRIPPolicy}
+
+class CacheLevel:
+    def __init__(self, capacity, policy='lru', granule=None):
+        # capacity in bytes; granule is the smallest entry size and sets the way count for PLRU
+        self.capacity = capacity
+        self.usage = 0
+        self.evictions = 0
+        self.entries = dict()
+        numWays = int(max(1, capacity//granule)) if granule else None
+        policyClass = cachePolicies[policy] if isinstance(policy, str) else policy
+        self.policy = policyClass(numWays)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def access(self, key, numBytes):
+        # Returns True on a hit, otherwise fetches the entry (evicting as needed) and returns False
+        if key in self.entries:
+            self.policy.touch(key)
+            return True
+        self.insert(key, numBytes)
+        return False
+
+    def insert(self, key, numBytes):
+        if numBytes > self.capacity:
+            # Larger than the whole level, streams through without allocating
+            return
+        while self.entries and (self.usage + numBytes > self.capacity or not self.policy.hasRoom()):
+            self.evict(self.policy.victim())
+        self.entries[key] = numBytes
+        self.usage += numBytes
+        self.policy.insert(key)
+
+    def fill(self, keys, numBytes):
+        # insert() of every key, oldest first, in bulk when they all fit an empty LRU/FIFO level
+        if not self.entries and isinstance(self.policy, LRUPolicy) and sum(numBytes) <= self.capacity and max(numBytes, default=0) <= self.capacity:
+            self.entries = dict(zip(keys, numBytes))
+            self.usage = sum(self.entries.values())
+            self.policy.order = OrderedDict.fromkeys(self.entries)
+            return
+        for key, size in zip(keys, numBytes):
+            self.insert(key, size)
+
+    def evict(self, key):
+        self.usage -= self.entries.pop(key)
+        self.policy.remove(key)
+        self.evictions += 1
+        return key
+
+    def signature(self, kSlice, KOverDU):
+        # Replacement state with every tile's kSlice taken relative to kSlice, None if the policy cannot expose it
+        if not hasattr(self.policy, 'orderedKeys'):
+            return None
+        keys = np.fromiter(self.policy.orderedKeys(), dtype=np.int64, count=len(self.entries))
+        return ((keys//KOverDU)*(2*KOverDU) + keys%KOverDU - kSlice + KOverDU).tobytes()
+
+    def relabel(self, delta):
+        # Moves every tile delta kSlices forward, keeping the replacement state
+        self.entries = {key + delta: numBytes for key, numBytes in self.entries.items()}
+        self.policy.relabel(delta)
+
+def simulateLevel(keys, numBytes, capacity, policy, granule):
+    # One cache level over a request stream, returns the hit mask. Module level so pool workers can run it
+    cache = CacheLevel(capacity, policy, granule)
+    return np.fromiter(map(cache.access, keys, numBytes), dtype=bool, count=len(keys))
+
+class CacheHierarchy:
+    # One L2 per XCD backed by the shared MALL; access() returns the level that served the request (0 L2, 1 MALL, 2 HBM)
+    levelNames = ('L2', 'MALL', 'HBM')
+
+    def __init__(self, GPU, policy=None, granule=None):
+        policy = GPU.cachePolicy if policy is None else policy
+        self.L2 = [CacheLevel(GPU.L2BytesPerXCD, policy, granule) for _ in range(GPU.numXCDs)]
+        self.MALL = CacheLevel(GPU.MALLBytes, policy, granule)
+
+    def access(self, xcd, key, numBytes):
+        if self.L2[xcd].access(key, numBytes):
+            return 0
+        if self.MALL.access(key, numBytes):
+            return 1
+        return 2
+
+    # The L2s only: the MALL outlives waves, so simulateSteadyState checks it separately and never relabels it
+    def L2Signature(self, kSlice, KOverDU):
+        signatures = tuple(level.signature(kSlice, KOverDU) for level in self.L2)
+        return None if None in signatures else signatures
+
+    def relabelL2(self, delta):
+        for level in self.L2:
+            level.relabel(delta)
+
+class SetAssociativeCache:
+    # numCaches independent caches (one per XCD) of numSets x numWays lines with LRU or FIFO replacement.
+    # access() serves a batch of line accesses vectorized over sets: round r serves the r-th access to every set
+    # in the batch, so a batch costs one NumPy round per access to its busiest set. Sets left with a long tail of
+    # accesses once rounds get narrower than minRound are finished one access at a time.
+    minRound = 16
+
+    def __init__(self, numCaches, numSets, numWays, policy='lru'):
+        if policy not in ('lru', 'fifo'):
+            raise ValueError("set-associative L2 supports 'lru' and 'fifo', not '%s'"%policy)
+        self.numSets = numSets
+        self.numWays = numWays
+        self.updateOnHit = policy == 'lru'
+        # Tag is the line address, -1 for an invalid way; stamp is the last use (LRU) or fill (FIFO), -1 when invalid
+        self.tags = np.full((numCaches*numSets, numWays), -1, dtype=np.int64)
+        self.stamps = np.full((numCaches*numSets, numWays), -1, dtype=np.int64)
+        self.clock = 0
+
+    def access(self, cache, setIndex, tags):
+        # cache, setIndex and tags are arrays of line accesses in issue order; returns the hit mask
+        numAccesses = len(tags)
+        sets = cache*self.numSets + setIndex
+        stamps = self.clock + np.arange(numAccesses)
+        self.clock += numAccesses
+        order = np.argsort(narrow(sets), kind='stable')
+        sortedSets = sets[order]
+        sortedTags = tags[order]
+        # A repeat of its set's previous access is a hit that leaves the set's order unchanged
+        repeat = np.r_[False, (sortedSets[1:] == sortedSets[:-1]) & (sortedTags[1:] == sortedTags[:-1])]
+        hits = np.empty(numAccesses, dtype=bool)
+        hits[order[repeat]] = True
+        order = order[~repeat]
+        sortedSets = sortedSets[~repeat]
+        firsts = np.flatnonzero(np.r_[True, sortedSets[1:] != sortedSets[:-1]])
+        rank = np.arange(len(order)) - np.repeat(firsts, np.diff(np.r_[firsts, len(order)]))
+        byRound = order[np.argsort(narrow(rank), kind='stable')]
+        # Gathered once in round order, so every round serves contiguous slices
+        roundSets = sets[byRound]
+        roundTags = tags[byRound]
+        roundStamps = stamps[byRound]
+        roundHits = np.empty(len(byRound), dtype=bool)
+        start = 0
+        for roundSize in np.bincount(rank).tolist():
+            if roundSize < self.minRound:
+                break
+            end = start + roundSize
+            roundHits[start:end] = self.serve(roundSets[start:end], roundTags[start:end], roundStamps[start:end])
+            start = end
+        hits[byRound[:start]] = roundHits[:start]
+        for index in np.sort(byRound[start:]).tolist():
+            hits[index] = self.serve(sets[index:index + 1], tags[index:index + 1], stamps[index:index + 1])[0]
+        return hits
+
+    def serve(self, sets, tags, stamps):
+        # One access to each of the distinct sets
+        match = self.tags[sets] == tags[:, None]
+        way = match.argmax(axis=1)
+        hit = match[np.arange(len(sets)), way]
+        miss = ~hit
+        way[miss] = self.stamps[sets[miss]].argmin(axis=1)
+        self.tags[sets, way] = tags
+        update = slice(None) if self.updateOnHit else miss
+        self.stamps[sets[update], way[update]] = stamps[update]
+        return hit
+
+def narrow(keys):
+    # Sort keys as uint16 when they fit, where NumPy's stable sort is a radix sort
+    return keys.astype(np.uint16) if len(keys) and keys.max() < 2**16 else keys
+
+class SetAssociativeResult:
+    # Line-granular L2 statistics. setMisses and setConflicts are (numXCDs, numSets) arrays, channelRequests is
+    # (numXCDs, L2Channels). Conflict misses are line misses of requests the fully associative tile-level L2 serves.
+    # With setSampleEvery > 1 only every setSampleEvery-th set was simulated: lineRequests and the miss counts cover
+    # those sets, so the rates are estimates, while channelRequests counts every line.
+    def __init__(self, lineRequests, setMisses, setConflicts, channelRequests, setSampleEvery=1):
+        self.lineRequests = lineRequests
+        self.setSampleEvery = setSampleEvery
+        self.setMisses = setMisses
+        self.setConflicts = setConflicts
+        self.channelRequests = channelRequests
+        self.lineMisses = int(setMisses.sum())
+        self.conflictMisses = int(setConflicts.sum())
+
+    def hitRate(self):
+        return 1 - self.lineMisses/self.lineRequests
+
+    def conflictFraction(self):
+        return self.conflictMisses/self.lineMisses if self.lineMisses else 0.0
+
+    def channelImbalance(self):
+        # Busiest channel's requests over the mean channel's, per XCD; 1.0 is perfectly balanced
+        mean = self.channelRequests.mean(axis=1)
+        return np.divide(self.channelRequests.max(axis=1), mean, out=np.ones(len(mean)), where=mean > 0)
+
+    def hotSets(self, count=8):
+        # (xcd, set, conflict misses) of the sets with the most conflict misses
+        flat = np.argsort(-self.setConflicts, axis=None, kind='stable')[:count]
+        xcd, setIndex = np.unravel_index(flat, self.setConflicts.shape)
+        return [(x, s, self.setConflicts[x, s].item()) for x, s in zip(xcd.tolist(), setIndex.tolist()) if self.setConflicts[x, s]]
+
+class SimulationResult:
+    def __init__(self, levelRequests, levelBytes, levels=None):
+        self.levelRequests = list(levelRequests)
+        self.levelBytes = list(levelBytes)
+        # Per-request serving level (0 L2, 1 MALL, 2 HBM) in trace order, when the engine kept it
+        self.levels = levels
+        self.numRequests = sum(self.levelRequests)
+        self.l2Hits, self.mallHits, self.hbmHits = self.levelRequests
+        self.l2Bytes, self.mallBytes, self.hbmBytes = self.levelBytes
+        # Set by engines that extrapolate: exact is False when some requests were estimated, and
+        # errorBound is then the worst-case absolute error of each hit fraction
+        self.exact = True
+        self.errorBound = 0.0
+        self.simulatedFraction = 1.0
+        # Bytes of write requests (split-K/Stream-K partial C tiles), which pass through the caches but are not counted
+        # in levelRequests/levelBytes
+        self.writeBytes = 0.0
+
+    @classmethod
+    def fromLevels(cls, levels, numBytes, write=None):
+        # write: per-request mask of writes, which only count towards writeBytes
+        if write is None:
+            return cls(np.bincount(levels, minlength=3).tolist(), np.bincount(levels, weights=numBytes, minlength=3).tolist(), levels)
+        read = ~write
+        result = cls(np.bincount(levels[read], minlength=3).tolist(), np.bincount(levels[read], weights=numBytes[read], minlength=3).tolist(), levels)
+        result.writeBytes = float(np.sum(numBytes[write]))
+        return result
+
+    def hitRates(self):
+        assert (self.l2Hits + self.mallHits + self.hbmHits) == self.numRequests
+        return self.l2Hits/self.numRequests, self.mallHits/self.numRequests, self.hbmHits/self.numRequests
+
+class PerformanceEstimate:
+    # Predicted runtime of one launch from its per-wave traffic. Each wave takes the longest of its L2 (busiest XCD),
+    # MALL, HBM and compute times, plus the latency of the deepest level it reads from; waves run back to back.
+    resources = ('L2', 'MALL', 'HBM', 'compute')
+
+    def __init__(self, waveBytes, waveWriteBytes, waveResourceTimes, waveLatency, flops, GPU):
+        # waveBytes: (numWaves, 3) bytes read from L2, MALL and HBM; waveWriteBytes: C-tile bytes written back to HBM;
+        # waveResourceTimes: (numWaves, 4) seconds each resource needs per wave, in the order of resources
+        self.waveBytes = waveBytes
+        self.waveWriteBytes = waveWriteBytes
+        self.waveResourceTimes = waveResourceTimes
+        self.waveMemoryTime = waveResourceTimes[:, :3].max(axis=1) + waveLatency
+        self.waveComputeTime = waveResourceTimes[:, 3]
+        self.waveTime = np.maximum(self.waveMemoryTime, self.waveComputeTime)
+        self.memoryTime = float(self.waveMemoryTime.sum())
+        self.computeTime = float(self.waveComputeTime.sum())
+        self.time = float(self.waveTime.sum())
+        self.flops = flops
+        self.l2Bytes, self.mallBytes, self.hbmBytes = waveBytes.sum(axis=0).tolist()
+        self.writeBytes = float(waveWriteBytes.sum())
+        # Roofline against HBM: FLOPs per byte read or written, and the intensity where compute takes over
+        self.arithmeticIntensity = flops/(self.hbmBytes + self.writeBytes)
+        self.ridgePoint = GPU.peakFLOPS/GPU.HBMBandwidth
+        self.rooflineFLOPS = min(GPU.peakFLOPS, self.arithmeticIntensity*GPU.HBMBandwidth)
+        self.achievedFLOPS = flops/self.time
+        # Resource that bounds most of the runtime
+        withLatency = waveResourceTimes.copy()
+        withLatency[:, :3] += waveLatency[:, None]
+        limiter = withLatency.argmax(axis=1)
+        self.boundBy = self.resources[int(np.bincount(limiter, weights=self.waveTime, minlength=4).argmax())]
+
+    def bandwidths(self):
+        # Average achieved bytes/s per level over the predicted runtime, C write-back counted against HBM
+        return {'L2': (self.l2Bytes + self.mallBytes + self.hbmBytes + self.writeBytes)/self.time,
+                'MALL': (self.mallBytes + self.hbmBytes + self.writeBytes)/self.time,
+                'HBM': (self.hbmBytes + self.writeBytes)/self.time}
+
+class SampledResult:
+    # Hit fractions estimated from a stratified sample of waves, with confidence intervals for the sampling error widened
+    # by an estimate of the warm-up bias; bench_wgm.py --validate-sampling checks them against the exact engine.
+    def __init__(self, estimates, halfWidths, confidence, sampledWaves, numWaves, simulatedFraction):
+        self.estimates = tuple(float(value) for value in estimates)
+        self.halfWidths = tuple(float(value) for value in halfWidths)
+        self.confidence = confidence
+        self.confidenceIntervals = tuple((value - width, value + width) for value, width in zip(self.estimates, self.halfWidths))
+        self.sampledWaves = sampledWaves
+        self.numWaves = numWaves
+        # Requests replayed, including warm-up waves, over requests in the full trace
+        self.simulatedFraction = simulatedFraction
+
+    def hitRates(self):
+        return self.estimates
+
+class Instrumentation:
+    # Counters per (XCD, wave, kSlice): requests served by each level (levelCounts, last axis L2/MALL/HBM) and, with
+    # evictions, the L2 and MALL evictions those requests caused, in arrays allocated from the trace's wave and kSlice
+    # extents before the run. Optionally every sampleEvery-th request (clk a multiple of sampleEvery) is logged to a
+    # ring buffer that keeps the last ringSize of them, and hooks are called as hook(clk, xcd, tileID, level,
+    # l2Evictions, mallEvictions) for every request. Level counts alone come from the finished result at no cost per
+    # request; evictions, events and hooks replay the trace on a separate, slower instrumented loop.
+    eventFields = [('clk', np.int64), ('wg', np.int64), ('xcd', np.int16), ('kSlice', np.int32), ('tileID', np.int64),
+                   ('level', np.int8), ('l2Evictions', np.int16), ('mallEvictions', np.int16)]
+
+    def __init__(self, evictions=False, sampleEvery=0, ringSize=65536, hooks=None):
+        self.evictions = evictions
+        self.sampleEvery = sampleEvery
+        self.ringSize = ringSize
+        self.hooks = list(hooks or [])
+        self.levelCounts = None
+        self.l2Evictions = None
+        self.mallEvictions = None
+        self.events = np.zeros(ringSize if sampleEvery else 0, dtype=self.eventFields)
+        # Records written to the ring buffer, and requests sampled, which includes those the ring no longer holds
+        self.numEvents = 0
+        self.numSampled = 0
+
+    def attach(self, hook):
+        self.hooks.append(hook)
+        return hook
+
+    def perRequest(self):
+        # Whether the trace must go through the instrumented replay loop
+        return self.evictions or self.sampleEvery > 0 or bool(self.hooks)
+
+    def allocate(self, trace, workGroupsPerWave, evictions):
+        # Zeroed counters shaped by the trace's XCDs, waves and kSlices, reusing the previous run's arrays when the
+        # shape matches; returns each request's flat counter cell
+        numWaves = int(trace.wg.max())//workGroupsPerWave + 1 if len(trace) else 0
+        shape = (trace.numXCDs, numWaves, trace.KOverDU)
+        if self.levelCounts is None or self.levelCounts.shape[:3] != shape:
+            self.levelCounts = np.zeros(shape + (3,), dtype=np.int64)
+        else:
+            self.levelCounts.fill(0)
+        # Counters of an earlier run must not survive a run without evictions
+        if not evictions:
+            self.l2Evictions = self.mallEvictions = None
+        elif self.l2Evictions is None or self.l2Evictions.shape != shape:
+            self.l2Evictions = np.zeros(shape, dtype=np.int64)
+            self.mallEvictions = np.zeros(shape, dtype=np.int64)
+        else:
+            self.l2Evictions.fill(0)
+            self.mallEvictions.fill(0)
+        return (trace.xcd.astype(np.int64)*numWaves + trace.wg//workGroupsPerWave)*trace.KOverDU + trace.kSlice
+
+    def collect(self, trace, levels, workGroupsPerWave):
+        # Fills the level counters from per-request levels in trace order, replacing any earlier run's
+        cell = self.allocate(trace, workGroupsPerWave, False)
+        self.levelCounts.reshape(-1)[:] = np.bincount(cell*3 + levels, minlength=self.levelCounts.size)
+
+    def sampledRequests(self, numRequests):
+        # clks the ring buffer retains: the last ringSize multiples of sampleEvery
+        numSampled = -(-numRequests//self.sampleEvery)
+        return range(max(0, numSampled - self.ringSize)*self.sampleEvery, numRequests, self.sampleEvery), numSampled
+
+    def recordEvents(self, trace, clks, levels, l2Evictions, mallEvictions, numSampled):
+        # Appends the retained sampled requests' events to the ring buffer; numSampled counts every sampled request
+        for clk in clks:
+            slot = self.numEvents%self.ringSize
+            self.events[slot] = (trace.clk[clk], trace.wg[clk], trace.xcd[clk], trace.kSlice[clk], trace.tileID[clk], levels[clk], l2Evictions[clk], mallEvictions[clk])
+            self.numEvents += 1
+        self.numSampled += numSampled
+
+    def eventLog(self):
+        # Ring buffer contents, oldest first
+        if self.numEvents <= self.ringSize:
+            return self.events[:self.numEvents]
+        start = self.numEvents%self.ringSize
+        return np.concatenate([self.events[start:], self.events[:start]])
+
+    def waveSummary(self):
+        # Per-wave totals: requests served by L2/MALL/HBM and evictions, e.g. to find the waves that thrash the MALL
+        summary = {'l2Hits': self.levelCounts[..., 0].sum(axis=(0, 2)), 'mallHits': self.levelCounts[..., 1].sum(axis=(0, 2)),
+                   'hbmHits': self.levelCounts[..., 2].sum(axis=(0, 2))}
+        if self.l2Evictions is not None:
+            summary['l2Evictions'] = self.l2Evictions.sum(axis=(0, 2))
+            summary['mallEvictions'] = self.mallEvictions.sum(axis=(0, 2))
+        return summary
+
+    def export(self, path):
+        # Counters and the event log as a compressed .npz
+        arrays = {'levelCounts': self.levelCounts, 'events': self.eventLog(), 'numSampled': self.numSampled}
+        if self.l2Evictions is not None:
+            arrays['l2Evictions'] = self.l2Evictions
+            arrays['mallEvictions'] = self.mallEvictions
+        np.savez_compressed(path, **arrays)
+
+class AccessTrace:
+    # Structure-of-arrays access stream, one entry per tile request in issue order.
+    # Tile IDs: A(m,k) -> m*KOverDU + k, B(k,n) -> MOverMT0*KOverDU + n*KOverDU + k, and for split-K/Stream-K the
+    # partial C tile of segment j -> MOverMT0*KOverDU + NOverMT1*KOverDU + j
+    A, B, C = 0, 1, 2
+
+    def __init__(self, clk, xcd, operand, tileID, numBytes, wg, kSlice, numXCDs, KOverDU, numATiles):
+        self.clk = clk
+        self.xcd = xcd
+        self.operand = operand
+        self.tileID = tileID
+        self.numBytes = numBytes
+        self.wg = wg
+        self.kSlice = kSlice
+        self.numXCDs = numXCDs
+        self.KOverDU = KOverDU
+        self.numATiles = numATiles
+        # Issue time and CU of every request for event-driven traces, None for the lockstep trace
+        self.time = None
+        self.cu = None
+        # With split-K/Stream-K, whether each request writes (a partial C tile) and the launch-order tile it works
+        # on (wg is then a workgroup, not a tile); None when workgroups are tiles
+        self.write = None
+        self.tile = None
+
+    def __len__(self):
+        return len(self.clk)
+
+    def decodeTile(self, tileID):
+        # (operand, row or column of the output tile, kSlice) of an A or B tile
+        if tileID < self.numATiles:
+            return self.A, tileID//self.KOverDU, tileID%self.KOverDU
+        tileID -= self.numATiles
+        return self.B, tileID//self.KOverDU, tileID%self.KOverDU
+
+    def replay(self, model):
+        # Any model with access(xcd, key, numBytes) -> level can consume the trace
+        access = model.access
+        levels = np.fromiter(map(access, self.xcd.tolist(), self.tileID.tolist(), self.numBytes.tolist()), dtype=np.int8, count=len(self))
+        return SimulationResult.fromLevels(levels, self.numBytes, self.write)
+
+class EventDispatcher:
+    # Discrete-event model of workgroup dispatch. Workgroups keep their static XCD (gfx9.dispatch), but within an XCD
+    # each one starts as soon as one of the workGroupsPerCU slots of any CU frees up, earliest slot first (ties by slot,
+    # then CU, as the lockstep round-robin). Each slot runs at 1/workGroupsPerCU of its CU, and each workgroup's kSlices
+    # take the same time, scaled by a lognormal factor with sigma jitter. With no jitter the resulting trace is the
+    # lockstep one.
+    def __init__(self, GPU, workGroupsPerCU=1, jitter=0.0, seed=0):
+        self.GPU = GPU
+        self.workGroupsPerCU = workGroupsPerCU
+        self.jitter = jitter
+        self.seed = seed
+
+    def sliceTimes(self, numWorkGroups):
+        # Time each workgroup spends on one kSlice, in units of a kSlice on an unshared CU
+        if not self.jitter:
+            return np.full(numWorkGroups, float(self.workGroupsPerCU))
+        return self.workGroupsPerCU*np.random.default_rng(self.seed).lognormal(0.0, self.jitter, numWorkGroups)
+
+    def schedule(self, XCD, sliceTimes, KOverDU, release=None):
+        # Start time and CU of every workgroup, in launch order. One heap of (free time, slot, CU) per XCD.
+        # KOverDU may differ per workgroup; with release, no workgroup starts before its release time.
+        start = [0.0]*len(XCD)
+        CU = [0]*len(XCD)
+        durations = (sliceTimes*KOverDU).tolist()
+        release = [0.0]*len(XCD) if release is None else np.asarray(release, dtype=float).tolist()
+        for xcd in range(self.GPU.numXCDs):
+            slots = [(0.0, slot, cu) for slot in range(self.workGroupsPerCU) for cu in range(self.GPU.numCUsPerXCD)]
+            for wg in np.flatnonzero(XCD == xcd).tolist():
+                freeTime, slot, cu = slots[0]
+                freeTime = max(freeTime, release[wg])
+                start[wg] = freeTime
+                CU[wg] = cu
+                heapq.heapreplace(slots, (freeTime + durations[wg], slot, cu))
+        return np.array(start), np.array(CU, dtype=np.int64)
+
+class FenwickTree:
+    def __init__(self, size):
+        self.size = size
+        self.tree = [0]*(size + 1)
+
+    def add(self, index, delta):
+        index += 1
+        while index <= self.size:
+            self.tree[index] += delta
+            index += index & -index
+
+    def prefix(self, index):
+        # Sum over [0, index)
+        total = 0
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+def stackDistances(keys, numBytes):
+    # Byte-weighted LRU stack distance of every access (inf for first touches), O(N log N).
+    # With byte-capacity LRU an access hits iff its distance <= capacity.
+    keys = keys.tolist() if isinstance(keys, np.ndarray) else list(keys)
+    numBytes = numBytes.tolist() if isinstance(numBytes, np.ndarray) else list(numBytes)
+    tree = FenwickTree(len(keys))
+    lastUse = dict()
+    distances = np.full(len(keys), np.inf)
+    live = 0
+    for clk, (key, size) in enumerate(zip(keys, numBytes)):
+        prev = lastUse.get(key)
+        if prev is not None:
+            # Bytes of every distinct key touched since prev, plus the key itself
+            distances[clk] = live - tree.prefix(prev + 1) + size
+            tree.add(prev, -size)
+            live -= size
+        tree.add(clk, size)
+        live += size
+        lastUse[key] = clk
+    return distances
+
+class StackDistanceProfile:
+    def __init__(self, distances):
+        self.distances = distances
+        self.sortedDistances = np.sort(distances)
+        self.numRequests = len(distances)
+
+    def hits(self, capacity):
+        return int(np.searchsorted(self.sortedDistances, capacity, side='right'))
+
+    def hitRate(self, capacity):
+        return self.hits(capacity)/self.numRequests if self.numRequests else 0.0
+
+    def curve(self, capacities):
+        capacities = np.asarray(capacities)
+        hits = np.searchsorted(self.sortedDistances, capacities, side='right')
+        return hits/max(self.numRequests, 1)
+
+class ReuseProfile:
+    # Hit rate vs capacity for every per-XCD L2 and the shared MALL from one pass per stream.
+    # The MALL sees the L2 miss stream, so its profile is built (and cached) per L2 capacity.
+    def __init__(self, trace):
+        self.trace = trace
+        self.l2Distances = np.empty(len(trace))
+        self.l2ByXCD = dict()
+        for xcd in range(trace.numXCDs):
+            requests = np.flatnonzero(trace.xcd == xcd)
+            distances = stackDistances(trace.tileID[requests], trace.numBytes[requests])
+            self.l2Distances[requests] = distances
+            self.l2ByXCD[xcd] = StackDistanceProfile(distances)
+        self.l2 = StackDistanceProfile(self.l2Distances)
+        self.mallProfiles = dict()
+
+    def mall(self, L2Bytes):
+        if L2Bytes not in self.mallProfiles:
+            misses = np.flatnonzero(self.l2Distances > L2Bytes)
+            self.mallProfiles[L2Bytes] = StackDistanceProfile(stackDistances(self.trace.tileID[misses], self.trace.numBytes[misses]))
+        return self.mallProfiles[L2Bytes]
+
+    def hitRates(self, L2Bytes, MALLBytes):
+        # Same (l2, mall, hbm) fractions getHitRates reports for LRU at this capacity point
+        numRequests = len(self.trace)
+        l2Hits = self.l2.hits(L2Bytes)
+        mallHits = self.mall(L2Bytes).hits(MALLBytes)
+        return l2Hits/numRequests, mallHits/numRequests, (numRequests - l2Hits - mallHits)/numRequests
+
+    def l2Curve(self, capacities):
+        return self.l2.curve(capacities)
+
+    def mallCurve(self, capacities, L2Bytes):
+        # Fraction of all requests served by the MALL at each MALL capacity
+        return self.mall(L2Bytes).curve(capacities)*self.mall(L2Bytes).numRequests/max(len(self.trace), 1)
+
+def firstOccurrences(keys, numKeys):
+    # Mask of the requests that touch their key for the first time, O(len(keys) + numKeys)
+    first = np.full(numKeys, len(keys), dtype=np.int64)
+    np.minimum.at(first, keys, np.arange(len(keys)))
+    return first[keys] == np.arange(len(keys))
+
+def countDistinct(group, value, numGroups, numValues):
+    # Distinct values per group: a numGroups x numValues bitmap when that is not much larger than the input,
+    # otherwise a sort
+    if numGroups*numValues <= 8*len(value) + 2**20:
+        seen = np.zeros(numGroups*numValues, dtype=bool)
+        seen[group*numValues + value] = True
+        return seen.reshape(numGroups, numValues).sum(axis=1)
+    keys = np.sort(group*numValues + value)
+    return np.bincount(keys[np.r_[True, keys[1:] != keys[:-1]]]//numValues, minlength=numGroups)
+
+class FootprintProfile:
+    # Infinite-capacity reference model. xcdRows/xcdCols: distinct A rows / B columns per (wave, XCD); waveRows/waveCols:
+    # distinct per wave over all XCDs; firstOnXCD/firstOverall: per workgroup and operand (A, B), whether the request is
+    # the first to its row/column on that XCD / anywhere. Every row and column stands for KOverDU tiles.
+    def __init__(self, xcdRows, xcdCols, waveRows, waveCols, firstOnXCD, firstOverall, KOverDU, ATileBytes, BTileBytes):
+        self.xcdRows = xcdRows
+        self.xcdCols = xcdCols
+        self.waveRows = waveRows
+        self.waveCols = waveCols
+        self.KOverDU = KOverDU
+        # Working sets: one kSlice on one XCD's L2, and a whole wave (every kSlice) on the MALL
+        self.xcdSliceBytes = xcdRows*ATileBytes + xcdCols*BTileBytes
+        self.waveBytes = (waveRows*ATileBytes + waveCols*BTileBytes)*KOverDU
+        self.numWorkGroupRequests = firstOnXCD.size
+        self.l2Misses = int(firstOnXCD.sum())
+        self.hbmHits = int(firstOverall.sum())
+        # Compulsory-miss floor over the whole launch: requests and bytes every finite cache must miss at least
+        self.numRequests = self.numWorkGroupRequests*KOverDU
+        self.l2MissFloor = self.l2Misses*KOverDU
+        self.hbmFloor = self.hbmHits*KOverDU
+        tileBytes = np.array([ATileBytes, BTileBytes])
+        self.l2MissBytesFloor = float((firstOnXCD.sum(axis=0)*tileBytes).sum())*KOverDU
+        self.hbmBytesFloor = float((firstOverall.sum(axis=0)*tileBytes).sum())*KOverDU
+
+    def hitRates(self):
+        # (l2, mall, hbm) fractions with unbounded L2s and MALL
+        numRequests = self.numWorkGroupRequests
+        return (numRequests - self.l2Misses)/numRequests, (self.l2Misses - self.hbmHits)/numRequests, self.hbmHits/numRequests
+
+    def violations(self, result):
+        # Ways a full-launch simulation result beats the compulsory floor, which a correct simulator never does
+        found = list()
+        if result.numRequests != self.numRequests:
+            found.append('%d requests simulated, expected %d'%(result.numRequests, self.numRequests))
+        if result.mallHits + result.hbmHits < self.l2MissFloor:
+            found.append('%d L2 misses, below the compulsory %d'%(result.mallHits + result.hbmHits, self.l2MissFloor))
+        if result.hbmHits < self.hbmFloor:
+            found.append('%d HBM requests, below the compulsory %d'%(result.hbmHits, self.hbmFloor))
+        if result.hbmBytes < self.hbmBytesFloor:
+            found.append('%d HBM bytes, below the compulsory %d'%(result.hbmBytes, self.hbmBytesFloor))
+        return found
+
 class WorkGroup:
-    def __init__(self, m, n, new_m, new_n, xcd, cu, color, width=0.1, height=0.1):
+    def __init__(self, m, n, new_m, new_n, xcd, cu, color, width=0.1, height=0.1, extras=None):
         self.m = m
         self.n = n
         self.new_m = new_m
         self.new_n = new_n
         self.xcd = xcd
         self.cu = cu
+        self.color = color
         self.width = width
         self.height = height
-        self.rect = patches.Rectangle((self.width*self.n, self.height*self.m), self.width, self.height, linewidth=1, edgecolor='k', facecolor='none')
-        self.new_rect = patches.Rectangle((self.width*self.new_n, self.height*self.new_m), self.width, self.height, linewidth=1, edgecolor='k', facecolor=color, alpha=0.25)
-
-
-
+        self.extras = dict() if extras is None else extras
+        self._rect = None
+        self._new_rect = None
+
+    # Patches are only built (and matplotlib only imported) when something is plotted
+    @property
+    def rect(self):
+        if self._rect is None:
+            from wgm_plot import workGroupRect
+            self._rect = workGroupRect(self)
+        return self._rect
+
+    @property
+    def new_rect(self):
+        if self._new_rect is None:
+            from wgm_plot import newWorkGroupRect
+            self._new_rect = newWorkGroupRect(self)
+        return self._new_rect
+
+class WorkGroupTable:
+    # Structure-of-arrays mapping indexed by launch order, linear = n*MOverMT0 + m
+    def __init__(self, GPU, MOverMT0, NOverMT1, new_m, new_n, xcd, cu, extras=None, width=0.1, height=0.1):
+        self.GPU = GPU
+        self.MOverMT0 = MOverMT0
+        self.NOverMT1 = NOverMT1
+        self.numWorkGroups = MOverMT0*NOverMT1
+        linear = np.arange(self.numWorkGroups)
+        self.m = linear%MOverMT0
+        self.n = linear//MOverMT0
+        self.new_m = np.asarray(new_m, dtype=np.int64)
+        self.new_n = np.asarray(new_n, dtype=np.int64)
+        self.xcd = np.asarray(xcd, dtype=np.int64)
+        self.cu = np.asarray(cu, dtype=np.int64)
+        self.extras = dict() if extras is None else extras
+        self.width = width
+        self.height = height
+        # Launch index of the workgroup computing each output tile, -1 where no workgroup lands
+        self.newIndex = np.full(self.numWorkGroups, -1, dtype=np.int64)
+        inGrid = (self.new_m >= 0) & (self.new_m < MOverMT0) & (self.new_n >= 0) & (self.new_n < NOverMT1)
+        self.newIndex[self.new_n[inGrid]*MOverMT0 + self.new_m[inGrid]] = linear[inGrid]
+        self._objects = dict()
+
+    def __len__(self):
+        return self.numWorkGroups
+
+    def index(self, m, n):
+        return n*self.MOverMT0 + m
+
+    def indexOfNew(self, new_m, new_n):
+        if not (0 <= new_m < self.MOverMT0 and 0 <= new_n < self.NOverMT1):
+            return -1
+        return int(self.newIndex[new_n*self.MOverMT0 + new_m])
+
+    def workGroup(self, index):
+        # WorkGroup objects are materialized on demand and reused so both views share them
+        wg = self._objects.get(index)
+        if wg is None:
+            xcd = int(self.xcd[index])
+            extras = {name: int(values[index]) for name, values in self.extras.items()}
+            wg = WorkGroup(int(self.m[index]), int(self.n[index]), int(self.new_m[index]), int(self.new_n[index]), xcd, int(self.cu[index]), self.GPU.color[xcd%len(self.GPU.color)], width=self.width, height=self.height, extras=extras)
+            self._objects[index] = wg
+        return wg
+
+class WorkGroupView(Mapping):
+    # Read-only dict-like access to the table keyed by launch (m, n) or by remapped (new_m, new_n)
+    def __init__(self, table, remapped=False):
+        self.table = table
+        self.remapped = remapped
+
+    def _index(self, key):
+        m, n = key
+        if self.remapped:
+            return self.table.indexOfNew(m, n)
+        if 0 <= m < self.table.MOverMT0 and 0 <= n < self.table.NOverMT1:
+            return self.table.index(m, n)
+        return -1
+
+    def __getitem__(self, key):
+        index = self._index(key)
+        if index < 0:
+            raise KeyError(key)
+        return self.table.workGroup(index)
+
+    def __iter__(self):
+        if self.remapped:
+            for index in self.table.newIndex[self.table.newIndex >= 0].tolist():
+                yield (int(self.table.new_m[index]), int(self.table.new_n[index]))
+        else:
+            for n in range(self.table.NOverMT1):
+                for m in range(self.table.MOverMT0):
+                    yield (m, n)
+
+    def __len__(self):
+        if self.remapped:
+            return int(np.count_nonzero(self.table.newIndex >= 0))
+        return self.table.numWorkGroups
+
+class WorkDecomposition:
+    # How workgroups cover segments (launch-order tile, kSlice range); segments are ordered by workgroup, then step
+    # (iteration index within the workgroup).
+    #   'data-parallel': workgroup t computes tile t over every kSlice.
+    #   'split-k': splitK workgroups per tile, the split outermost in launch order (workgroup s*numTiles + t), each
+    #       over a contiguous share of the kSlices.
+    #   'stream-k': numWorkGroups persistent workgroups split the (tile, kSlice) iteration space, tile by tile, into
+    #       equal contiguous ranges that cross tile boundaries.
+    # Workgroups dispatch to XCDs and CUs as GPU.dispatch numbers them.
+    kinds = ('data-parallel', 'split-k', 'stream-k')
+
+    def __init__(self, kind, numTiles, KOverDU, GPU, splitK=1, numWorkGroups=None):
+        if kind not in self.kinds:
+            raise ValueError("unknown decomposition '%s', expected one of %s"%(kind, ', '.join(self.kinds)))
+        self.kind = kind
+        if kind == 'data-parallel':
+            self.wg = np.arange(numTiles)
+            self.tile = np.arange(numTiles)
+            self.kStart = np.zeros(numTiles, dtype=np.int64)
+            self.length = np.full(numTiles, KOverDU)
+            self.step0 = np.zeros(numTiles, dtype=np.int64)
+            self.numWorkGroups = numTiles
+        elif kind == 'split-k':
+            if not 1 <= splitK <= KOverDU:
+                raise ValueError('splitK must be between 1 and KOverDU=%d, got %d'%(KOverDU, splitK))
+            self.wg = np.arange(splitK*numTiles)
+            split = self.wg//numTiles
+            self.tile = self.wg%numTiles
+            self.kStart = split*KOverDU//splitK
+            self.length = (split + 1)*KOverDU//splitK - self.kStart
+            self.step0 = np.zeros(len(self.wg), dtype=np.int64)
+            self.numWorkGroups = splitK*numTiles
+        else:
+            numIterations = numTiles*KOverDU
+            self.numWorkGroups = min(numWorkGroups, numIterations)
+            wgBounds = np.arange(self.numWorkGroups + 1)*numIterations//self.numWorkGroups
+            bounds = np.union1d(wgBounds, np.arange(numTiles + 1)*KOverDU)
+            start = bounds[:-1]
+            self.wg = np.searchsorted(wgBounds, start, side='right') - 1
+            self.tile = start//KOverDU
+            self.kStart = start%KOverDU
+            self.length = np.diff(bounds)
+            self.step0 = start - wgBounds[self.wg]
+        self.iterations = np.bincount(self.wg, weights=self.length, minlength=self.numWorkGroups).astype(np.int64)
+        # Segments per tile; tiles with more than one need partial C tiles and a reduction
+        self.contributors = np.bincount(self.tile, minlength=numTiles)
+        self.xcd, self.cu = GPU.dispatch(self.numWorkGroups)
+        # partials() of the lockstep order, cached by WorkGroupMapping.getWorkTrace
+        self.lockstepPartials = None
+
+    def __len__(self):
+        return len(self.wg)
+
+    def partials(self, finish):
+        # (writers, readers) for the given per-segment finish order: every segment of a shared tile but the last to
+        # finish (ties by workgroup) writes a partial C tile, which that last segment, its reader, reads back
+        byTile = np.lexsort((self.wg, finish, self.tile))
+        last = byTile[np.r_[np.flatnonzero(np.diff(self.tile[byTile])), len(byTile) - 1]]
+        reducer = np.full(len(self.contributors), -1)
+        reducer[self.tile[last]] = last
+        isLast = np.zeros(len(self), dtype=bool)
+        isLast[last] = True
+        writers = np.flatnonzero((self.contributors[self.tile] > 1) & ~isLast)
+        return writers, reducer[self.tile[writers]]
+
+    def waveEfficiency(self, workGroupsPerWave):
+        # Busy fraction of the workgroup slots when every lockstep wave lasts as long as its longest workgroup
+        wave = np.arange(self.numWorkGroups)//workGroupsPerWave
+        longest = np.zeros(int(wave[-1]) + 1, dtype=np.int64)
+        np.maximum.at(longest, wave, self.iterations)
+        return float(self.iterations.sum()/(longest.sum()*workGroupsPerWave))
 
 class WorkGroupMapping:
-
-    def __init__(self, M, N, K, WGM, GPU, MT0=64, MT1=512, DU=256, workGroupsPerCU=1, width=0.1, height=0.1, elemSize=0.5, customWGM=False,debug=False):
+    # Longest grid side, in tiles, plotWorkGroups/plotNewWorkGroups draw with patches (2 inches per tile) before switching to plotTileMaps
+    maxPatchSide = 32
+
+    # Pipeline stages in order, with the constructor arguments and gfx9 settings each depends on besides the stages
+    # before it. The mapping lives in attributes (remap, table, ...); the others are computed on first use into stages.
+    stageOrder = ('mapping', 'work', 'trace', 'l2Misses', 'result')
+    stageInputs = {'mapping': {'M', 'N', 'MT0', 'MT1', 'WGM', 'customWGM', 'mapping', 'width', 'height', 'numXCDs', 'chunkSize', 'numCUsPerXCD'},
+                   'work': {'K', 'DU', 'decomposition', 'splitK', 'streamKWorkGroups', 'workGroupsPerCU'},
+                   'trace': {'elemSize', 'accumElemSize'},
+                   'l2Misses': {'L2BytesPerXCD', 'cachePolicy'},
+                   'result': {'MALLBytes', 'debug'}}
+
+    def __init__(self, M, N, K, WGM, GPU, MT0=64, MT1=512, DU=256, workGroupsPerCU=1, width=0.1, height=0.1, elemSize=0.5, customWGM=False,debug=False, verbose=False, mapping=None,
+                 decomposition='data-parallel', splitK=1, streamKWorkGroups=None, accumElemSize=4):
+        # Construction only builds the mapping; the simulation runs on first access to result (printing its hit rates
+        # with verbose) and is cached, as are the trace and L2 miss streams it is built from.
+        # decomposition ('data-parallel', 'split-k' with splitK splits, or 'stream-k' over streamKWorkGroups persistent
+        # workgroups, default one wave) sets how workgroups cover tiles and kSlices (see WorkDecomposition); partial C
+        # tiles hold accumElemSize-byte accumulators
         self.M = M
         self.N = N
         self.K = K
@@ -60,440 +1031,872 @@ class WorkGroupMapping:
         self.MT1 = MT1
         self.DU = DU
         self.workGroupsPerCU = workGroupsPerCU
+        self.debug = debug
+        self.verbose = verbose
+        self.width = width
+        self.height = height
+        self.customWGM = customWGM
+        self.mappingArgument = mapping
+        self.decomposition = decomposition
+        self.splitK = splitK
+        self.streamKWorkGroups = streamKWorkGroups
+        self.accumElemSize = accumElemSize
+        self.shape()
+        self.buildMapping()
+        self.stages = dict()
+
+    def shape(self):
         self.MOverMT0 = self.M//self.MT0
         self.NOverMT1 = self.N//self.MT1
         self.KOverDU = self.K//self.DU
         self.ATileBytes = self.MT0*self.DU*self.elemSize
         self.BTileBytes = self.MT1*self.DU*self.elemSize
         self.CTileBytes = self.MT0*self.MT1*self.elemSize
-        self.debug = debug
+        self.partialTileBytes = self.MT0*self.MT1*self.accumElemSize
         if self.WGM != 0:
             self.numWGMSets = self.NOverMT1//self.WGM
-            self.numFullWG = self.NOverMT1//self.WGM
-            self.remainder = self.NOverMT1%self.WGM
-        cuGen = self.GPU()
-        self.width = width
-        self.height = height
-        self.customWGM = customWGM
-        self.workGroups = dict()
-        self.newWorkGroups = dict()
-        for y in range(self.NOverMT1):
-            for x in range(self.MOverMT0):
-                wg = (x, y)
-                if self.WGM != 0:
-                    if self.customWGM:
-                        new_wg, extras = self.getCustomNewWorkGroup(wg)
-                    else:
-                        new_wg, extras = self.getNewWorkGroup(wg)
-                else:
-                    new_wg = wg
-                XCD, CU, color = next(cuGen)
-                self.workGroups[wg] = WorkGroup(x, y, new_wg[0], new_wg[1], XCD, CU, color, width=self.width, height=self.height)
-                self.workGroups[wg].extras = extras
-        for x in range(self.MOverMT0):
-            for y in range(self.NOverMT1):
-                wg = (x, y)
-                if self.WGM != 0:
-                    if self.customWGM:
-                        new_wg, extras = self.getCustomNewWorkGroup(wg)
-                    else:
-                        new_wg, extras = self.getNewWorkGroup(wg)
-                else:
-                    new_wg = wg
-                new_wg = (new_wg[0], new_wg[1])
-                self.newWorkGroups[new_wg] = self.workGroups[wg]
-        #print(f"hit_rates(l2,mall,hbm) {self.getHitRatesFast()}")
-        print(f"hit-rate(l2,mall,hbm) {self.getHitRates(self.debug)}")        
-
-    def getNewWorkGroup(self, wg):
-        wgSerial = (wg[1]%self.WGM)*self.MOverMT0 + wg[0]
-        wgSet = wg[1]//self.WGM
-        if wgSet < self.numFullWG: 
-            X = wgSerial//self.WGM
-            Y = wgSerial%self.WGM
-        else:
-            X = wgSerial//self.remainder
-            Y = wgSerial%self.remainder
-        wg_new = (X, Y + wgSet*self.WGM)
-        extras = {'wgSet': wgSet, 'wgSerial': wgSerial, 'X': X, 'Y': Y}
-        return wg_new, extras
-
-    def getCustomNewWorkGroup(self, wg):
-        extras = dict()
-        
-        numWG = self.MOverMT0*self.NOverMT1
-        wgPerBlockM = 2 # WG
-        wgPerBlockN = 16 # WG
-        numWGPerBlock = wgPerBlockM*wgPerBlockN # WG
-
-        numBlocksM = self.MOverMT0//wgPerBlockM # Block
-        numBlocksN = self.NOverMT1//wgPerBlockN # Block
-        numBlocks = numBlocksM*numBlocksN # Block        
-
-        numWGInBlocks = numWGPerBlock*numBlocks # WG
-        numWGInEdges = numWG - numWGInBlocks # WG
-
-        blockLimM = numBlocksM*wgPerBlockM # WG
-        blockLimN = numBlocksN*wgPerBlockN # WG
-
-        # Compute the serialized workgroup ID
-        wgID = wg[1]*self.MOverMT0 + wg[0] # WG
-        extras['wgID'] = wgID
-
-        if wgID < numWGInBlocks:
-            # wg is a blockWG
-            wgIDDechunked = (wgID%self.GPU.numXCDs)*numWGPerBlock + (wgID//self.GPU.numXCDs)
-            blockID = wgIDDechunked//numWGPerBlock
-            blockM = blockID%numBlocksM
-            blockN = blockID//numBlocksM
-            wgBlockOffsetM = blockM*wgPerBlockM
-            wgBlockOffsetN = blockN*wgPerBlockN
-            wgBlockID = wgIDDechunked%numWGPerBlock
-            wgM = wgBlockID%wgPerBlockM
-            wgN = wgBlockID//wgPerBlockM
-            wg_new = (wgM + wgBlockOffsetM, wgN + wgBlockOffsetN)
-        else:
-            # wg is an edgeWG
-            wgID -= numWGInBlocks
-            numWGPerBlock = 2 # In the edge, we are only allocating the extra 2 CUs in each XCD, so the effective numWGPerBlock = 2 in this region
-            wgPerBlockN = 2  # Both the extra 2 CUs in each XCD are allocated in a row, so the effective wgPerBlockN = 2 in this region
-            wgIDDechunked = (wgID%self.GPU.numXCDs)*numWGPerBlock + (wgID//self.GPU.numXCDs)
-            blockID = wgIDDechunked//numWGPerBlock
-            blockM = 0
-            blockN = blockID
-            wgBlockOffsetM = numBlocksM*wgPerBlockM # The edge lies at the very top of the output
-            wgBlockOffsetN = blockN*wgPerBlockN
-            wgBlockID = wgIDDechunked%numWGPerBlock
-            wgM = 0
-            wgN = wgBlockID%wgPerBlockN
-            wg_new = (wgM + wgBlockOffsetM, wgN + wgBlockOffsetN)
-        extras['wgIDDechunked'] = wgIDDechunked
-        return wg_new, extras
-
-    '''
-    def getCustomNewWorkGroupFull(self, wg):
-        extras = dict()
-
-        numWG = self.MOverMT0*self.NOverMT1 # WG
-        numFullRounds = numWG//self.GPU.numCUs # Round
-        numPartialRounds = numWG%self.GPU.numCUs # Round
-
-        wgPerBlockM = 4 # WG/Block
-        wgPerBlockN = 9 # WG/Block
-        wgPerBlock = wgPerBlockM*wgPerBlockN # WG/Block
-
-        numBlocksM = self.MOverMT0//wgPerBlockM # Block
-        numBlocksN = self.NOverMT1//wgPerBlockN # Block
-        numBlocks = numBlocksM*numBlocksN # Block
-
-        numWGInBlocks = wgPerBlock*numBlocks # WG
-        numWGInEdges = numWG - numWGInBlocks # WG
-
-        blockLimM = numBlocksM*wgPerBlockM # WG
-        blockLimN = numBlocksN*wgPerBlockN # WG
-
-        # Compute the serialized workgroup ID
-        wgID = wg[1]*self.MOverMT0 + wg[0] # WG
-
-        # Compute the wgRound & the serialzied wgID within the wgRound
-        wgRound = wgID//self.GPU.numCUs # Round
-        wgRoundID = wgID%self.GPU.numCUs # WG
-
-        # Check if the wg is within the blockWG area or the edgeWG area
-        if wgRoundID//numWGInBlocks == 0:
-            # Compute the wgBlock & the serialized wgID within the block
-            wgBlock = wgRoundID//wgPerBlock # Block
-            wgBlockID = wgRoundID%wgPerBlock # WG
-
-            blockN = blockSerial//nBlocksM
-            blockM = blockSerial%nBlocksM
-            blockWGOffset = blockSerial*wgPerBlock
-            wgWithin = wgSerialWithinRound - blockWGOffset
-            wgWithinN = wgWithin//wgPerBlockN
-            wgWithinM = wgWithin%wgPerBlockN
-            new_wgN = wgWithinN + blockN*wgPerBlockN
-            new_wgM = wgWithinM + blockM*wgPerBlockM
-        else:
 
+    def buildMapping(self):
+        # mapping (a wgm_mapping name, remap object or callable) overrides WGM/customWGM; it is compiled once into
+        # launch-order arrays and permutation (launch ID -> output tile n*MOverMT0 + m)
+        mapping = self.mappingArgument
+        if mapping is None:
+            mapping = IdentityRemap() if self.WGM == 0 else BlockRemap() if self.customWGM else WGMRemap(self.WGM)
+        self.mapping = getRemap(mapping)
+        self.remap = CompiledRemap(self.mapping, RemapGrid.of(self))
+        self.permutation = self.remap.permutation
+        numWorkGroups = self.MOverMT0*self.NOverMT1
+        XCD, CU = self.GPU.dispatch(numWorkGroups)
+        self.table = WorkGroupTable(self.GPU, self.MOverMT0, self.NOverMT1, self.remap.newM, self.remap.newN, XCD, CU, self.remap.extras, width=self.width, height=self.height)
+        self.workGroups = WorkGroupView(self.table)
+        self.newWorkGroups = WorkGroupView(self.table, remapped=True)
+        collisions, holes, outOfGrid = self.remapDefects()
+        if collisions or holes or outOfGrid:
+            logging.warning('WGM remap is not a permutation: %d collisions, %d holes, %d workgroups outside the %dx%d grid'%(collisions, holes, outOfGrid, self.MOverMT0, self.NOverMT1))
+
+    def arguments(self):
+        # Constructor arguments other than GPU
+        return {'M': self.M, 'N': self.N, 'K': self.K, 'WGM': self.WGM, 'MT0': self.MT0, 'MT1': self.MT1, 'DU': self.DU, 'workGroupsPerCU': self.workGroupsPerCU,
+                'width': self.width, 'height': self.height, 'elemSize': self.elemSize, 'customWGM': self.customWGM, 'debug': self.debug,
+                'verbose': self.verbose, 'mapping': self.mappingArgument, 'decomposition': self.decomposition, 'splitK': self.splitK,
+                'streamKWorkGroups': self.streamKWorkGroups, 'accumElemSize': self.accumElemSize}
+
+    @property
+    def work(self):
+        # The WorkDecomposition of the launch
+        if 'work' not in self.stages:
+            numWorkGroups = self.GPU.numCUs*self.workGroupsPerCU if self.streamKWorkGroups is None else self.streamKWorkGroups
+            self.stages['work'] = WorkDecomposition(self.decomposition, len(self.table), self.KOverDU, self.GPU, self.splitK, numWorkGroups)
+        return self.stages['work']
+
+    def dataParallel(self):
+        return self.decomposition == 'data-parallel'
+
+    @property
+    def trace(self):
+        # The lockstep trace of the whole grid
+        if 'trace' not in self.stages:
+            self.stages['trace'] = self.getTrace()
+        return self.stages['trace']
+
+    @property
+    def l2Misses(self):
+        # Per-XCD L2 miss streams of trace under the gfx9 cachePolicy
+        if 'l2Misses' not in self.stages:
+            self.stages['l2Misses'] = self.l2MissStreams(self.trace, workers=1)
+        return self.stages['l2Misses']
+
+    @property
+    def result(self):
+        # Exact SimulationResult of trace, from the L2 miss streams through the MALL (the serial replay with debug)
+        if 'result' not in self.stages:
+            result = self.simulate(self.debug) if self.debug else self.mallPhase(self.trace, self.l2Misses)
+            # The footprint floors model data-parallel launches only
+            for violation in self.getFootprints().violations(result) if self.dataParallel() else []:
+                logging.error('simulation below the infinite-capacity floor: %s'%violation)
+            if self.verbose:
+                print('hit-rate(l2,mall,hbm) %s'%(result.hitRates(),))
+            self.stages['result'] = result
+        return self.stages['result']
+
+    def derive(self, GPU=None, **changes):
+        # Copy with some constructor arguments and/or gfx9 settings (e.g. MALLBytes=...) changed, or a new GPU, that
+        # shares every stage the changes leave valid: changing MALLBytes reuses the mapping, trace and L2 miss streams,
+        # changing K reuses the mapping, and bandwidths or latencies reuse everything
+        config = self.GPU.config()
+        gpuChanges = {name: changes.pop(name) for name in list(changes) if name in config}
+        unknown = set(changes) - set(self.arguments())
+        if unknown:
+            raise TypeError('unexpected WorkGroupMapping arguments %s'%sorted(unknown))
+        GPU = self.GPU if GPU is None else GPU
+        if gpuChanges:
+            GPU = gfx9(**dict(GPU.config(), **gpuChanges))
+        newConfig = GPU.config()
+        arguments = self.arguments()
+        changed = {name for name, value in changes.items() if arguments[name] != value}
+        changed |= {name for name in config if newConfig[name] != config[name]}
+        invalid = next((stage for stage in self.stageOrder if self.stageInputs[stage] & changed), None)
+        derived = WorkGroupMapping.__new__(WorkGroupMapping)
+        derived.__dict__.update(self.__dict__)
+        for name, value in changes.items():
+            setattr(derived, 'mappingArgument' if name == 'mapping' else name, value)
+        derived.GPU = GPU
+        derived.shape()
+        kept = self.stageOrder if invalid is None else self.stageOrder[:self.stageOrder.index(invalid)]
+        derived.stages = {stage: value for stage, value in self.stages.items() if stage in kept}
+        if 'mapping' not in kept:
+            derived.buildMapping()
+        return derived
+
+    def getNewWorkGroups(self, m, n):
+        # WGM remap of arrays of launch coordinates
+        return WGMRemap(self.WGM).remap(np.asarray(m, dtype=np.int64), np.asarray(n, dtype=np.int64), RemapGrid.of(self))
+
+    def getCustomNewWorkGroups(self, m, n):
+        # Custom block remap of arrays of launch coordinates: 2x16 blocks, one per XCD per group, edge rows 2 tiles per
+        # XCD, a permutation even when the blocks span several groups
+        return BlockRemap(2, 16).remap(np.asarray(m, dtype=np.int64), np.asarray(n, dtype=np.int64), RemapGrid.of(self))
+
+    def remapDefects(self, newM=None, newN=None):
+        # (collisions, holes, outOfGrid) of the launch -> output tile remap; all zero for a permutation
+        newM = self.table.new_m if newM is None else np.asarray(newM)
+        newN = self.table.new_n if newN is None else np.asarray(newN)
+        numWorkGroups = self.MOverMT0*self.NOverMT1
+        inGrid = (newM >= 0) & (newM < self.MOverMT0) & (newN >= 0) & (newN < self.NOverMT1)
+        hits = np.bincount(newN[inGrid]*self.MOverMT0 + newM[inGrid], minlength=numWorkGroups)
+        collisions = int(np.sum(np.maximum(hits - 1, 0)))
+        holes = int(np.count_nonzero(hits == 0))
+        return collisions, holes, int(np.count_nonzero(~inGrid))
 
-        return wg_new, extras
-        '''
+    def isPermutation(self):
+        return self.remapDefects() == (0, 0, 0)
 
     def getHitRatesFast(self):
-        # Original Hit Rate Function - correct but deos not account for finite L2 & MALL capacity 
-        # Gives more or less the same answers as the correct version for simple cases but much faster
-        #-----------------------------------------------------------------------------------------------
-        num_wg = 0
-        l2Hits = 0
-        mallHits = 0
-        hbmHits = 0
-        l2ARows = dict()
-        l2BCols = dict()
-        mallARows = list()
-        mallBCols = list()
-        for xcd in range(self.GPU.numXCDs):
-            l2ARows[xcd] = list()
-            l2BCols[xcd] = list()
-        for wg_tup, wg in self.workGroups.items():
-            num_wg += 1     
-            if wg.new_m not in l2ARows[wg.xcd]:
-                l2ARows[wg.xcd].append(wg.new_m)
-                if wg.new_m not in mallARows:
-                    mallARows.append(wg.new_m)
-                    hbmHits += 1
-                else:
-                    mallHits += 1
-            else:
-                l2Hits += 1
-            if wg.new_n not in l2BCols[wg.xcd]:
-                l2BCols[wg.xcd].append(wg.new_n)
-                if wg.new_n not in mallBCols:
-                    mallBCols.append(wg.new_n)
-                    hbmHits += 1
-                else:
-                    mallHits += 1
-            else:
-                l2Hits += 1
-            #print('%d: (%d,%d) '%(wg.xcd, wg.new_m, wg.new_n))
-            #print('l2_hits=%d mall_hits: %d,hbm_hits: %d) '%(l2Hits,mallHits,hbmHits))
-        assert (l2Hits + mallHits + hbmHits)/(2*num_wg) == 1
-        return l2Hits/(2*num_wg), mallHits/(2*num_wg), hbmHits/(2*num_wg)
-
-    def getHitRates(self, debug=True, pause=False):
-        debug = debug
-
-        numRequests = 0
-        l2Hits = 0
-        mallHits = 0
-        hbmHits = 0
-        L2 = dict()
-        L2Usage = dict()
-        MALL = dict()
-        MALLUsage = 0
-        num_ways = 16
-        set_size = num_ways * 128
-        num_sets = self.GPU.L2BytesPerXCD//num_ways
-        num_channels = 16
-
-        for xcd in range(self.GPU.numXCDs):
-            L2[xcd] = dict()
-            L2Usage[xcd] = 0
-
+        # Hit rates with unbounded L2s and MALL: a row/column is an L2 hit once its XCD has seen it and a MALL hit once
+        # any XCD has. Same answers as the original list-based scan, in O(workgroups). Split-K/Stream-K workgroups
+        # cover kSlice ranges and partial tiles rather than whole rows and columns, so those launches apply the same
+        # rule to every tile of the work trace, in O(requests)
+        if not self.dataParallel():
+            trace = self.trace
+            numKeys = int(trace.tileID.max()) + 1
+            firstOnXCD = firstOccurrences(trace.xcd.astype(np.int64)*numKeys + trace.tileID, trace.numXCDs*numKeys)
+            firstOverall = firstOccurrences(trace.tileID, numKeys)
+            levels = np.where(firstOverall, 2, np.where(firstOnXCD, 1, 0)).astype(np.int8)
+            return SimulationResult.fromLevels(levels, trace.numBytes, trace.write).hitRates()
+        return self.getFootprints().hitRates()
+
+    def getFootprints(self):
+        # FootprintProfile of the launch: per-XCD/per-wave distinct rows and columns and the compulsory-miss floor,
+        # from boolean bitmaps and first-occurrence arrays indexed by (XCD, row) and (XCD, column). Data-parallel
+        # launches only; getHitRatesFast covers the others from their trace
+        if not self.dataParallel():
+            raise ValueError("footprints model data-parallel launches, not '%s'; use getHitRatesFast for its hit rates"%self.decomposition)
+        numXCDs = self.GPU.numXCDs
+        numWorkGroups = len(self.table)
+        workGroupsPerWave = self.GPU.numCUs*self.workGroupsPerCU
+        numWaves = -(-numWorkGroups//workGroupsPerWave)
+        newM = self.table.new_m
+        newN = self.table.new_n
+        xcd = self.table.xcd
+        wave = np.arange(numWorkGroups)//workGroupsPerWave
+        xcdRows = countDistinct(wave*numXCDs + xcd, newM, numWaves*numXCDs, self.MOverMT0).reshape(numWaves, numXCDs)
+        xcdCols = countDistinct(wave*numXCDs + xcd, newN, numWaves*numXCDs, self.NOverMT1).reshape(numWaves, numXCDs)
+        waveRows = countDistinct(wave, newM, numWaves, self.MOverMT0)
+        waveCols = countDistinct(wave, newN, numWaves, self.NOverMT1)
+        firstOnXCD = np.stack([firstOccurrences(xcd*self.MOverMT0 + newM, numXCDs*self.MOverMT0),
+                               firstOccurrences(xcd*self.NOverMT1 + newN, numXCDs*self.NOverMT1)], axis=1)
+        firstOverall = np.stack([firstOccurrences(newM, self.MOverMT0), firstOccurrences(newN, self.NOverMT1)], axis=1)
+        return FootprintProfile(xcdRows, xcdCols, waveRows, waveCols, firstOnXCD, firstOverall, self.KOverDU, self.ATileBytes, self.BTileBytes)
+
+    def getHitRates(self, debug=False):
+        return self.simulate(debug).hitRates() if debug else self.result.hitRates()
+
+    def getTrace(self, firstWave=0, lastWave=None):
+        # Lockstep issue order: for each wave, every kSlice, every workgroup of the wave requests A then B.
+        # firstWave/lastWave restrict the trace to waves [firstWave, lastWave); clk stays global.
+        if not self.dataParallel():
+            return self.getWorkTrace(firstWave, lastWave)
         numWorkGroups = self.MOverMT0*self.NOverMT1
-        numWaves = numWorkGroups/(self.workGroupsPerCU*self.GPU.numCUs)
-        numFullWaves = int(math.floor(numWaves))
-        if numFullWaves != numWaves:
-            partialWave = True
+        workGroupsPerWave = self.GPU.numCUs*self.workGroupsPerCU
+        newM = self.table.new_m
+        newN = self.table.new_n
+        wgXCD = self.table.xcd
+
+        firstWG = firstWave*workGroupsPerWave
+        lastWG = numWorkGroups if lastWave is None else min(numWorkGroups, lastWave*workGroupsPerWave)
+        linearWG = np.arange(firstWG, lastWG)[:, None]
+        kSlice = np.arange(self.KOverDU)[None, :]
+        wave = linearWG//workGroupsPerWave
+        waveSize = np.minimum(workGroupsPerWave, numWorkGroups - wave*workGroupsPerWave)
+        # Slot of the A request of (linearWG, kSlice); the B request follows it
+        pos = 2*((wave - firstWave)*workGroupsPerWave*self.KOverDU + kSlice*waveSize + linearWG - wave*workGroupsPerWave)
+
+        numRequests = 2*(lastWG - firstWG)*self.KOverDU
+        traceWG = np.empty(numRequests, dtype=np.int64)
+        traceK = np.empty(numRequests, dtype=np.int64)
+        traceWG[pos] = linearWG
+        traceWG[pos + 1] = linearWG
+        traceK[pos] = kSlice
+        traceK[pos + 1] = kSlice
+        operand = np.empty(numRequests, dtype=np.int8)
+        operand[0::2] = AccessTrace.A
+        operand[1::2] = AccessTrace.B
+
+        numATiles = self.MOverMT0*self.KOverDU
+        tileID = np.empty(numRequests, dtype=np.int64)
+        tileID[0::2] = newM[traceWG[0::2]]*self.KOverDU + traceK[0::2]
+        tileID[1::2] = numATiles + newN[traceWG[1::2]]*self.KOverDU + traceK[1::2]
+        numBytes = np.empty(numRequests, dtype=np.int64)
+        numBytes[0::2] = self.ATileBytes
+        numBytes[1::2] = self.BTileBytes
+        clk = np.arange(numRequests) + 2*firstWG*self.KOverDU
+        return AccessTrace(clk, wgXCD[traceWG], operand, tileID, numBytes, traceWG, traceK, self.GPU.numXCDs, self.KOverDU, numATiles)
+
+    def getWorkTrace(self, firstWave=0, lastWave=None, start=None, sliceTimes=None, CU=None):
+        # Trace of any WorkDecomposition. Each workgroup requests A then B at every step (iteration) of its segments.
+        # A segment sharing its tile with others writes its partial C tile right after its last iteration, except the
+        # last of them to finish, which then reads every other partial of the tile (the reduction; the final C
+        # write-back is left to getPerformance, as for data-parallel tiles). Lockstep order is (wave, step, workgroup),
+        # as getTrace; with the EventDispatcher start times and sliceTimes of the workgroups, it is issue time, ties
+        # in (workgroup, step) order, and the reduction waits for the last partial. firstWave/lastWave select the
+        # requests of the workgroups in waves [firstWave, lastWave); clk stays global. C requests carry the kSlice of
+        # the last iteration of the segment that issues them.
+        work = self.work
+        workGroupsPerWave = self.GPU.numCUs*self.workGroupsPerCU
+        numATiles = self.MOverMT0*self.KOverDU
+        partialBase = numATiles + self.NOverMT1*self.KOverDU
+
+        # Partial C tiles (see WorkDecomposition.partials), computed once per decomposition for the lockstep order
+        lastStep = work.step0 + work.length - 1
+        if start is None:
+            if work.lockstepPartials is None:
+                work.lockstepPartials = work.partials((work.wg//workGroupsPerWave)*(int(work.iterations.max()) + 1) + lastStep)
+            writers, readers = work.lockstepPartials
         else:
-            partialWave = False
-        workGroupsPerFullWave = self.GPU.numCUs*self.workGroupsPerCU
-        workGroupsPerPartialWave = numWorkGroups - workGroupsPerFullWave*numFullWaves
+            finish = start[work.wg] + (lastStep + 1)*sliceTimes[work.wg]
+            writers, readers = work.partials(finish)
+
+        # Lockstep waves are contiguous in the trace: only the segments of the selected waves are expanded, and clk
+        # starts after the requests of the earlier waves. Event-driven traces interleave waves and are filtered below.
+        segments = np.arange(len(work))
+        writes = np.arange(len(writers))
+        reads = np.arange(len(readers))
+        firstClk = 0
+        selectWaves = firstWave > 0 or lastWave is not None
+        if selectWaves and start is None:
+            segmentWave = work.wg//workGroupsPerWave
+            selected = (segmentWave >= firstWave) & (segmentWave < (np.inf if lastWave is None else lastWave))
+            firstClk = int(2*work.length[segmentWave < firstWave].sum() + np.count_nonzero(segmentWave[writers] < firstWave) + np.count_nonzero(segmentWave[readers] < firstWave))
+            segments = segments[selected]
+            writes = writes[selected[writers]]
+            reads = reads[selected[readers]]
+            selectWaves = False
+
+        length = work.length[segments]
+        segment = np.repeat(segments, length)
+        offset = np.arange(len(segment)) - np.repeat(np.cumsum(length) - length, length)
+        iterationWG = work.wg[segment]
+        iterationStep = work.step0[segment] + offset
+        kSlice = work.kStart[segment] + offset
+        tile = work.tile[segment]
+        writer = writers[writes]
+        reader = readers[reads]
+        readPartial = writers[reads]
+
+        # Requests: A and B of every iteration, then partial writes and reduction reads (sub 0..3 within a step)
+        requestSegment = np.concatenate([np.repeat(segment, 2), writer, reader])
+        wg = work.wg[requestSegment]
+        step = np.concatenate([np.repeat(iterationStep, 2), lastStep[writer], lastStep[reader]])
+        sub = np.concatenate([np.tile([0, 1], len(segment)), np.full(len(writer), 2), np.full(len(reader), 3)])
+        operand = np.minimum(sub, AccessTrace.C).astype(np.int8)
+        lastK = work.kStart + work.length - 1
+        requestK = np.concatenate([np.repeat(kSlice, 2), lastK[writer], lastK[reader]])
+        requestTile = np.concatenate([np.repeat(tile, 2), work.tile[writer], work.tile[readPartial]])
+        tileID = np.concatenate([np.stack([self.table.new_m[tile]*self.KOverDU + kSlice, numATiles + self.table.new_n[tile]*self.KOverDU + kSlice], axis=1).ravel(),
+                                 partialBase + writer, partialBase + readPartial])
+        numBytes = np.concatenate([np.tile([self.ATileBytes, self.BTileBytes], len(segment)), np.full(len(writer) + len(reader), self.partialTileBytes)])
+        if start is None:
+            order = np.lexsort((sub, wg, step, wg//workGroupsPerWave))
+            time = None
+        else:
+            time = np.concatenate([np.repeat(start[iterationWG] + iterationStep*sliceTimes[iterationWG], 2), finish[writer], finish[reader]])
+            order = np.lexsort((sub, step, wg, time))
+        clk = firstClk + np.arange(len(order))
+        if selectWaves:
+            wave = wg[order]//workGroupsPerWave
+            keep = (wave >= firstWave) & (wave < (np.inf if lastWave is None else lastWave))
+            order = order[keep]
+            clk = clk[keep]
+        trace = AccessTrace(clk, work.xcd[wg[order]], operand[order], tileID[order], numBytes[order], wg[order], requestK[order], self.GPU.numXCDs, self.KOverDU, numATiles)
+        trace.write = sub[order] == 2
+        trace.tile = requestTile[order]
+        if time is not None:
+            trace.time = time[order]
+            trace.cu = CU[wg[order]]
+        return trace
+
+    def getSchedule(self, jitter=0.0, seed=0):
+        # EventDispatcher start time, end time and CU of every workgroup of the WorkDecomposition in launch order
+        work = self.work
+        dispatcher = EventDispatcher(self.GPU, self.workGroupsPerCU, jitter, seed)
+        sliceTimes = dispatcher.sliceTimes(work.numWorkGroups)
+        start, CU = dispatcher.schedule(work.xcd, sliceTimes, work.iterations)
+        return start, start + sliceTimes*work.iterations, CU, sliceTimes
+
+    def getEventTrace(self, jitter=0.0, seed=0):
+        # Access stream ordered by issue time under the EventDispatcher: a workgroup requests A then B at the start of
+        # each of its kSlices; simultaneous requests go in launch order, as in the lockstep trace
+        start, end, CU, sliceTimes = self.getSchedule(jitter, seed)
+        if not self.dataParallel():
+            return self.getWorkTrace(start=start, sliceTimes=sliceTimes, CU=CU)
+        numWorkGroups = len(self.table)
+        issueTime = (start[:, None] + np.arange(self.KOverDU)*sliceTimes[:, None]).ravel()
+        order = np.lexsort((np.arange(numWorkGroups*self.KOverDU), issueTime))
+        wg = np.repeat(order//self.KOverDU, 2)
+        kSlice = np.repeat(order%self.KOverDU, 2)
+        numRequests = len(wg)
+        operand = np.tile(np.array([AccessTrace.A, AccessTrace.B], dtype=np.int8), numRequests//2)
+        numATiles = self.MOverMT0*self.KOverDU
+        tileID = np.where(operand == AccessTrace.A, self.table.new_m[wg]*self.KOverDU + kSlice, numATiles + self.table.new_n[wg]*self.KOverDU + kSlice)
+        numBytes = np.where(operand == AccessTrace.A, self.ATileBytes, self.BTileBytes)
+        trace = AccessTrace(np.arange(numRequests), self.table.xcd[wg], operand, tileID, numBytes, wg, kSlice, self.GPU.numXCDs, self.KOverDU, numATiles)
+        trace.time = np.repeat(issueTime[order], 2)
+        trace.cu = CU[wg]
+        return trace
+
+    def exportTrace(self, path, trace=None, wavesPerChunk=16):
+        # Writes the trace (default: lockstep, built wavesPerChunk waves at a time) to a binary trace file for
+        # wgm_trace.TraceFile; see wgm_trace.writeTrace to put several GEMMs in one file
+        from wgm_trace import TraceWriter, writeTrace
+        with TraceWriter(path, self.GPU.numXCDs) as writer:
+            writeTrace(self, writer, trace=trace, wavesPerChunk=wavesPerChunk)
+        return path
+
+    def l2MissStreams(self, trace, policy=None, workers=None):
+        # Phase one: each XCD's L2 over its own requests, concurrently when workers != 1.
+        # Returns, per XCD, the trace positions (= clk order) of its L2 misses.
+        policy = self.GPU.cachePolicy if policy is None else policy
+        granule = min(self.ATileBytes, self.BTileBytes)
+        order = np.argsort(trace.xcd, kind='stable')
+        requestsByXCD = np.split(order, np.cumsum(np.bincount(trace.xcd, minlength=self.GPU.numXCDs))[:-1])
+        args = [(trace.tileID[requests].tolist(), trace.numBytes[requests].tolist(), self.GPU.L2BytesPerXCD, policy, granule) for requests in requestsByXCD]
+        if workers == 1:
+            hits = [simulateLevel(*xcdArgs) for xcdArgs in args]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers or self.GPU.numXCDs) as pool:
+                hits = list(pool.map(simulateLevel, *zip(*args)))
+        return [requests[~xcdHits] for requests, xcdHits in zip(requestsByXCD, hits)]
+
+    def mallPhase(self, trace, missStreams, policy=None):
+        # Phase two: k-way merge of the per-XCD miss streams by clk, fed through the shared MALL
+        policy = self.GPU.cachePolicy if policy is None else policy
+        numMisses = sum(len(stream) for stream in missStreams)
+        misses = np.fromiter(heapq.merge(*(stream.tolist() for stream in missStreams)), dtype=np.int64, count=numMisses)
+        mallHits = simulateLevel(trace.tileID[misses].tolist(), trace.numBytes[misses].tolist(), self.GPU.MALLBytes, policy, min(self.ATileBytes, self.BTileBytes))
+        levels = np.zeros(len(trace), dtype=np.int8)
+        levels[misses] = np.where(mallHits, 1, 2)
+        return SimulationResult.fromLevels(levels, trace.numBytes, trace.write)
+
+    def simulateParallel(self, trace=None, policy=None, workers=None):
+        trace = self.trace if trace is None else trace
+        return self.mallPhase(trace, self.l2MissStreams(trace, policy, workers), policy)
+
+    def simulateSteadyState(self, trace=None, policy=None, extrapolateWaves=True, maxFailedProbes=32):
+        # Within a wave, kSlice k+1 requests exactly the tiles of kSlice k shifted by one kSlice. After kSlice k, the
+        # rest of the wave repeats kSlice k exactly when:
+        #   - every L2 equals its state after kSlice k-1 shifted by one kSlice (LRU/FIFO expose their state);
+        #   - before kSlice k, each A row and B column of the wave had either all or none of its tiles of kSlices
+        #     k..KOverDU-1 in the MALL;
+        #   - the MALL evicts nothing during kSlice k, and has room for what the remaining kSlices insert.
+        # The MALL may then hold any number of older tiles, e.g. from earlier waves. The repeated levels are copied,
+        # the L2s are relabelled to the end of the wave, and only the MALL sees the remaining kSlices' L2 misses.
+        # Probes cost O(wave rows and columns x kSlices), back off exponentially within a wave, and stop for good
+        # after maxFailedProbes failures, so the engine stays close to serial speed when nothing repeats.
+        # Limitation: a MALL that fills up during a wave (e.g. a small MALL behind a large footprint) breaks the third
+        # condition, and the wave then simulates every kSlice. Other policies always do.
+        # With extrapolateWaves, once two full waves serve identical levels the remaining full waves are copied
+        # from the last one. That part is not exact and is covered by errorBound.
+        trace = self.trace if trace is None else trace
+        hierarchy = CacheHierarchy(self.GPU, policy, granule=min(self.ATileBytes, self.BTileBytes))
+        access = hierarchy.access
+        MALL = hierarchy.MALL
+        xcds = trace.xcd.tolist()
+        keys = trace.tileID.tolist()
+        numBytes = trace.numBytes.tolist()
+        levels = np.empty(len(trace), dtype=np.int8)
+        canProbe = hierarchy.L2Signature(0, self.KOverDU) is not None
 
+        numWorkGroups = self.MOverMT0*self.NOverMT1
+        numATiles = self.MOverMT0*self.KOverDU
+        workGroupsPerWave = self.GPU.numCUs*self.workGroupsPerCU
+        numWaves = -(-numWorkGroups//workGroupsPerWave)
+        numFullWaves = numWorkGroups//workGroupsPerWave
+        fullWaveLength = 2*workGroupsPerWave*self.KOverDU
+        simulated = 0
+        estimated = 0
+        failedProbes = 0
+        wave = 0
+        while wave < numWaves:
+            waveStart = wave*fullWaveLength
+            if extrapolateWaves and 2 <= wave < numFullWaves and np.array_equal(levels[waveStart - fullWaveLength:waveStart], levels[waveStart - 2*fullWaveLength:waveStart - fullWaveLength]):
+                waveLevels = levels[waveStart - fullWaveLength:waveStart]
+                levels[waveStart:numFullWaves*fullWaveLength] = np.tile(waveLevels, numFullWaves - wave)
+                estimated += (numFullWaves - wave)*fullWaveLength
+                wave = numFullWaves
+                continue
+            waveWGs = slice(wave*workGroupsPerWave, min((wave + 1)*workGroupsPerWave, numWorkGroups))
+            # First key of every A row and B column of the wave, for the MALL presence checks
+            firstKeys = np.concatenate([np.unique(self.table.new_m[waveWGs])*self.KOverDU, numATiles + np.unique(self.table.new_n[waveWGs])*self.KOverDU])
+            blockLength = 2*(waveWGs.stop - waveWGs.start)
+            prevBlock = None
+            # L2 signatures are taken after kSlice nextCheck-1 and compared after kSlice nextCheck
+            prevSignature = None
+            nextCheck = 1
+            checkGap = 1
+            for kSlice in range(self.KOverDU):
+                comparing = prevSignature is not None
+                if comparing:
+                    futureKeys = (firstKeys[:, None] + np.arange(kSlice, self.KOverDU)).ravel().tolist()
+                    present = np.fromiter(map(MALL.entries.__contains__, futureKeys), dtype=bool).reshape(len(firstKeys), -1)
+                    uniform = bool(np.all(present.all(axis=1) | ~present.any(axis=1)))
+                    mallEvictions = MALL.evictions
+                start = waveStart + kSlice*blockLength
+                end = start + blockLength
+                block = np.fromiter(map(access, xcds[start:end], keys[start:end], numBytes[start:end]), dtype=np.int8, count=blockLength)
+                levels[start:end] = block
+                simulated += blockLength
+                signature = None
+                if comparing:
+                    remaining = self.KOverDU - 1 - kSlice
+                    signature = hierarchy.L2Signature(kSlice, self.KOverDU)
+                    insertedBytes = float(np.sum(trace.numBytes[start:end][block == 2]))
+                    if (uniform and np.array_equal(block, prevBlock) and signature == prevSignature and MALL.evictions == mallEvictions
+                            and MALL.usage + remaining*insertedBytes <= MALL.capacity):
+                        levels[end:end + remaining*blockLength] = np.tile(block, remaining)
+                        hierarchy.relabelL2(remaining)
+                        # The MALL sees the L2 misses of the remaining kSlices. It evicts nothing, so replaying them
+                        # in order reproduces its replacement state exactly
+                        rest = np.arange(end, end + remaining*blockLength)[np.tile(block > 0, remaining)].tolist()
+                        mallAccess = MALL.access
+                        for index in rest:
+                            mallAccess(keys[index], numBytes[index])
+                        simulated += len(rest)
+                        break
+                    failedProbes += 1
+                    nextCheck = kSlice + checkGap
+                    checkGap *= 2
+                prevSignature = None
+                if canProbe and failedProbes < maxFailedProbes and kSlice + 1 == nextCheck and nextCheck < self.KOverDU - 1:
+                    prevSignature = signature if signature is not None else hierarchy.L2Signature(kSlice, self.KOverDU)
+                prevBlock = block
+            wave += 1
+
+        result = SimulationResult.fromLevels(levels, trace.numBytes)
+        result.exact = estimated == 0
+        result.errorBound = estimated/len(trace)
+        # Requests replayed through a cache level (the MALL-only replay of skipped kSlices included)
+        result.simulatedFraction = simulated/len(trace)
+        return result
+
+    def warmMALL(self, MALL, wave):
+        # Approximates the MALL contents at the start of `wave` without simulating earlier waves: every tile of
+        # waves [0, wave) ordered by last use (wave, then kSlice), inserted oldest first up to the MALL capacity.
+        # It ignores that L2 hits never refresh the MALL, so it errs towards a warmer MALL.
+        if wave == 0:
+            return
+        workGroupsPerWave = self.GPU.numCUs*self.workGroupsPerCU
+        earlier = slice(0, min(wave*workGroupsPerWave, self.MOverMT0*self.NOverMT1))
+        waveOf = np.arange(earlier.stop)//workGroupsPerWave
+        lastWaveA = np.full(self.MOverMT0, -1)
+        lastWaveB = np.full(self.NOverMT1, -1)
+        np.maximum.at(lastWaveA, self.table.new_m[earlier], waveOf)
+        np.maximum.at(lastWaveB, self.table.new_n[earlier], waveOf)
+        rowsA = np.flatnonzero(lastWaveA >= 0)
+        colsB = np.flatnonzero(lastWaveB >= 0)
+        kSlice = np.arange(self.KOverDU)
+        numATiles = self.MOverMT0*self.KOverDU
+        keys = np.concatenate([(rowsA[:, None]*self.KOverDU + kSlice).ravel(), (numATiles + colsB[:, None]*self.KOverDU + kSlice).ravel()])
+        recency = np.concatenate([(lastWaveA[rowsA][:, None]*self.KOverDU + kSlice).ravel(), (lastWaveB[colsB][:, None]*self.KOverDU + kSlice).ravel()])
+        numBytes = np.concatenate([np.full(len(rowsA)*self.KOverDU, self.ATileBytes), np.full(len(colsB)*self.KOverDU, self.BTileBytes)])
+        newestFirst = np.argsort(-recency, kind='stable')
+        fits = np.cumsum(numBytes[newestFirst]) <= MALL.capacity
+        oldestFirst = newestFirst[fits][::-1]
+        MALL.fill(keys[oldestFirst].tolist(), numBytes[oldestFirst].tolist())
+
+    def getHitRatesSampled(self, targetError=0.005, timeBudget=None, warmupWaves=1, numStrata=8, confidence=0.95, seed=0, policy=None, maxSampledFraction=0.5, samplesPerStratum=4):
+        # Simulates a stratified random sample of full waves, each after warmupWaves waves of warm-up on top of warmMALL,
+        # samplesPerStratum waves to start with (a few guard against missing waves that differ periodically), then
+        # adding waves where they shrink the variance most until every hit fraction's confidence half-width is within
+        # targetError, timeBudget seconds have passed, or every wave has been sampled. The cold first warmupWaves+1 waves
+        # and the partial wave are always simulated.
+        # Once the sample would replay more than maxSampledFraction of the trace (warm-up included) the exact engine is
+        # cheaper, so it runs instead.
+        startTime = time.perf_counter()
+        numWaves = -(-self.work.numWorkGroups//(self.GPU.numCUs*self.workGroupsPerCU))
+
+        def exact():
+            return SampledResult(self.simulate(policy=policy).hitRates(), np.zeros(3), confidence, numWaves, numWaves, 1.0)
+
+        if not self.dataParallel():
+            # Waves of split-K/Stream-K workgroups differ in length and share partial tiles: simulate them all
+            return exact()
+        numWorkGroups = self.MOverMT0*self.NOverMT1
+        workGroupsPerWave = self.GPU.numCUs*self.workGroupsPerCU
+        numFullWaves = numWorkGroups//workGroupsPerWave
+        totalRequests = 2*numWorkGroups*self.KOverDU
+        fullWaveRequests = 2*workGroupsPerWave*self.KOverDU
+        granule = min(self.ATileBytes, self.BTileBytes)
+        from statistics import NormalDist
+        z = NormalDist().inv_cdf(0.5 + confidence/2)
+        rng = np.random.default_rng(seed)
+        simulatedRequests = 0
+
+        def measure(wave, warmup=warmupWaves):
+            nonlocal simulatedRequests
+            firstWave = max(0, wave - warmup)
+            trace = self.getTrace(firstWave, wave + 1)
+            hierarchy = CacheHierarchy(self.GPU, policy, granule)
+            self.warmMALL(hierarchy.MALL, firstWave)
+            levels = trace.replay(hierarchy).levels
+            simulatedRequests += len(trace)
+            waveLength = min(fullWaveRequests, totalRequests - wave*fullWaveRequests)
+            return np.bincount(levels[-waveLength:], minlength=3)/waveLength
+
+        numColdWaves = min(warmupWaves + 1, numFullWaves)
+        strata = [rng.permutation(stratum) for stratum in np.array_split(np.arange(numColdWaves, numFullWaves), max(1, min(numStrata, numFullWaves - numColdWaves))) if len(stratum)]
+        # The cold waves, samplesPerStratum waves per stratum, the partial wave and the warm-up bias probe, each with its warm-up
+        initialWaves = numColdWaves + (sum(min(samplesPerStratum, len(stratum)) for stratum in strata) + numWaves - numFullWaves)*(warmupWaves + 1) + 2*warmupWaves + 1
+        if not strata or initialWaves > maxSampledFraction*numWaves:
+            return exact()
+        budget = maxSampledFraction*totalRequests
+
+        # The cold waves start from empty caches, which warmMALL cannot stand in for, so they are simulated from wave 0
+        coldLevels = self.getTrace(0, numColdWaves).replay(CacheHierarchy(self.GPU, policy, granule)).levels
+        simulatedRequests += len(coldLevels)
+        estimate = np.bincount(coldLevels, minlength=3)/totalRequests
+        if numWaves > numFullWaves:
+            estimate += measure(numFullWaves)*(totalRequests - numFullWaves*fullWaveRequests)/totalRequests
+
+        weights = [len(stratum)*fullWaveRequests/totalRequests for stratum in strata]
+        samples = [[measure(wave) for wave in stratum[:samplesPerStratum]] for stratum in strata]
+        # warmMALL only approximates the MALL before the warm-up. The change in a late sampled wave's hit fractions when
+        # its warm-up is doubled estimates the bias that leaves, and widens every interval
+        probeStratum = max(range(len(strata)), key=lambda h: strata[h][0])
+        bias = np.abs(measure(strata[probeStratum][0], 2*warmupWaves) - samples[probeStratum][0])
+
+        def combine():
+            means = [np.mean(stratumSamples, axis=0) for stratumSamples in samples]
+            variances = [np.var(stratumSamples, axis=0, ddof=1) if len(stratumSamples) > 1 else np.zeros(3) for stratumSamples in samples]
+            total = estimate + sum(weight*mean for weight, mean in zip(weights, means))
+            # A few waves can agree by chance, so each stratum's variance is at least the pooled within-strata variance
+            # and the between-strata variance of the stratum means. Finite population correction: a fully sampled
+            # stratum contributes none
+            pooled = sum((len(stratumSamples) - 1)*variance for stratumSamples, variance in zip(samples, variances))/max(1, sum(len(stratumSamples) - 1 for stratumSamples in samples))
+            between = np.var(means, axis=0, ddof=1) if len(means) > 1 else np.zeros(3)
+            floor = np.maximum(pooled, between)
+            contributions = [weight**2*(1 - len(stratumSamples)/len(stratum))*np.maximum(variance, floor)/len(stratumSamples)
+                             for weight, stratum, stratumSamples, variance in zip(weights, strata, samples, variances)]
+            widths = z*np.sqrt(sum(contributions, np.zeros(3)))
+            # The fractions sum to one, so a fraction no sampled wave varied in errs by at most the other two's widths
+            widths = np.where(widths == 0, widths.sum() - widths, widths)
+            return total, widths + bias, contributions
+
+        total, halfWidths, contributions = combine()
+        while np.max(halfWidths) > targetError:
+            if timeBudget is not None and time.perf_counter() - startTime > timeBudget:
+                break
+            open_ = [h for h in range(len(strata)) if len(samples[h]) < len(strata[h])]
+            if not open_:
+                break
+            if simulatedRequests + (warmupWaves + 1)*fullWaveRequests > budget:
+                return exact()
+            h = max(open_, key=lambda h: np.max(contributions[h]))
+            samples[h].append(measure(strata[h][len(samples[h])]))
+            total, halfWidths, contributions = combine()
+
+        sampledWaves = numColdWaves + sum(len(stratumSamples) for stratumSamples in samples) + numWaves - numFullWaves
+        return SampledResult(total, halfWidths, confidence, sampledWaves, numWaves, simulatedRequests/totalRequests)
+
+    def getReuseProfile(self, trace=None):
+        # Stack-distance profile: hit rates for any L2BytesPerXCD/MALLBytes pair without re-simulating
+        return ReuseProfile(self.trace if trace is None else trace)
+
+    def getPerformance(self, result=None, trace=None):
+        # Performance model over a simulation that kept per-request levels (the serial and parallel engines).
+        # Every byte delivered to the CUs crosses its XCD's L2, L2 misses cross the MALL, and each tile's C is written
+        # back through L2 and MALL to HBM in the wave of the workgroup that finishes it. With split-K/Stream-K, partial
+        # C tiles also cross L2 and MALL, and those read back from HBM were written to HBM too. A wave computes for as
+        # long as its longest workgroup, and a partial wave as long as a full one.
+        trace = self.trace if trace is None else trace
+        result = self.result if result is None else result
+        if result.levels is None or len(result.levels) != len(trace):
+            result = self.simulate(trace=trace)
+        GPU = self.GPU
+        work = self.work
+        workGroupsPerWave = GPU.numCUs*self.workGroupsPerCU
+        numWaves = -(-work.numWorkGroups//workGroupsPerWave)
+        wave = trace.wg//workGroupsPerWave
+        levels = result.levels.astype(np.int64)
+        write = np.zeros(len(trace), dtype=bool) if trace.write is None else trace.write
+        readBytes = np.where(write, 0, trace.numBytes)
+        waveBytes = np.bincount(wave*3 + levels, weights=readBytes, minlength=numWaves*3).reshape(numWaves, 3)
+        # Workgroup that finishes each tile: its only one, or the one reading the partials
+        finalWG = np.empty(len(work.contributors), dtype=np.int64)
+        finalWG[work.tile] = work.wg
+        if trace.tile is not None:
+            reads = (trace.operand == AccessTrace.C) & ~write
+            finalWG[trace.tile[reads]] = trace.wg[reads]
+            spilled = reads & (levels == 2)
+        else:
+            spilled = np.zeros(len(trace), dtype=bool)
+        waveOfWG = finalWG//workGroupsPerWave
+        waveWriteBytes = np.bincount(waveOfWG, minlength=numWaves)*self.CTileBytes
+        waveWriteBytes += np.bincount(wave[spilled], weights=trace.numBytes[spilled], minlength=numWaves)
+        wavePartialBytes = np.bincount(wave[write], weights=trace.numBytes[write], minlength=numWaves)
+        xcdBytes = np.bincount(wave*GPU.numXCDs + trace.xcd, weights=trace.numBytes, minlength=numWaves*GPU.numXCDs).reshape(numWaves, GPU.numXCDs)
+        xcdBytes += np.bincount(waveOfWG*GPU.numXCDs + work.xcd[finalWG], minlength=numWaves*GPU.numXCDs).reshape(numWaves, GPU.numXCDs)*self.CTileBytes
+
+        waveOfWorkGroup = np.arange(work.numWorkGroups)//workGroupsPerWave
+        workGroupsPerCU = -(-np.bincount(waveOfWorkGroup, minlength=numWaves)//GPU.numCUs)
+        longest = np.zeros(numWaves, dtype=np.int64)
+        np.maximum.at(longest, waveOfWorkGroup, work.iterations)
+        waveResourceTimes = np.stack([xcdBytes.max(axis=1)/GPU.L2BandwidthPerXCD,
+                                      (waveBytes[:, 1] + waveBytes[:, 2] + waveWriteBytes + wavePartialBytes)/GPU.MALLBandwidth,
+                                      (waveBytes[:, 2] + waveWriteBytes)/GPU.HBMBandwidth,
+                                      workGroupsPerCU*2*self.MT0*self.MT1*self.K*(longest/self.KOverDU)*GPU.numCUs/GPU.peakFLOPS], axis=1)
+        latencies = np.array([GPU.L2Latency, GPU.MALLLatency, GPU.HBMLatency])
+        deepest = np.zeros(numWaves, dtype=np.int64)
+        np.maximum.at(deepest, wave, levels)
+        estimate = PerformanceEstimate(waveBytes, waveWriteBytes, waveResourceTimes, latencies[deepest], 2*self.M*self.N*self.K, GPU)
+        # Busy fraction of the workgroup slots (1 - wave quantization and imbalance)
+        estimate.waveEfficiency = work.waveEfficiency(workGroupsPerWave)
+        return estimate
+
+    def compareDecompositions(self, splitKs=(2, 4, 8), streamKWorkGroups=None):
+        # Data-parallel, split-K with each of splitKs and Stream-K variants of this launch (derived, so they share the
+        # mapping), as rows of predicted time, wave efficiency and traffic, fastest first
+        variants = [('data-parallel', dict(decomposition='data-parallel'))]
+        variants += [('split-k %d'%splitK, dict(decomposition='split-k', splitK=splitK)) for splitK in splitKs if splitK <= self.KOverDU]
+        variants.append(('stream-k', dict(decomposition='stream-k', streamKWorkGroups=streamKWorkGroups)))
+        rows = list()
+        for name, changes in variants:
+            wgm = self.derive(**changes)
+            performance = wgm.getPerformance()
+            rows.append({'decomposition': name, 'numWorkGroups': wgm.work.numWorkGroups, 'hitRates': wgm.result.hitRates(),
+                         'hbmBytes': performance.hbmBytes, 'writeBytes': performance.writeBytes, 'partialBytes': wgm.result.writeBytes,
+                         'waveEfficiency': performance.waveEfficiency, 'boundBy': performance.boundBy, 'time': performance.time})
+        rows.sort(key=lambda row: row['time'])
+        return rows
+
+    def tileLayout(self, trace, BLayout='nk'):
+        # Byte address of the first element of every requested tile, and per operand (rows, row stride, row bytes).
+        # A is row-major MxK. B is NxK row-major ('nk', the layout getHitRates originally addressed) or KxN ('kn').
+        # B starts at the first 2MiB boundary after A, partial C tiles at the next one after B.
+        rowBytesK = int(self.K*self.elemSize)
+        BBase = -(-self.M*rowBytesK//2**21)*2**21
+        isA = trace.operand == AccessTrace.A
+        tileID = np.where(isA, trace.tileID, trace.tileID - trace.numATiles)
+        row = tileID//self.KOverDU
+        kSlice = tileID%self.KOverDU
+        sliceBytes = int(self.DU*self.elemSize)
+        base = np.where(isA, row*self.MT0*rowBytesK + kSlice*sliceBytes, 0)
+        layout = {AccessTrace.A: (self.MT0, rowBytesK, sliceBytes)}
+        if BLayout == 'nk':
+            base = np.where(isA, base, BBase + row*self.MT1*rowBytesK + kSlice*sliceBytes)
+            layout[AccessTrace.B] = (self.MT1, rowBytesK, sliceBytes)
+        elif BLayout == 'kn':
+            rowBytesN = int(self.N*self.elemSize)
+            base = np.where(isA, base, BBase + kSlice*self.DU*rowBytesN + row*int(self.MT1*self.elemSize))
+            layout[AccessTrace.B] = (self.DU, rowBytesN, int(self.MT1*self.elemSize))
+        else:
+            raise ValueError("unknown BLayout '%s', expected 'nk' or 'kn'"%BLayout)
+        isC = trace.operand == AccessTrace.C
+        if isC.any():
+            # Partial C tiles of split-K/Stream-K: contiguous MT0xMT1 accumulator tiles, one per segment, in a
+            # workspace at the first 2MiB boundary after B
+            partialBytes = int(self.partialTileBytes)
+            CBase = -(-(BBase + self.N*rowBytesK)//2**21)*2**21
+            base = np.where(isC, CBase + (trace.tileID - trace.numATiles - self.NOverMT1*self.KOverDU)*partialBytes, base)
+            rowBytesC = int(self.MT1*self.accumElemSize)
+            layout[AccessTrace.C] = (self.MT0, rowBytesC, rowBytesC)
+        return base, layout
+
+    def simulateL2Sets(self, trace=None, BLayout='nk', policy=None, maxLinesPerBatch=2**21, setSampleEvery=1, maxLineRequests=2**28):
+        # Cacheline-granular, set-associative, channel-interleaved model of the per-XCD L2s with the gfx9 L2 geometry.
+        # Every tile request expands to the lines of its rows; lines are generated, hashed and simulated in batches of
+        # about maxLinesPerBatch with NumPy. Warns when some XCD's busiest channel sees twice its mean share of lines.
+        # Sets never interact, so setSampleEvery=k simulates only every k-th set of each XCD: the hit rate and conflict
+        # fraction become estimates over those sets and the other sets report no misses, while channel requests still
+        # count every line. Raises ValueError rather than replay more than maxLineRequests lines, naming a sampling
+        # rate that fits.
+        trace = self.trace if trace is None else trace
+        policy = self.GPU.cachePolicy if policy is None else policy
+        numXCDs = self.GPU.numXCDs
+        numChannels = self.GPU.L2Channels
+        lineBytes = self.GPU.L2LineBytes
+        numSets = self.GPU.L2Sets()
+        if setSampleEvery < 1 or setSampleEvery & (setSampleEvery - 1) or setSampleEvery > numSets//numChannels:
+            raise ValueError('setSampleEvery must be a power of two of at most the %d sets per channel, got %d'%(numSets//numChannels, setSampleEvery))
+        numSampledSets = numSets//setSampleEvery
+
+        base, layout = self.tileLayout(trace, BLayout)
+        # Lines a row can span, one more than its length when rows are not line aligned
+        spans = {operand: -(-rowBytes//lineBytes) + (1 if rowStride % lineBytes or np.any(base[trace.operand == operand] % lineBytes) else 0)
+                 for operand, (numRows, rowStride, rowBytes) in layout.items()}
+        linesPerRequest = max(layout[operand][0]*spans[operand] for operand in layout)
+        sampledLines = int(sum(np.count_nonzero(trace.operand == operand)*numRows*-(-rowBytes//lineBytes) for operand, (numRows, rowStride, rowBytes) in layout.items()))//setSampleEvery
+        if sampledLines > maxLineRequests:
+            fits = min(numSets//numChannels, 1 << (-(-sampledLines*setSampleEvery//maxLineRequests) - 1).bit_length())
+            raise ValueError('simulateL2Sets would replay %d line requests, more than maxLineRequests=%d; pass setSampleEvery=%d or raise maxLineRequests'%(sampledLines, maxLineRequests, fits))
+        batchRequests = max(1, maxLinesPerBatch*setSampleEvery//linesPerRequest)
+
+        cache = SetAssociativeCache(numXCDs, numSampledSets, self.GPU.L2Ways, policy)
+        # Requests the fully associative tile-level L2 serves; their line misses are conflict misses
+        tileHit = np.ones(len(trace), dtype=bool)
+        for misses in self.l2MissStreams(trace, policy, workers=1):
+            tileHit[misses] = False
+
+        lineRequests = 0
+        setMisses = np.zeros(numXCDs*numSampledSets, dtype=np.int64)
+        setConflicts = np.zeros(numXCDs*numSampledSets, dtype=np.int64)
+        channelRequests = np.zeros((numXCDs, numChannels), dtype=np.int64)
+        for first in range(0, len(trace), batchRequests):
+            requests = np.arange(first, min(first + batchRequests, len(trace)))
+            # Lines of every distinct tile of the batch row by row, padded with -1, and their channels and sets;
+            # requests then gather the sampled ones in issue order
+            tiles, firstRequest, tileOfRequest = np.unique(trace.tileID[requests], return_index=True, return_inverse=True)
+            tileLines = np.full((len(tiles), linesPerRequest), -1, dtype=np.int64)
+            for operand, (numRows, rowStride, rowBytes) in layout.items():
+                selected = np.flatnonzero(trace.operand[requests[firstRequest]] == operand)
+                rowStart = base[requests[firstRequest[selected]]][:, None] + np.arange(numRows)*rowStride
+                span = (rowStart//lineBytes)[..., None] + np.arange(spans[operand])
+                span[span > ((rowStart + rowBytes - 1)//lineBytes)[..., None]] = -1
+                tileLines[selected, :numRows*spans[operand]] = span.reshape(len(selected), numRows*spans[operand])
+            tileValid = tileLines >= 0
+            tileLineAddr = tileLines[tileValid]
+            tileOfLine = np.repeat(np.arange(len(tiles)), tileValid.sum(axis=1))
+            tileChannel, tileSet = self.GPU.L2Location(tileLineAddr*lineBytes)
+            # Channel requests of every line: per-tile channel histograms weighted by each XCD's requests of the tile
+            tileChannels = np.bincount(tileOfLine*numChannels + tileChannel, minlength=len(tiles)*numChannels).reshape(len(tiles), numChannels)
+            xcdTiles = np.bincount(trace.xcd[requests].astype(np.int64)*len(tiles) + tileOfRequest, minlength=numXCDs*len(tiles)).reshape(numXCDs, len(tiles))
+            channelRequests += xcdTiles @ tileChannels
+            sampled = tileSet % setSampleEvery == 0
+            tileLineAddr = tileLineAddr[sampled]
+            tileSet = tileSet[sampled]//setSampleEvery
+            tileFirst = np.r_[0, np.cumsum(np.bincount(tileOfLine[sampled], minlength=len(tiles)))]
+            # Flat line index of every request's sampled lines, in issue order
+            lineCounts = np.diff(tileFirst)[tileOfRequest]
+            lineIndex = np.repeat(tileFirst[tileOfRequest] - np.r_[0, np.cumsum(lineCounts)[:-1]], lineCounts) + np.arange(lineCounts.sum())
+            lineAddr = tileLineAddr[lineIndex]
+            setIndex = tileSet[lineIndex]
+            request = np.repeat(requests, lineCounts)
+            xcd = trace.xcd[request].astype(np.int64)
+            miss = ~cache.access(xcd, setIndex, lineAddr)
+            globalSet = xcd*numSampledSets + setIndex
+            setMisses += np.bincount(globalSet[miss], minlength=numXCDs*numSampledSets)
+            setConflicts += np.bincount(globalSet[miss & tileHit[request]], minlength=numXCDs*numSampledSets)
+            lineRequests += len(lineAddr)
+
+        # Back to every set's own index, unsampled sets left at zero
+        allSetMisses = np.zeros((numXCDs, numSets), dtype=np.int64)
+        allSetConflicts = np.zeros((numXCDs, numSets), dtype=np.int64)
+        allSetMisses[:, ::setSampleEvery] = setMisses.reshape(numXCDs, numSampledSets)
+        allSetConflicts[:, ::setSampleEvery] = setConflicts.reshape(numXCDs, numSampledSets)
+        result = SetAssociativeResult(lineRequests, allSetMisses, allSetConflicts, channelRequests, setSampleEvery)
+        imbalance = result.channelImbalance()
+        if imbalance.max() >= 2:
+            logging.warning('L2 channel imbalance: busiest channel sees %.1fx the mean line requests on XCD %d (%s hash, row stride %d bytes)'%(
+                imbalance.max(), imbalance.argmax(), self.GPU.L2Hash, layout[AccessTrace.A][1]))
+        return result
+
+    def simulate(self, debug=False, policy=None, trace=None, engine='serial', workers=None, instrumentation=None):
+        # A tiles are charged ATileBytes and B tiles BTileBytes in both L2 and MALL.
+        # engine='parallel' runs the per-XCD L2s in worker processes and merges their misses into the MALL,
+        # with results identical to the serial engine. engine='steady' skips kSlices once the caches repeat.
+        # instrumentation (an Instrumentation) receives per-(XCD, wave, kSlice) counters; when it needs evictions,
+        # events or hooks the serial engine replays the trace on the instrumented loop. debug prints every request.
+        trace = self.trace if trace is None else trace
+        if engine == 'steady' and trace.time is not None:
+            raise ValueError("engine='steady' relies on the lockstep trace layout, replay event-driven traces with 'serial' or 'parallel'")
+        if engine == 'steady' and trace.write is not None:
+            raise ValueError("engine='steady' relies on data-parallel kSlices, replay '%s' traces with 'serial' or 'parallel'"%self.decomposition)
+        workGroupsPerWave = self.GPU.numCUs*self.workGroupsPerCU
+        printHook = None
         if debug:
+            instrumentation = instrumentation or Instrumentation()
+            # Attached for this call only, so the caller's instrumentation does not keep printing
+            printHook = instrumentation.attach(self.printRequest(trace))
             print('MxNxK: %dx%dx%d; MT0xMT1xDU: %dx%dx%d'%(self.M, self.N, self.K, self.MT0, self.MT1, self.DU))
-            print('numWorkGroups: %d; numWaves: %f; numFullWaves: %d; partialWave: %r'%(numWorkGroups, numWaves, numFullWaves, partialWave))
-            print('workGroupsPerFullWave: %d; workGroupsPerPartialWave: %d'%(workGroupsPerFullWave, workGroupsPerPartialWave))
-
-        clk = 0
-
-        for wave in range(numFullWaves):
-            for kSlice in range(self.KOverDU):
-                for wgNumWithinFullWave in range(workGroupsPerFullWave):
-                    linearWG = wave*workGroupsPerFullWave + wgNumWithinFullWave
-                    n = linearWG//self.MOverMT0
-                    m = linearWG%self.MOverMT0
-                    wg = self.workGroups[(m,n)]
-                    ATile_str = 'A(%d,%d)'%(wg.new_m, kSlice)
-                    BTile_str = 'B(%d,%d)'%(kSlice, wg.new_n)
-                    numRequests += 2
-                    A_addr = int(wg.new_m*self.MT0*self.K*self.elemSize + kSlice*self.DU*self.elemSize)
-                    B_addr = int(wg.new_n*self.MT1*self.K*self.elemSize + kSlice*self.DU*self.elemSize)
-                    if debug:
-                        print('%d - (%d,%d) -> (%d,%d) on xcd %d cu %d'%(clk, wg.m, wg.n, wg.new_m, wg.new_n, wg.xcd, wg.cu))
-
-                    if debug:
-                        print('%d: (%d,%d) - Requesting %s'%(clk,  wg.new_m, wg.new_n, ATile_str))
-
-                    if ATile_str not in L2[wg.xcd].keys():
-
-                        if debug:
-                            print('%d: (%d,%d) - %s not found in L2[%d]'%(clk,  wg.new_m, wg.new_n, ATile_str, wg.xcd))
-                            print('%d: (%d,%d) - L2[%d] %d bytes used of %d bytes'%(clk,  wg.new_m, wg.new_n, wg.xcd, L2Usage[wg.xcd], self.GPU.L2BytesPerXCD))
-
-                        if L2Usage[wg.xcd] + self.ATileBytes >=self.GPU.L2BytesPerXCD:
-
-                            if debug:
-                                print('%d: (%d,%d) - L2[%d] eviction required'%(clk,  wg.new_m, wg.new_n, wg.xcd))
-
-                            lru_entry = min(L2[wg.xcd], key=L2[wg.xcd].get)
-                            lru_clk = L2[wg.xcd].pop(lru_entry, None)
-                            L2Usage[wg.xcd] -= self.ATileBytes
-
-                            if debug:
-                                print('%d: (%d,%d) - Evicting %s from L2[%d] since it was last used on clk %d'%(clk,  wg.new_m, wg.new_n, lru_entry, wg.xcd, lru_clk))
-                                print('%d: (%d,%d) - L2[%d] %d bytes used of %d bytes'%(clk,  wg.new_m, wg.new_n, wg.xcd, L2Usage[wg.xcd], self.GPU.L2BytesPerXCD))
-                        
-                        set_num = A_addr>>12 & 0xff
-                        channel_num = A_addr>>7 & 0xf
-                        L2[wg.xcd].update({ATile_str: clk})
-                        L2Usage[wg.xcd] += self.ATileBytes
-
-                        if debug:
-                            print('%d: (%d,%d) - Fetched %d bytes of %s into L2[%d]'%(clk,  wg.new_m, wg.new_n, self.ATileBytes, ATile_str, wg.xcd))
-                            print('%d: (%d,%d) - L2[%d] %d bytes used of %d bytes'%(clk,  wg.new_m, wg.new_n, wg.xcd, L2Usage[wg.xcd], self.GPU.L2BytesPerXCD))
-
-                        if ATile_str not in MALL.keys():
-
-                            if debug:
-                                print('%d: (%d,%d) - %s not found in MALL'%(clk,  wg.new_m, wg.new_n, ATile_str))
-                                print('%d: (%d,%d) - MALL %d bytes used of %d bytes'%(clk,  wg.new_m, wg.new_n, MALLUsage, self.GPU.MALLBytes))
-
-                            if MALLUsage + self.ATileBytes >= self.GPU.MALLBytes:
-
-                                if debug:
-                                    print('%d: (%d,%d) - MALL eviction required'%(clk,  wg.new_m, wg.new_n))
-
-                                lru_entry = min(MALL, key=MALL.get)
-                                lru_clk = MALL.pop(lru_entry, None)
-                                MALLUsage -= self.ATileBytes
-
-                                if debug:
-                                    print('%d: (%d,%d) - Evicting %s from MALL since it was last used on clk %d'%(clk,  wg.new_m, wg.new_n, lru_entry, wg.xcd, lru_clk))
-                                    print('%d: (%d,%d) - MALL %d bytes used of %d bytes'%(clk,  wg.new_m, wg.new_n, wg.xcd, MALLUsage, self.GPU.MALLBytes))
-
-                            MALL.update({ATile_str: clk})
-                            MALLUsage += self.ATileBytes
-
-                            if debug:
-                                print('%d: (%d,%d) - Fetched %d bytes of %s into MALL'%(clk,  wg.new_m, wg.new_n, self.ATileBytes, ATile_str))
-                                print('%d: (%d,%d) - MALL %d bytes used of %d bytes'%(clk,  wg.new_m, wg.new_n, MALLUsage, self.GPU.MALLBytes))
-
-                            hbmHits += 1
-
-                            if debug:
-                                print('%d: (%d,%d) - Fetched %d bytes of %s from HBM'%(clk,  wg.new_m, wg.new_n, self.ATileBytes, ATile_str))
-
-                        else:
-                            MALL[ATile_str] = clk
-                            mallHits += 1
-
-                            if debug:
-                                print('%d: (%d,%d) - Fetched %d bytes of %s from MALL'%(clk,  wg.new_m, wg.new_n, self.ATileBytes, ATile_str))
-
-                    else:
-                        L2[wg.xcd][ATile_str] = clk
-                        l2Hits += 1
-
-                        if debug:
-                            print('%d: (%d,%d) - Fetched %d bytes of %s from L2[%d]'%(clk,  wg.new_m, wg.new_n, self.ATileBytes, ATile_str, wg.xcd))
-
-                    if debug:
-                        print('numRequests: %d; L2Hits: %d; MALLHits: %d; HBMHits: %d'%(numRequests, l2Hits, mallHits, hbmHits))
-
-                    clk += 1
-
-                    if BTile_str not in L2[wg.xcd].keys():
-                        if L2Usage[wg.xcd] + self.ATileBytes >= self.GPU.L2BytesPerXCD:
-                            lru_entry = min(L2[wg.xcd], key=L2[wg.xcd].get)
-                            lru_clk = L2[wg.xcd].pop(lru_entry, None)
-                            L2Usage[wg.xcd] -= self.ATileBytes
-                            if debug:
-                                print('Removing entry %s from L2 since it was last used on clk %d'%(lru_entry, lru_clk))
-                        L2[wg.xcd].update({BTile_str: clk})
-                        L2Usage[wg.xcd] += self.ATileBytes
-                        if BTile_str not in MALL.keys():
-                            if MALLUsage + self.ATileBytes >= self.GPU.MALLBytes:
-                                lru_entry = min(MALL, key=MALL.get)
-                                lru_clk = MALL.pop(lru_entry, None)
-                                MALLUsage -= self.ATileBytes
-                                if debug:
-                                    print('Removing entry %s from MALL since it was last used on clk %d'%(lru_entry, lru_clk))
-                            MALL.update({BTile_str: clk})
-                            MALLUsage += self.ATileBytes
-                            hbmHits += 1
-                        else:
-                            MALL[BTile_str] = clk
-                            mallHits += 1
-                    else:
-                        L2[wg.xcd][BTile_str] = clk
-                        l2Hits += 1
-                    
-                    clk += 1
-
-                    if debug:
-                        print('numRequests: %d; L2Hits: %d; MALLHits: %d; HBMHits: %d'%(numRequests, l2Hits, mallHits, hbmHits))        
-                        if pause:
-                            yn = input('Pause? (y/n)')
-                            if yn.lower()[0] == 'y':
-                                pdb.set_trace()
-
-        if partialWave:
-            for kSlice in range(self.KOverDU):
-                for wgNumWithinPartialWave in range(workGroupsPerPartialWave):
-                    linearWG = numFullWaves*workGroupsPerFullWave + wgNumWithinPartialWave
-                    n = linearWG//self.MOverMT0
-                    m = linearWG%self.MOverMT0
-                    wg = self.workGroups[(m,n)]
-                    ATile_str = 'A(%d,%d)'%(wg.new_m, kSlice)
-                    BTile_str = 'B(%d,%d)'%(kSlice, wg.new_n)
-                    numRequests += 2
-
-                    if ATile_str not in L2[wg.xcd].keys():
-                        if L2Usage[wg.xcd] + self.ATileBytes >= self.GPU.L2BytesPerXCD:
-                            lru_entry = min(L2[wg.xcd], key=L2[wg.xcd].get)
-                            L2[wg.xcd].pop(lru_entry, None)
-                            L2Usage[wg.xcd] -= self.ATileBytes
-                        L2[wg.xcd].update({ATile_str: clk})
-                        L2Usage[wg.xcd] += self.ATileBytes
-                        L2[wg.xcd].update({ATile_str: clk})
-                        L2Usage[wg.xcd] += self.ATileBytes
-                        if ATile_str not in MALL.keys():
-                            if MALLUsage + self.ATileBytes >= self.GPU.MALLBytes:
-                                #MALL.pop(0)
-                                #MALLUsage -= self.ATileBytes
-                                lru_entry = min(MALL, key=MALL.get)
-                                lru_clk = MALL.pop(lru_entry, None)
-                                MALLUsage -= self.ATileBytes
-                            MALL.update({ATile_str: clk})
-                            MALLUsage += self.ATileBytes
-                            hbmHits += 1
-                        else:
-                            mallHits += 1
-                    else:
-                        l2Hits += 1
-                    
-                    clk += 1
-
-                    if BTile_str not in L2[wg.xcd].keys():
-                        if L2Usage[wg.xcd] + self.ATileBytes >= self.GPU.L2BytesPerXCD:
-                            lru_entry = min(L2[wg.xcd], key=L2[wg.xcd].get)
-                            lru_clk = L2[wg.xcd].pop(lru_entry, None)
-                            L2Usage[wg.xcd] -= self.ATileBytes
-                            if debug:
-                                print('Removing entry %s from L2 since it was last used on clk %d'%(lru_entry, lru_clk))
-                        L2[wg.xcd].update({BTile_str: clk})
-                        L2Usage[wg.xcd] += self.ATileBytes
-                        if BTile_str not in MALL.keys():
-                            if MALLUsage + self.ATileBytes >= self.GPU.MALLBytes:
-                                lru_entry = min(MALL, key=MALL.get)
-                                lru_clk = MALL.pop(lru_entry, None)
-                                MALLUsage -= self.ATileBytes
-                                if debug:
-                                    print('Removing entry %s from MALL since it was last used on clk %d'%(lru_entry, lru_clk))
-                            MALL.update({BTile_str: clk})
-                            MALLUsage += self.ATileBytes
-                            hbmHits += 1
-                        else:
-                            MALL[BTile_str] = clk
-                            mallHits += 1
-                    else:
-                        L2[wg.xcd][BTile_str] = clk
-                        l2Hits += 1
-                    
-                    clk += 1
-
-        assert (l2Hits + mallHits + hbmHits)/numRequests == 1
-        return l2Hits/numRequests, mallHits/numRequests, hbmHits/numRequests
+            print('numWorkGroups: %d; numRequests: %d'%(self.MOverMT0*self.NOverMT1, len(trace)))
+        try:
+            if instrumentation is not None and instrumentation.perRequest():
+                # Collects the counters itself, with evictions
+                result = self.replayInstrumented(trace, CacheHierarchy(self.GPU, policy, granule=min(self.ATileBytes, self.BTileBytes)), instrumentation)
+            else:
+                if engine == 'steady':
+                    result = self.simulateSteadyState(trace, policy)
+                elif engine == 'parallel':
+                    result = self.simulateParallel(trace, policy, workers)
+                else:
+                    result = trace.replay(CacheHierarchy(self.GPU, policy, granule=min(self.ATileBytes, self.BTileBytes)))
+                if instrumentation is not None:
+                    instrumentation.collect(trace, result.levels, workGroupsPerWave)
+        finally:
+            if printHook is not None:
+                instrumentation.hooks.remove(printHook)
+        if debug:
+            print('numRequests: %d; L2Hits: %d; MALLHits: %d; HBMHits: %d'%(result.numRequests, *result.levelRequests))
+        return result
+
+    def replayInstrumented(self, trace, hierarchy, instrumentation):
+        # Serial replay that also counts the evictions each request causes into the preallocated counters, logs
+        # sampled events and calls hooks
+        access = hierarchy.access
+        L2 = hierarchy.L2
+        MALL = hierarchy.MALL
+        hooks = instrumentation.hooks
+        numRequests = len(trace)
+        cells = instrumentation.allocate(trace, self.GPU.numCUs*self.workGroupsPerCU, instrumentation.evictions)
+        levels = np.empty(numRequests, dtype=np.int8)
+        # Per-request eviction counts are kept only for the event log
+        sampleEvery = instrumentation.sampleEvery
+        l2Evictions = np.zeros(numRequests if sampleEvery else 0, dtype=np.int16)
+        mallEvictions = np.zeros(numRequests if sampleEvery else 0, dtype=np.int16)
+        l2Counts = None if instrumentation.l2Evictions is None else instrumentation.l2Evictions.reshape(-1)
+        mallCounts = None if instrumentation.mallEvictions is None else instrumentation.mallEvictions.reshape(-1)
+        for clk, (xcd, tileID, numBytes, cell) in enumerate(zip(trace.xcd.tolist(), trace.tileID.tolist(), trace.numBytes.tolist(), cells.tolist())):
+            l2Before = L2[xcd].evictions
+            mallBefore = MALL.evictions
+            level = access(xcd, tileID, numBytes)
+            levels[clk] = level
+            l2Evicted = L2[xcd].evictions - l2Before
+            mallEvicted = MALL.evictions - mallBefore
+            if l2Evicted or mallEvicted:
+                if l2Counts is not None:
+                    l2Counts[cell] += l2Evicted
+                    mallCounts[cell] += mallEvicted
+                if sampleEvery:
+                    l2Evictions[clk] = l2Evicted
+                    mallEvictions[clk] = mallEvicted
+            for hook in hooks:
+                hook(clk, xcd, tileID, level, l2Evicted, mallEvicted)
+        if sampleEvery:
+            clks, numSampled = instrumentation.sampledRequests(numRequests)
+            instrumentation.recordEvents(trace, clks, levels, l2Evictions, mallEvictions, numSampled)
+        instrumentation.levelCounts.reshape(-1)[:] = np.bincount(cells*3 + levels, minlength=instrumentation.levelCounts.size)
+        return SimulationResult.fromLevels(levels, trace.numBytes, trace.write)
+
+    def printRequest(self, trace):
+        # Hook printing one line per request, the former debug output
+        def hook(clk, xcd, tileID, level, l2Evictions, mallEvictions):
+            if trace.operand[clk] == AccessTrace.C:
+                tile = '%s partial C of tile %d'%('write' if trace.write[clk] else 'read', trace.tile[clk])
+            else:
+                operand, index, kSlice = trace.decodeTile(tileID)
+                tile = 'A(%d,%d)'%(index, kSlice) if operand == AccessTrace.A else 'B(%d,%d)'%(kSlice, index)
+            print('%d: wg %d xcd %d - %s from %s'%(clk, trace.wg[clk], xcd, tile, CacheHierarchy.levelNames[level]))
+        return hook
 
     def printWorkGroups(self):
         for x in range(self.MOverMT0):
@@ -515,98 +1918,105 @@ class WorkGroupMapping:
             line += '\n'
             print(line)
 
-    def plotWorkGroups(self, plot_launch_order=True, full_annotation=False):
-        fig, ax = plt.subplots(figsize=(2*self.NOverMT1, 2*self.MOverMT0))
-        plt.tick_params(left = False, right = False, labelleft = False, labelbottom = False, bottom = False)
-        for x in range(self.MOverMT0):
-            for y in range(self.NOverMT1):
-                wg_tup = (x,y)
-                wg = self.workGroups[wg_tup]
-                ax.add_patch(wg.rect)
-                rx, ry = wg.rect.get_xy()
-                cx = rx + wg.rect.get_width()/2.0
-                cy = ry + wg.rect.get_height()/2.0
-                if full_annotation:
-                    ax.annotate('%d,%d -> %d,%d'%(wg.m, wg.n,wg.new_m,wg.new_n), (cx, cy), color='k', fontsize=8, ha='center', va='center')
-                else:
-                    ax.annotate('%d,%d\nXCD%d CU%d'%(wg.m,wg.n, wg.xcd, wg.cu), (cx, cy), color='k', fontsize=8, ha='center', va='center')
-        if plot_launch_order:
-            Ctr = 0
-            for y in range(self.NOverMT1):
-                for x in range(self.MOverMT0):
-                    wg_tup = (x,y)
-                    wg = self.workGroups[wg_tup]
-                    rx, ry = wg.rect.get_xy()
-                    cx = rx + wg.rect.get_width()/2.0
-                    cy = ry + wg.rect.get_height()/2.0
-                    if Ctr == 0:
-                        cx_begin = cx
-                        cy_begin = cy
-                        if not (x == 0 and y == 0):
-                            cx_dot_len = cx - cx_dot_begin
-                            cy_dot_len = cy - cy_dot_begin
-                            plt.arrow(cx_dot_begin, cy_dot_begin, cx_dot_len, cy_dot_len, length_includes_head=True, linestyle='--', width=0.005, alpha=0.25, zorder=5)
-                    if Ctr == self.MOverMT0 - 1 or (x == self.MOverMT0 - 1 and y == self.NOverMT1 - 1):
-                        cx_len = cx - cx_begin
-                        cy_len = cy - cy_begin
-                        cx_dot_begin = cx
-                        cy_dot_begin = cy
-                        plt.arrow(cx_begin, cy_begin, cx_len, cy_len, length_includes_head=True, width=0.005, alpha=0.25, zorder=5)
-                    Ctr = (Ctr + 1)%self.MOverMT0
-        plt.xlim(0,0.1*self.NOverMT1)
-        plt.ylim(0,0.1*self.MOverMT0)
-
-    def plotNewWorkGroups(self, saveFig=False, figureTag=None, plot_launch_order=True, full_annotation=False):
-        fig, ax = plt.subplots(figsize=(2*self.NOverMT1, 2*self.MOverMT0))
-        plt.tick_params(left = False, right = False, labelleft = False, labelbottom = False, bottom = False)
-        for wg_tup, wg in self.newWorkGroups.items():
-                ax.add_patch(wg.new_rect)
-                rx, ry = wg.new_rect.get_xy()
-                cx = rx + wg.new_rect.get_width()/2.0
-                cy = ry + wg.new_rect.get_height()/2.0
-                if full_annotation:
-                    if self.customWGM:
-                        ax.annotate('%d,%d -> %d,%d\nXCD%d CU%d\nwgID %d -> %d'%(wg.m, wg.n,wg.new_m, wg.new_n, wg.xcd, wg.cu, wg.extras['wgID'], wg.extras['wgIDDechunked']), (cx, cy), color='k', fontsize=8, ha='center', va='center')
-                    else:
-                        ax.annotate('%d,%d -> %d,%d\nXCD%d CU%d\n%d;%d\n%d,%d'%(wg.m, wg.n, wg.new_m, wg.new_n, wg.xcd, wg.cu, wg.extras['wgSet'], wg.extras['wgSerial'], wg.extras['X'], wg.extras['Y']), (cx, cy), color='k', fontsize=8, ha='center', va='center')
-                else:
-                    ax.annotate('%d,%d\nXCD%d CU%d'%(wg.new_m,wg.new_n, wg.xcd, wg.cu), (cx, cy), color='k', fontsize=8, ha='center', va='center')
-        if plot_launch_order:
-            WGMCtr = 0
-            for y in range(self.NOverMT1):
-                for x in range(self.MOverMT0):
-                    wg_tup = (x,y)
-                    wg = self.workGroups[wg_tup]
-                    rx, ry = wg.new_rect.get_xy()
-                    cx = rx + wg.new_rect.get_width()/2.0
-                    cy = ry + wg.new_rect.get_height()/2.0
-                    if WGMCtr == 0:
-                        cx_begin = cx
-                        cy_begin = cy
-                        if not (x == 0 and y == 0):
-                            cx_dot_len = cx - cx_dot_begin
-                            cy_dot_len = cy - cy_dot_begin
-                            plt.arrow(cx_dot_begin, cy_dot_begin, cx_dot_len, cy_dot_len, length_includes_head=True, linestyle='--', width=0.005, alpha=0.25, zorder=5)
-                    if WGMCtr == self.WGM - 1 or (x == self.MOverMT0 - 1 and y == self.NOverMT1 - 1):
-                        cx_len = cx - cx_begin
-                        cy_len = cy - cy_begin
-                        cx_dot_begin = cx
-                        cy_dot_begin = cy
-                        plt.arrow(cx_begin, cy_begin, cx_len, cy_len, length_includes_head=True, width=0.005, alpha=0.25, zorder=5)
-                    WGMCtr = (WGMCtr + 1)%self.WGM
-        plt.xlim(0,0.1*self.NOverMT1)
-        plt.ylim(0,0.1*self.MOverMT0)
-        if saveFig:
-            figureName = '%dx%dx%d_HHS_NN_%dx%dx%d_WGM%d'%(self.M, self.N, self.K, self.MT0, self.MT1, self.DU, self.WGM)
-            if figureTag is not None:
-                figureName += '_%s'%(figureTag)
-            figureName += '.png'
-            
-            plt.savefig(figureName, transparent=True, dpi=300, format='png')
-
+    def plotWorkGroups(self, plot_launch_order=True, full_annotation=False, raster=None):
+        from wgm_plot import plotWorkGroups
+        return plotWorkGroups(self, plot_launch_order, full_annotation, raster)
+
+    def plotNewWorkGroups(self, saveFig=False, figureTag=None, plot_launch_order=True, full_annotation=False, raster=None):
+        from wgm_plot import plotNewWorkGroups
+        return plotNewWorkGroups(self, saveFig, figureTag, plot_launch_order, full_annotation, raster)
+
+    def plotTileMaps(self, layout='new', result=None, hitCounts=True, maxInches=16.0, maxPixels=1024, annotateLimit=256, saveFig=False, figureTag=None):
+        from wgm_plot import plotTileMaps
+        return plotTileMaps(self, layout, result, hitCounts, maxInches, maxPixels, annotateLimit, saveFig, figureTag)
+
+def parseProblem(text):
+    M, N, K, *elemSize = text.split(',')
+    return int(M), int(N), int(K), float(elemSize[0]) if elemSize else 0.5
+
+def addShapeArguments(parser):
+    parser.add_argument('--problem', type=parseProblem, default=(128, 106496, 8192*2, 0.5), help='M,N,K[,elemSize]')
+    parser.add_argument('--MT0', type=int, default=64)
+    parser.add_argument('--MT1', type=int, default=512)
+    parser.add_argument('--DU', type=int, default=512)
+    parser.add_argument('--WGM', type=int, default=16)
+    parser.add_argument('--mapping', default=None, help='registered remap name (default: WGM remap, identity for WGM 0)')
+    parser.add_argument('--workGroupsPerCU', type=int, default=1)
+    parser.add_argument('--decomposition', choices=WorkDecomposition.kinds, default='data-parallel')
+    parser.add_argument('--splitK', type=int, default=1, help='kSlice splits per tile with --decomposition split-k')
+    parser.add_argument('--streamKWorkGroups', type=int, default=None, help='persistent workgroups with --decomposition stream-k (default: one wave)')
+
+def buildMapping(args, verbose=False):
+    M, N, K, elemSize = args.problem
+    return WorkGroupMapping(M=M, N=N, K=K, WGM=args.WGM, GPU=gfx9(), MT0=args.MT0, MT1=args.MT1, DU=args.DU, workGroupsPerCU=args.workGroupsPerCU,
+                            elemSize=elemSize, verbose=verbose, mapping=args.mapping, decomposition=args.decomposition, splitK=args.splitK,
+                            streamKWorkGroups=args.streamKWorkGroups)
+
+def runSimulate(args):
+    wgm = buildMapping(args)
+    result = wgm.simulate(policy=args.policy, engine=args.engine) if args.policy or args.engine != 'serial' else wgm.result
+    print('hit-rate(l2,mall,hbm) (%.4f, %.4f, %.4f)'%result.hitRates())
+    print('bytes(l2,mall,hbm) (%.0f, %.0f, %.0f)'%tuple(result.levelBytes))
+    if args.performance:
+        performance = wgm.getPerformance(result)
+        print('predicted %.1f us, %s-bound, %.1f TFLOPS, wave efficiency %.4f'%(performance.time*1e6, performance.boundBy, performance.achievedFLOPS/1e12, performance.waveEfficiency))
+    if args.compare_decompositions:
+        for row in wgm.compareDecompositions():
+            print('%-14s %6d WGs  hit-rate(l2,mall,hbm) (%.4f, %.4f, %.4f)  HBM %8.1f MiB  partials %8.1f MiB  efficiency %.4f  %8.1f us  %s-bound'%(
+                row['decomposition'], row['numWorkGroups'], *row['hitRates'], (row['hbmBytes'] + row['writeBytes'])/2**20,
+                row['partialBytes']/2**20, row['waveEfficiency'], row['time']*1e6, row['boundBy']))
+
+def runPlot(args):
+    import matplotlib
+    matplotlib.use('Agg')
+    wgm = buildMapping(args)
+    if args.layout == 'launch':
+        fig = wgm.plotWorkGroups(raster=args.raster)
+    elif args.layout == 'tiles':
+        fig = wgm.plotTileMaps()
+    else:
+        fig = wgm.plotNewWorkGroups(raster=args.raster)
+    import matplotlib.pyplot as plt
+    (fig or plt.gcf()).savefig(args.out, dpi=args.dpi)
+    print(args.out)
+
+def runSweepCommand(args, rest):
+    import argparse
+    from wgm_sweep import addSweepArguments, runSweep
+    parser = argparse.ArgumentParser(prog='wgm_util sweep', description='Sweep tile sizes and WGM over GEMM problems')
+    addSweepArguments(parser)
+    runSweep(parser.parse_args(rest))
+
+def main(argv=None):
+    # python -m wgm_util simulate|sweep|plot; plotting and sweep modules load only for their commands
+    import argparse
+    parser = argparse.ArgumentParser(prog='wgm_util', description='L2/MALL utilization of GEMM workgroup mappings on gfx9')
+    commands = parser.add_subparsers(dest='command', required=True)
+    simulate = commands.add_parser('simulate', help='simulate one GEMM shape and mapping')
+    addShapeArguments(simulate)
+    simulate.add_argument('--engine', choices=('serial', 'parallel', 'steady'), default='serial')
+    simulate.add_argument('--policy', default=None, help='replacement policy (default: the gfx9 cachePolicy)')
+    simulate.add_argument('--performance', action='store_true', help='also print the predicted time')
+    simulate.add_argument('--compare-decompositions', action='store_true', help='also compare data-parallel, split-K and Stream-K')
+    simulate.set_defaults(run=runSimulate)
+    plot = commands.add_parser('plot', help='plot one GEMM shape and mapping to an image file')
+    addShapeArguments(plot)
+    plot.add_argument('--layout', choices=('new', 'launch', 'tiles'), default='new', help='remapped tiles, launch grid, or the raster tile maps with hit counts')
+    plot.add_argument('--raster', action='store_true', default=None, help='force the raster renderer')
+    plot.add_argument('--out', default='workgroups.png')
+    plot.add_argument('--dpi', type=int, default=100)
+    plot.set_defaults(run=runPlot)
+    # The sweep options (and the sweep module) are only loaded for the sweep command, which parses the rest itself
+    commands.add_parser('sweep', add_help=False, help='sweep tile sizes and WGM over GEMM problems, see sweep --help')
+    args, rest = parser.parse_known_args(argv)
+    if args.command == 'sweep':
+        runSweepCommand(args, rest)
+    elif rest:
+        parser.error('unrecognized arguments: %s'%' '.join(rest))
+    elif args.command == 'simulate' and args.engine == 'steady' and args.decomposition != 'data-parallel':
+        parser.error("--engine steady needs data-parallel kSlices, use --engine serial or parallel with --decomposition %s"%args.decomposition)
+    else:
+        args.run(args)
 
 if __name__ == '__main__':
-
-    gpu = gfx9();
-    Wgm = WorkGroupMapping(M=128,N=106496,K=8192*2,MT0=64,MT1=512,DU=512,WGM=16,GPU=gpu,customWGM=False)
-    Wgm = WorkGroupMapping(M=128,N=106496,K=8192*2,MT0=128,MT1=512,DU=512,WGM=32,GPU=gpu,customWGM=False)
+    main()